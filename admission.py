@@ -0,0 +1,231 @@
+"""
+Admission control for Ani v0
+Caps concurrent websocket sessions and the number of turns allowed into each
+heavy stage (STT, LLM, TTS). A turn that would have to queue behind a full
+stage is shed immediately with a pre-synthesized "busy" clip, so latency for
+admitted users stays flat under overload instead of every turn timing out.
+"""
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from text_utils import detect_language
+
+
+BUSY_TEXT = {
+    "zh": "现在找我聊天的人有点多，稍等一下再和我说吧~",
+    "en": "I'm a little busy right now, talk to me again in a moment!",
+}
+
+
+class Overloaded(RuntimeError):
+    """Raised when a stage is at capacity and the request should be shed"""
+
+    def __init__(self, stage: str):
+        super().__init__(f"{stage} at capacity")
+        self.stage = stage
+
+
+@dataclass
+class AdmissionConfig:
+    """Capacity limits (per worker process)"""
+    max_sessions: int = 50
+    max_llm_concurrency: int = 8  # LLM calls in flight
+    max_llm_queue: int = 4  # turns allowed to wait for an LLM slot
+    # STT/TTS caps only bound anything because that work yields to the event loop: Whisper
+    # decodes and Coqui synthesis run on their engine's own thread, one at a time (slots
+    # beyond the first wait there). An engine that blocks the loop never lets two turns
+    # hold a slot at once, so its caps would never shed.
+    max_tts_concurrency: int = 4
+    max_tts_queue: int = 8
+    max_stt_concurrency: int = 2
+    max_stt_queue: int = 4
+    max_wait_s: float = 2.0  # a queued turn gives up after this long
+
+    @classmethod
+    def from_env(cls) -> "AdmissionConfig":
+        """Override limits with ANI_MAX_SESSIONS, ANI_MAX_LLM_CONCURRENCY, ANI_MAX_LLM_QUEUE, ..."""
+        config = cls()
+        for name, field_type in (
+            ("max_sessions", int),
+            ("max_llm_concurrency", int), ("max_llm_queue", int),
+            ("max_tts_concurrency", int), ("max_tts_queue", int),
+            ("max_stt_concurrency", int), ("max_stt_queue", int),
+            ("max_wait_s", float),
+        ):
+            raw = os.getenv(f"ANI_{name.upper()}")
+            if raw:
+                try:
+                    setattr(config, name, field_type(raw))
+                except ValueError:
+                    print(f"[WARN] Ignoring invalid ANI_{name.upper()}={raw!r}")
+        return config
+
+
+class StageGate:
+    """Concurrency slots plus a bounded waiting line for one stage"""
+
+    def __init__(self, name: str, concurrency: int, max_queue: int, max_wait_s: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_wait_s = max_wait_s
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        self.timed_out = 0
+        self.skipped = 0  # optional work turned away by try_acquire()
+
+    def saturated(self) -> bool:
+        """True if a new request would be shed right now"""
+        return self.in_flight >= self.concurrency and self.waiting >= self.max_queue
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.saturated():
+            self.shed += 1
+            raise Overloaded(self.name)
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.max_wait_s)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            self.shed += 1
+            raise Overloaded(self.name)
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def try_acquire(self) -> bool:
+        """Take a slot only if one is free right now (optional work: never waits, never queues ahead of turns)"""
+        if self._semaphore.locked():
+            self.skipped += 1
+            return False
+        await self._semaphore.acquire()  # free: returns without suspending
+        self.in_flight += 1
+        self.admitted += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def try_slot(self):
+        """try_acquire() as a context; raises Overloaded (not counted as shed) when no slot is free"""
+        if not await self.try_acquire():
+            raise Overloaded(self.name)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def snapshot(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+            "skipped": self.skipped,
+        }
+
+
+class AdmissionController:
+    """
+    Process-wide admission decisions
+    - open_session()/close_session(): cap on concurrent websocket sessions
+    - admit_turn(): fast check before a turn starts any work
+    - slot(stage): bounded wait for an STT/LLM/TTS slot
+    - try_slot(stage): a free slot or nothing, for optional work (partials, speculation)
+    - busy_clip(): cached TTS audio for the shed response
+    """
+
+    def __init__(self, config: Optional[AdmissionConfig] = None):
+        self.config = config or AdmissionConfig()
+        c = self.config
+        self.gates: Dict[str, StageGate] = {
+            "stt": StageGate("stt", c.max_stt_concurrency, c.max_stt_queue, c.max_wait_s),
+            "llm": StageGate("llm", c.max_llm_concurrency, c.max_llm_queue, c.max_wait_s),
+            "tts": StageGate("tts", c.max_tts_concurrency, c.max_tts_queue, c.max_wait_s),
+        }
+        self.sessions = 0
+        self.sessions_rejected = 0
+        self.turns_shed = 0
+        self.last_shed_at: Optional[float] = None
+        self._busy_clips: Dict[Tuple[str, Optional[int]], dict] = {}
+
+    # Sessions ---------------------------------------------------------------
+
+    def open_session(self) -> bool:
+        if self.sessions >= self.config.max_sessions:
+            self.sessions_rejected += 1
+            return False
+        self.sessions += 1
+        return True
+
+    def close_session(self):
+        self.sessions = max(0, self.sessions - 1)
+
+    # Turns ------------------------------------------------------------------
+
+    def admit_turn(self) -> bool:
+        """Shed up front if any stage the turn needs is already full"""
+        for name in ("llm", "tts"):
+            if self.gates[name].saturated():
+                self.gates[name].shed += 1
+                self.record_shed()
+                return False
+        return True
+
+    def record_shed(self):
+        self.turns_shed += 1
+        self.last_shed_at = time.time()
+
+    def slot(self, stage: str):
+        return self.gates[stage].slot()
+
+    def try_slot(self, stage: str):
+        return self.gates[stage].try_slot()
+
+    # Busy response ----------------------------------------------------------
+
+    async def prepare_busy_clips(self, tts_pipeline, sample_rate: Optional[int] = None):
+        """Synthesize the busy clips once (at startup) so shedding costs no TTS work"""
+        for language, text in BUSY_TEXT.items():
+            try:
+                result = await tts_pipeline.synthesize_with_phonemes(text, sample_rate=sample_rate)
+            except Exception as e:
+                print(f"[WARN] Busy clip ({language}) not cached: {e}")
+                continue
+            self._busy_clips[(language, sample_rate)] = result
+        if self._busy_clips:
+            print(f"[OK] Busy clips cached: {sorted({lang for lang, _ in self._busy_clips})}")
+
+    def busy_clip(self, user_text: str = "", sample_rate: Optional[int] = None) -> Tuple[str, Optional[dict]]:
+        """(text, cached TTS result or None) in the user's language"""
+        language = detect_language(user_text) if user_text else "zh"
+        clip = self._busy_clips.get((language, sample_rate)) or self._busy_clips.get((language, None))
+        return BUSY_TEXT[language], clip
+
+    def snapshot(self) -> dict:
+        return {
+            "sessions": self.sessions,
+            "max_sessions": self.config.max_sessions,
+            "sessions_rejected": self.sessions_rejected,
+            "turns_shed": self.turns_shed,
+            "last_shed_at": self.last_shed_at,
+            "stages": {name: gate.snapshot() for name, gate in self.gates.items()},
+        }
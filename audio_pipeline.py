@@ -4,11 +4,14 @@ Handles VAD (Voice Activity Detection) and STT (Speech-to-Text)
 Target: VAD <150ms, STT <300ms
 """
 import asyncio
+import functools
 import time
 import numpy as np
-from typing import Optional, AsyncGenerator, Callable
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, AsyncGenerator, Awaitable, Callable
 from dataclasses import dataclass
-import torch
+# torch is imported on first model load, not at import time (keeps server startup fast)
 
 
 @dataclass
@@ -19,6 +22,7 @@ class AudioConfig:
     vad_threshold: float = 0.45  # Voice probability threshold (lower = more sensitive)
     min_speech_duration_ms: int = 300  # Minimum speech duration
     min_silence_duration_ms: int = 700  # Silence before speech ends (longer = less cutting)
+    partial_silence_ms: int = 0  # Pause that triggers a partial transcript (0 = no partials)
 
     @property
     def chunk_duration_ms(self) -> float:
@@ -30,14 +34,26 @@ class SileroVAD:
     """
     Silero VAD wrapper
     Target latency: <150ms
+    The model is stateful (recurrent state plus trailing context). Callers that
+    interleave several audio streams pass a stream id, and each stream's state
+    is swapped in before its chunk runs.
     """
+    # Recurrent state attributes of the Silero JIT model (v5: _state/_context, v4: _h/_c)
+    STATE_ATTRS = ("_state", "_context", "_h", "_c", "_last_sr", "_last_batch_size")
+    RECURRENT_ATTRS = (("_state", "_context"), ("_h", "_c"))  # one of these sets must exist
+    MAX_STREAMS = 4096  # least recently used stream states are dropped beyond this
+
     def __init__(self, config: AudioConfig):
         self.config = config
         self.model = None
+        self.torch = None
         self.is_loaded = False
+        self._streams: "OrderedDict[str, dict]" = OrderedDict()  # saved state per inactive stream
+        self._active_stream: Optional[str] = None
+        self._state_attrs: tuple = ()  # STATE_ATTRS present on the loaded model
 
     async def load(self):
-        """Load Silero VAD model"""
+        """Load Silero VAD model (off the event loop)"""
         if self.is_loaded:
             return
 
@@ -45,17 +61,24 @@ class SileroVAD:
         start = time.time()
 
         try:
+            import torch
+            self.torch = torch
+
             # Load Silero VAD from torch hub
-            self.model, utils = torch.hub.load(
-                repo_or_dir='snakers4/silero-vad',
-                model='silero_vad',
-                force_reload=False,
-                onnx=False
+            self.model, utils = await asyncio.get_running_loop().run_in_executor(
+                None,
+                lambda: torch.hub.load(
+                    repo_or_dir='snakers4/silero-vad',
+                    model='silero_vad',
+                    force_reload=False,
+                    onnx=False
+                )
             )
 
             # Extract utility functions
             (get_speech_timestamps, _, read_audio, *_) = utils
             self.get_speech_timestamps = get_speech_timestamps
+            self._check_state_attrs()
 
             self.is_loaded = True
             elapsed = (time.time() - start) * 1000
@@ -65,23 +88,55 @@ class SileroVAD:
             print(f"[FAIL] Failed to load Silero VAD: {e}")
             raise
 
-    def detect_speech(self, audio_chunk: np.ndarray) -> float:
+    def detect_speech(self, audio_chunk: np.ndarray, stream: Optional[str] = None) -> float:
         """
         Detect speech in audio chunk
+        stream: id of the audio stream the chunk belongs to (None: one shared stream)
         Returns: speech probability (0.0-1.0)
         """
         if not self.is_loaded:
             raise RuntimeError("VAD model not loaded")
+        if stream is not None and stream != self._active_stream:
+            self._switch_stream(stream)
 
         # Convert to torch tensor
-        audio_tensor = torch.from_numpy(audio_chunk).float()
+        audio_tensor = self.torch.from_numpy(audio_chunk).float()
 
         # Get speech probability
-        with torch.no_grad():
+        with self.torch.no_grad():
             speech_prob = self.model(audio_tensor, self.config.sample_rate).item()
 
         return speech_prob
 
+    async def detect_speech_async(self, audio_chunk: np.ndarray, stream: Optional[str] = None) -> float:
+        """Same as detect_speech; remote VAD implementations await the model host"""
+        return self.detect_speech(audio_chunk, stream)
+
+    def _check_state_attrs(self):
+        """Per-stream state swaps attributes by name: fail now if this model doesn't have them"""
+        self.model.reset_states()
+        present = tuple(name for name in self.STATE_ATTRS if hasattr(self.model, name))
+        if not any(all(name in present for name in group) for group in self.RECURRENT_ATTRS):
+            raise RuntimeError(
+                f"Silero VAD model has none of the expected state attributes {self.RECURRENT_ATTRS}; "
+                "streams would share recurrent state"
+            )
+        self._state_attrs = present
+
+    def _switch_stream(self, stream: str):
+        """Park the active stream's model state and load `stream`'s (fresh state for a new stream)"""
+        if self._active_stream is not None:
+            self._streams[self._active_stream] = {name: getattr(self.model, name) for name in self._state_attrs}
+            while len(self._streams) > self.MAX_STREAMS:
+                self._streams.popitem(last=False)
+        state = self._streams.pop(stream, None)
+        if state is None:
+            self.model.reset_states()
+        else:
+            for name, value in state.items():
+                setattr(self.model, name, value)
+        self._active_stream = stream
+
     def is_speech(self, speech_prob: float) -> bool:
         """Check if probability exceeds threshold"""
         return speech_prob >= self.config.vad_threshold
@@ -97,9 +152,11 @@ class WhisperSTT:
         self.device = device
         self.model = None
         self.is_loaded = False
+        # Decodes run here, one at a time: VAD, websocket I/O and other sessions keep going meanwhile
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stt")
 
     async def load(self):
-        """Load Faster-Whisper model"""
+        """Load Faster-Whisper model (off the event loop)"""
         if self.is_loaded:
             return
 
@@ -107,6 +164,7 @@ class WhisperSTT:
         start = time.time()
 
         try:
+            import torch
             from faster_whisper import WhisperModel
 
             # Auto-detect device
@@ -114,10 +172,13 @@ class WhisperSTT:
                 self.device = "cuda" if torch.cuda.is_available() else "cpu"
 
             # Load model
-            self.model = WhisperModel(
-                self.model_size,
-                device=self.device,
-                compute_type="float32" if self.device == "cpu" else "float16"
+            self.model = await asyncio.get_running_loop().run_in_executor(
+                None,
+                lambda: WhisperModel(
+                    self.model_size,
+                    device=self.device,
+                    compute_type="float32" if self.device == "cpu" else "float16"
+                )
             )
 
             self.is_loaded = True
@@ -128,16 +189,25 @@ class WhisperSTT:
             print(f"[FAIL] Failed to load Faster-Whisper: {e}")
             raise
 
-    async def transcribe(self, audio: np.ndarray, language: Optional[str] = None) -> str:
+    async def transcribe(self, audio: np.ndarray, language: Optional[str] = None, partial: bool = False) -> str:
         """
-        Transcribe audio to text
+        Transcribe audio to text on the STT thread
+        partial: greedy decode for mid-utterance partials (cheap; the final gets the beam search)
         Returns: transcribed text
         """
+        if not self.is_loaded:
+            raise RuntimeError("STT model not loaded")
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.transcribe_sync, audio, language, partial
+        )
+
+    def transcribe_sync(self, audio: np.ndarray, language: Optional[str] = None, partial: bool = False) -> str:
+        """Blocking decode, for callers already on a worker thread"""
         if not self.is_loaded:
             raise RuntimeError("STT model not loaded")
 
         try:
-            # Transcribe
+            # Transcribe (segments is lazy: decoding happens while collecting them below)
             if language is None:
                 # Let faster-whisper auto-detect language
                 segments, info = self.model.transcribe(
@@ -156,15 +226,15 @@ class WhisperSTT:
             else:
                 # Use initial_prompt to improve Chinese recognition
                 initial_prompt = "以下是普通话的句子。" if language == "zh" else None
+                search = {"beam_size": 1} if partial else {"beam_size": 5, "best_of": 5}  # Better beam search for accuracy
                 segments, info = self.model.transcribe(
                     audio,
                     language=language,
                     task="transcribe",
-                    beam_size=5,  # Better beam search for accuracy
-                    best_of=5,
                     temperature=0.0,
                     vad_filter=False,  # We handle VAD separately
-                    initial_prompt=initial_prompt
+                    initial_prompt=initial_prompt,
+                    **search
                 )
 
             # Collect segments
@@ -196,16 +266,19 @@ class AudioPipeline:
         self.speech_duration = 0
 
     async def load_models(self):
-        """Load VAD and STT models"""
-        await self.vad.load()
-        await self.stt.load()
+        """Load VAD and STT models (in parallel)"""
+        await asyncio.gather(self.vad.load(), self.stt.load())
         print("[OK] Audio pipeline ready")
 
     async def process_audio_stream(
         self,
         audio_generator: AsyncGenerator[bytes, None],
         on_partial: Optional[Callable[[str], None]] = None,
-        on_final: Optional[Callable[[str], None]] = None
+        on_final: Optional[Callable[[str], None]] = None,
+        on_speech_start: Optional[Callable[[], None]] = None,
+        transcribe: Optional[Callable[[np.ndarray, Optional[str]], Awaitable[str]]] = None,
+        transcribe_partial: Optional[Callable[[np.ndarray, Optional[str]], Awaitable[Optional[str]]]] = None,
+        stream: Optional[str] = None
     ):
         """
         Process streaming audio with VAD and STT
@@ -214,7 +287,25 @@ class AudioPipeline:
             audio_generator: Async generator yielding audio bytes
             on_partial: Callback for partial transcriptions
             on_final: Callback for final transcription
+            on_speech_start: Callback when VAD detects the user starting to speak (barge-in)
+            transcribe: Override for self.stt.transcribe (e.g. behind an admission gate)
+            transcribe_partial: Override for partials (default: greedy decode); None from it means
+                "skipped" (the final transcribes)
+            stream: Id of this audio stream (keeps VAD state apart from other connections)
         """
+        if transcribe_partial is None:
+            transcribe_partial = transcribe or functools.partial(self.stt.transcribe, partial=True)
+        transcribe = transcribe or self.stt.transcribe
+        # Partial transcript of the speech so far, taken at a short pause
+        partial_task: Optional[asyncio.Task] = None
+        partial_chunks = 0  # speech chunks covered by partial_task
+
+        async def emit_partial(audio_array: np.ndarray) -> Optional[str]:
+            text = await transcribe_partial(audio_array, language="zh")
+            if on_partial and text:
+                on_partial(text)
+            return text
+
         try:
             async for audio_bytes in audio_generator:
                 # Convert bytes to numpy array
@@ -222,7 +313,7 @@ class AudioPipeline:
 
                 # Measure VAD latency
                 vad_start = time.time()
-                speech_prob = self.vad.detect_speech(audio_chunk)
+                speech_prob = await self.vad.detect_speech_async(audio_chunk, stream)
                 vad_latency = (time.time() - vad_start) * 1000
 
                 is_speech = self.vad.is_speech(speech_prob)
@@ -233,6 +324,8 @@ class AudioPipeline:
                         self.is_speaking = True
                         self.speech_buffer = []
                         print(f"[SPEECH] Started (VAD: {vad_latency:.1f}ms, prob: {speech_prob:.2f})")
+                        if on_speech_start:
+                            on_speech_start()
 
                     self.speech_buffer.append(audio_chunk)
                     self.speech_duration += self.config.chunk_duration_ms
@@ -243,6 +336,16 @@ class AudioPipeline:
                     if self.is_speaking:
                         self.silence_duration += self.config.chunk_duration_ms
 
+                        # Short pause: transcribe what we have so far (once per pause)
+                        if (on_partial and self.config.partial_silence_ms
+                                and self.silence_duration >= self.config.partial_silence_ms
+                                and partial_chunks != len(self.speech_buffer)
+                                and self.speech_duration >= self.config.min_speech_duration_ms):
+                            if partial_task is not None and not partial_task.done():
+                                partial_task.cancel()
+                            partial_chunks = len(self.speech_buffer)
+                            partial_task = asyncio.create_task(emit_partial(np.concatenate(self.speech_buffer)))
+
                         # Check if speech ended
                         if self.silence_duration >= self.config.min_silence_duration_ms:
                             # Speech ended - transcribe
@@ -253,7 +356,15 @@ class AudioPipeline:
 
                                 # Measure STT latency
                                 stt_start = time.time()
-                                text = await self.stt.transcribe(audio_array, language="zh")
+                                if partial_task is not None and partial_chunks == len(self.speech_buffer):
+                                    # No speech since the partial: same audio, reuse its transcript
+                                    text = None if partial_task.cancelled() else await partial_task
+                                    if text is None:
+                                        text = await transcribe(audio_array, language="zh")
+                                else:
+                                    if partial_task is not None and not partial_task.done():
+                                        partial_task.cancel()
+                                    text = await transcribe(audio_array, language="zh")
                                 stt_latency = (time.time() - stt_start) * 1000
 
                                 # Safe print with encoding error handling
@@ -267,6 +378,7 @@ class AudioPipeline:
                                     on_final(text)
 
                             # Reset state
+                            partial_task, partial_chunks = None, 0
                             self.is_speaking = False
                             self.speech_buffer = []
                             self.speech_duration = 0
@@ -275,6 +387,9 @@ class AudioPipeline:
         except Exception as e:
             print(f"[FAIL] Audio pipeline error: {e}")
             raise
+        finally:
+            if partial_task is not None and not partial_task.done():
+                partial_task.cancel()
 
 
 # Testing utilities
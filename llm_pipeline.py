@@ -4,12 +4,29 @@ Supports multiple LLM backends with strict JSON schema enforcement
 Target: <400ms latency
 """
 import asyncio
+import copy
+import functools
 import json
+import random
 import time
-from typing import Optional, Dict, Any
-from dataclasses import dataclass
+from collections import deque
+from typing import Optional, Dict, Any, List, Tuple
+from dataclasses import dataclass, field, replace
 from abc import ABC, abstractmethod
 
+from prompt_assembly import PromptAssembler, PromptComponent
+from resilience import RollingStats
+from singleflight import SingleFlight
+from text_utils import (
+    JSON_OBJECT_RE, JSON_NESTED_OBJECT_RE, JsonFieldScanner, clean_utterance, detect_language, estimate_tokens, has_cjk
+)
+
+# Reply fields that reach the client; a streamed reply can stop once they are all complete
+STOP_FIELDS = ("utterance", "emote", "intent", "gesture")
+
+# Prompt components carrying long-term memories / knowledge-base facts (replies using them aren't cached)
+PERSONAL_COMPONENTS = ("recall", "rag")
+
 
 @dataclass
 class LLMConfig:
@@ -22,22 +39,74 @@ class LLMConfig:
 
     # Ollama-specific
     ollama_host: str = "http://localhost:11434"
+    ollama_keep_alive: str = "30m"  # keep the model resident between turns ("-1" = forever)
+    ollama_use_chat: bool = True  # /api/chat with a stable system prefix (runner reuses its KV cache)
 
     # OpenAI-specific
     openai_api_key: Optional[str] = None
     openai_base_url: str = "https://api.openai.com/v1"
 
+    # Output budget
+    include_plan: bool = False  # also ask for the "plan" object (after the spoken fields); costs output tokens
+    stream_early_stop: bool = True  # stream JSON replies and stop once STOP_FIELDS are complete
+    adaptive_max_tokens: bool = True  # size max_tokens per language from observed reply lengths (max_tokens is the cap)
+    min_max_tokens: int = 64
+
+    # Conversation memory
+    memory_max_tokens: int = 400  # recent-turn window budget; older turns fold into the summary
+    memory_summary_max_tokens: int = 150
+    memory_summarizer: bool = False  # compress folded turns with this LLM in the background
+
+    # Prompt assembly: per-turn context blocks and their budgets
+    prompt_context_tokens: int = 900  # memory + long-term recall + RAG facts together
+    rag_max_tokens: int = 300
+    rag_deadline_ms: float = 80.0  # RAG search runs in a worker thread; a slower one is skipped this turn
+    recall_max_tokens: int = 150
+
+    # Multi-backend routing (backend="router"): first entry is the primary, the rest hedge/fail over
+    router_backends: List[str] = field(default_factory=list)  # e.g. ["anthropic", "ollama"]
+    router_overrides: Dict[str, Dict[str, Any]] = field(default_factory=dict)  # per-backend LLMConfig fields, e.g. {"ollama": {"model": "qwen2.5:7b"}}
+    hedge_requests: bool = True  # fire the next backend once the current one passes its p90
+    hedge_percentile: float = 90.0
+    hedge_min_samples: int = 10  # successes needed before the percentile is trusted
+    max_error_rate: float = 0.5  # rolling error rate (incl. schema-invalid replies) above which a backend is skipped
+    failure_cooldown_s: float = 30.0  # circuit-open time after 3 consecutive failures
+
     # Character personality
     character_name: str = "Ani"
     character_personality: str = "friendly, enthusiastic anime companion"
 
 
+class TruncatedReply(ValueError):
+    """The reply is not valid JSON, most likely cut off by the token budget (a larger budget can fix it)"""
+
+
+def parse_json_reply(text: str, pattern=JSON_OBJECT_RE) -> Dict[str, Any]:
+    """JSON object from a model reply, or the first {...} in it; TruncatedReply if there is none"""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError as e:
+        match = pattern.search(text)
+        if match:
+            try:
+                return json.loads(match.group())
+            except json.JSONDecodeError:
+                pass
+        raise TruncatedReply(f"reply is not valid JSON ({e}): ...{text[-60:]!r}") from e
+
+
 class LLMBackend(ABC):
     """Abstract base class for LLM backends"""
 
     @abstractmethod
-    async def generate(self, prompt: str, schema: Optional[Dict] = None) -> Dict[str, Any]:
-        """Generate response with optional JSON schema enforcement"""
+    async def generate(self, prompt: str, schema: Optional[Dict] = None, prefix: Optional[str] = None,
+                       max_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Generate response with optional JSON schema enforcement
+        prefix: stable leading part of the prompt (identical every turn, cacheable);
+                when given, `prompt` is only the per-turn suffix
+        max_tokens: output budget for this call (default: config.max_tokens)
+        """
         pass
 
     @abstractmethod
@@ -47,36 +116,131 @@ class LLMBackend(ABC):
 
 
 class OllamaBackend(LLMBackend):
-    """Ollama LLM backend with JSON mode"""
+    """
+    Ollama LLM backend with JSON mode
+    - keep_alive keeps the model loaded between turns (no reload spikes)
+    - With a prompt prefix, uses /api/chat: the static prefix is the system message,
+      so the runner's KV cache covers it and only the per-turn suffix is evaluated
+    - Records Ollama's own prompt-eval vs eval timings
+    """
+
+    TIMING_FIELDS = ("total_duration", "load_duration", "prompt_eval_duration", "eval_duration")
 
     def __init__(self, config: LLMConfig):
         self.config = config
         self.base_url = config.ollama_host
+        self._session = None  # reused aiohttp session (keep-alive HTTP connection)
+        self.requests = 0
+        self.reloads = 0
+        self.early_stops = 0
+        self.timings: Dict[str, deque] = {
+            name: deque(maxlen=100)
+            for name in ("total_ms", "load_ms", "prompt_eval_ms", "eval_ms", "prompt_eval_count", "eval_count")
+        }
+
+    async def _get_session(self):
+        import aiohttp
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
 
     async def is_available(self) -> bool:
         """Check if Ollama is running"""
         try:
             import aiohttp
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"{self.base_url}/api/tags", timeout=aiohttp.ClientTimeout(total=2)) as resp:
-                    return resp.status == 200
+            session = await self._get_session()
+            async with session.get(f"{self.base_url}/api/tags", timeout=aiohttp.ClientTimeout(total=2)) as resp:
+                return resp.status == 200
         except Exception:
             return False
 
-    async def generate(self, prompt: str, schema: Optional[Dict] = None) -> Dict[str, Any]:
-        """Generate response using Ollama"""
+    async def _read_stream(self, resp, endpoint: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """
+        Read NDJSON chunks until the reply is done or STOP_FIELDS are complete
+        Returns (text, final chunk with timings) or (closed JSON prefix, None) when
+        stopped early; closing the connection makes Ollama stop generating.
+        """
+        scanner = JsonFieldScanner()
+        pieces = []
+        async for line in resp.content:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if endpoint == "/api/chat":
+                piece = (event.get("message") or {}).get("content", "")
+            else:
+                piece = event.get("response", "")
+            pieces.append(piece)
+            scanner.feed(piece)
+            if event.get("done"):
+                return "".join(pieces), event
+            if scanner.has_fields(STOP_FIELDS):
+                self.early_stops += 1
+                resp.close()
+                return scanner.prefix_object(), None
+        return "".join(pieces), {}
+
+    def _record_timings(self, result: Dict[str, Any]):
+        """Ollama reports durations in nanoseconds"""
+        self.requests += 1
+        ms = {name: (result.get(name) or 0) / 1e6 for name in self.TIMING_FIELDS}
+        self.timings["total_ms"].append(ms["total_duration"])
+        self.timings["load_ms"].append(ms["load_duration"])
+        self.timings["prompt_eval_ms"].append(ms["prompt_eval_duration"])
+        self.timings["eval_ms"].append(ms["eval_duration"])
+        self.timings["prompt_eval_count"].append(result.get("prompt_eval_count") or 0)
+        self.timings["eval_count"].append(result.get("eval_count") or 0)
+        if ms["load_duration"] > 500:
+            self.reloads += 1  # model had been unloaded
+        return ms
+
+    def snapshot(self) -> dict:
+        def avg(name):
+            values = self.timings[name]
+            return round(sum(values) / len(values), 1) if values else 0.0
+
+        eval_ms = sum(self.timings["eval_ms"])
+        return {
+            "requests": self.requests,
+            "early_stops": self.early_stops,
+            "model_reloads": self.reloads,
+            "avg_total_ms": avg("total_ms"),
+            "avg_load_ms": avg("load_ms"),
+            "avg_prompt_eval_ms": avg("prompt_eval_ms"),
+            "avg_eval_ms": avg("eval_ms"),
+            "avg_prompt_eval_tokens": avg("prompt_eval_count"),
+            "avg_eval_tokens": avg("eval_count"),
+            "eval_tokens_per_s": round(sum(self.timings["eval_count"]) / (eval_ms / 1000), 1) if eval_ms else 0.0,
+        }
+
+    async def generate(self, prompt: str, schema: Optional[Dict] = None, prefix: Optional[str] = None,
+                       max_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """Generate response using Ollama (JSON replies stream and stop at STOP_FIELDS)"""
         import aiohttp
-        import time
 
+        stream = bool(schema) and self.config.stream_early_stop
         payload = {
             "model": self.config.model,
-            "prompt": prompt,
-            "stream": False,
+            "stream": stream,
+            "keep_alive": self.config.ollama_keep_alive,
             "options": {
                 "temperature": self.config.temperature,
-                "num_predict": self.config.max_tokens,
+                "num_predict": max_tokens or self.config.max_tokens,
             }
         }
+        if prefix and self.config.ollama_use_chat:
+            endpoint = "/api/chat"
+            payload["messages"] = [
+                {"role": "system", "content": prefix},
+                {"role": "user", "content": prompt},
+            ]
+        else:
+            endpoint = "/api/generate"
+            payload["prompt"] = f"{prefix}\n{prompt}" if prefix else prompt
 
         # Enable JSON mode if schema provided
         if schema:
@@ -86,36 +250,45 @@ class OllamaBackend(LLMBackend):
         start_time = time.time()
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{self.base_url}/api/generate",
-                    json=payload,
-                    timeout=aiohttp.ClientTimeout(total=self.config.timeout)
-                ) as resp:
-                    if resp.status != 200:
-                        raise Exception(f"Ollama API error: {resp.status}")
-
+            session = await self._get_session()
+            async with session.post(
+                f"{self.base_url}{endpoint}",
+                json=payload,
+                timeout=aiohttp.ClientTimeout(total=self.config.timeout)
+            ) as resp:
+                if resp.status != 200:
+                    raise Exception(f"Ollama API error: {resp.status}")
+
+                if stream:
+                    response_text, result = await self._read_stream(resp, endpoint)
+                else:
                     result = await resp.json()
-                    response_text = result.get("response", "")
-                    elapsed = time.time() - start_time
-                    print(f"[Ollama] Response received in {elapsed:.2f}s")
+                    if endpoint == "/api/chat":
+                        response_text = (result.get("message") or {}).get("content", "")
+                    else:
+                        response_text = result.get("response", "")
+                elapsed = time.time() - start_time
+                if result is None:
+                    # Stopped early: Ollama only reports timings on the final chunk
+                    self.requests += 1
+                    print(f"[Ollama] Required fields complete in {elapsed:.2f}s, stopped generation")
+                    return json.loads(response_text)
+                ms = self._record_timings(result)
+                print(f"[Ollama] Response received in {elapsed:.2f}s "
+                      f"(prompt eval {result.get('prompt_eval_count', 0)} tok / {ms['prompt_eval_duration']:.0f}ms, "
+                      f"eval {result.get('eval_count', 0)} tok / {ms['eval_duration']:.0f}ms, "
+                      f"load {ms['load_duration']:.0f}ms)")
 
-                    # Parse JSON if schema was requested
-                    if schema and response_text:
-                        try:
-                            return json.loads(response_text)
-                        except json.JSONDecodeError:
-                            # Fallback: try to extract JSON from text
-                            import re
-                            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-                            if json_match:
-                                return json.loads(json_match.group())
-                            raise
+                # Parse JSON if schema was requested
+                if schema and response_text:
+                    return parse_json_reply(response_text)
 
-                    return {"response": response_text}
+                return {"response": response_text}
 
         except asyncio.TimeoutError:
             raise Exception(f"LLM timeout after {self.config.timeout}s")
+        except TruncatedReply:
+            raise
         except Exception as e:
             raise Exception(f"Ollama generation failed: {e}")
 
@@ -127,6 +300,32 @@ class OpenAIBackend(LLMBackend):
         self.config = config
         if not config.openai_api_key:
             raise ValueError("OpenAI API key is required. Set openai_api_key in LLMConfig")
+        self.requests = 0
+        self.early_stops = 0
+
+    def snapshot(self) -> dict:
+        return {"requests": self.requests, "early_stops": self.early_stops}
+
+    async def _read_stream(self, resp) -> str:
+        """Read server-sent deltas until done or STOP_FIELDS are complete (closed JSON prefix)"""
+        scanner = JsonFieldScanner()
+        pieces = []
+        async for line in resp.content:
+            line = line.strip()
+            if not line.startswith(b"data:"):
+                continue
+            data = line[5:].strip()
+            if data == b"[DONE]":
+                break
+            choices = json.loads(data).get("choices") or [{}]
+            piece = (choices[0].get("delta") or {}).get("content") or ""
+            pieces.append(piece)
+            scanner.feed(piece)
+            if scanner.has_fields(STOP_FIELDS):
+                self.early_stops += 1
+                resp.close()
+                return scanner.prefix_object()
+        return "".join(pieces)
 
     async def is_available(self) -> bool:
         """Check if OpenAI API is accessible"""
@@ -143,10 +342,10 @@ class OpenAIBackend(LLMBackend):
         except Exception:
             return False
 
-    async def generate(self, prompt: str, schema: Optional[Dict] = None) -> Dict[str, Any]:
-        """Generate response using OpenAI API"""
+    async def generate(self, prompt: str, schema: Optional[Dict] = None, prefix: Optional[str] = None,
+                       max_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """Generate response using OpenAI API (a stable system prefix hits OpenAI's automatic prompt cache)"""
         import aiohttp
-        import time
 
         headers = {
             "Authorization": f"Bearer {self.config.openai_api_key}",
@@ -156,16 +355,20 @@ class OpenAIBackend(LLMBackend):
         payload = {
             "model": self.config.model,
             "messages": [
-                {"role": "system", "content": f"You are {self.config.character_name}, a {self.config.character_personality}."},
+                {"role": "system", "content": prefix or f"You are {self.config.character_name}, a {self.config.character_personality}."},
                 {"role": "user", "content": prompt}
             ],
             "temperature": self.config.temperature,
-            "max_tokens": self.config.max_tokens,
+            "max_tokens": max_tokens or self.config.max_tokens,
         }
 
         # Enable JSON mode if schema provided
+        stream = bool(schema) and self.config.stream_early_stop
         if schema:
             payload["response_format"] = {"type": "json_object"}
+        if stream:
+            payload["stream"] = True
+        self.requests += 1
 
         try:
             print(f"[OpenAI] Sending request (model: {self.config.model})...")
@@ -182,39 +385,107 @@ class OpenAIBackend(LLMBackend):
                         error_text = await resp.text()
                         raise Exception(f"OpenAI API error ({resp.status}): {error_text}")
 
-                    result = await resp.json()
-                    response_text = result["choices"][0]["message"]["content"]
+                    if stream:
+                        response_text = await self._read_stream(resp)
+                    else:
+                        result = await resp.json()
+                        response_text = result["choices"][0]["message"]["content"]
 
                     elapsed = time.time() - start_time
                     print(f"[OpenAI] Response received in {elapsed:.2f}s")
 
                     # Parse JSON if schema was requested
                     if schema and response_text:
-                        try:
-                            return json.loads(response_text)
-                        except json.JSONDecodeError:
-                            import re
-                            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-                            if json_match:
-                                return json.loads(json_match.group())
-                            raise
+                        return parse_json_reply(response_text)
 
                     return {"response": response_text}
 
         except asyncio.TimeoutError:
             raise Exception(f"OpenAI timeout after {self.config.timeout}s")
+        except TruncatedReply:
+            raise
         except Exception as e:
             raise Exception(f"OpenAI generation failed: {e}")
 
 
 class AnthropicBackend(LLMBackend):
-    """Anthropic Claude API backend (Claude 3.5 Haiku, Sonnet, Opus)"""
+    """
+    Anthropic Claude API backend (Claude 3.5 Haiku, Sonnet, Opus)
+    The static prompt prefix goes into a system block marked for prompt caching;
+    only the per-turn suffix is new input on a cache hit.
+    """
+
+    JSON_ONLY_RULE = "\n\nCRITICAL: Respond with ONLY the JSON object. No markdown, no explanation, no code blocks."
 
     def __init__(self, config: LLMConfig):
         self.config = config
         if not config.openai_api_key:
             raise ValueError("Anthropic API key is required. Set openai_api_key in LLMConfig")
         self.api_key = config.openai_api_key
+        self._client = None  # one client (and connection pool) for the backend's lifetime
+        self.usage = {
+            "requests": 0,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "cache_creation_input_tokens": 0,
+            "cache_read_input_tokens": 0,
+            "cache_hits": 0,
+            "early_stops": 0,
+        }
+        self._latency_ms = {"hit": deque(maxlen=100), "miss": deque(maxlen=100)}
+
+    def _get_client(self):
+        if self._client is None:
+            from anthropic import AsyncAnthropic
+            self._client = AsyncAnthropic(api_key=self.api_key)
+        return self._client
+
+    def _record_usage(self, usage, elapsed_ms: float, output_tokens: Optional[int] = None):
+        """output_tokens overrides the reported count (a stopped stream never gets its final usage)"""
+        self.usage["requests"] += 1
+        for key in ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens"):
+            self.usage[key] += getattr(usage, key, None) or 0
+        if output_tokens is not None:
+            self.usage["output_tokens"] += output_tokens - (getattr(usage, "output_tokens", None) or 0)
+        hit = (getattr(usage, "cache_read_input_tokens", None) or 0) > 0
+        self.usage["cache_hits"] += int(hit)
+        self._latency_ms["hit" if hit else "miss"].append(elapsed_ms)
+
+    def snapshot(self) -> dict:
+        requests = self.usage["requests"]
+
+        def avg(values):
+            return round(sum(values) / len(values), 1) if values else 0.0
+
+        return {
+            **self.usage,
+            "cache_hit_rate": round(self.usage["cache_hits"] / requests, 3) if requests else 0.0,
+            "avg_uncached_input_tokens": round(self.usage["input_tokens"] / requests, 1) if requests else 0.0,
+            "latency_ms_cache_hit": avg(self._latency_ms["hit"]),
+            "latency_ms_cache_miss": avg(self._latency_ms["miss"]),
+        }
+
+    async def _stream(self, client, request: dict):
+        """
+        Stream the reply and stop once STOP_FIELDS are complete (leaving the stream
+        context closes the connection and ends generation)
+        Returns (text, usage, estimated output tokens if stopped early else None)
+        """
+        scanner = JsonFieldScanner()
+        pieces = []
+        async with client.messages.stream(**request) as stream:
+            async for piece in stream.text_stream:
+                pieces.append(piece)
+                scanner.feed(piece)
+                if scanner.has_fields(STOP_FIELDS):
+                    self.usage["early_stops"] += 1
+                    try:
+                        usage = stream.current_message_snapshot.usage  # input side from message_start
+                    except Exception:
+                        usage = None
+                    return scanner.prefix_object(), usage, estimate_tokens("".join(pieces))
+            message = await stream.get_final_message()
+        return "".join(pieces).strip(), getattr(message, "usage", None), None
 
     async def is_available(self) -> bool:
         """Check if Anthropic API can be used without making a full request"""
@@ -226,17 +497,22 @@ class AnthropicBackend(LLMBackend):
         except Exception:
             return False
 
-    async def generate(self, prompt: str, schema: Optional[Dict] = None) -> Dict[str, Any]:
+    async def generate(self, prompt: str, schema: Optional[Dict] = None, prefix: Optional[str] = None,
+                       max_tokens: Optional[int] = None) -> Dict[str, Any]:
         """Generate response using Anthropic Claude"""
-        from anthropic import AsyncAnthropic
-        import time
-
-        client = AsyncAnthropic(api_key=self.api_key)
+        client = self._get_client()
 
         # Build system prompt with JSON schema requirement
         system_prompt = f"You are {self.config.character_name}, a {self.config.character_personality}."
 
-        if schema:
+        if prefix:
+            # Persona + schema + guides already live in the prefix: send them once, cached
+            system = [{
+                "type": "text",
+                "text": prefix + (self.JSON_ONLY_RULE if schema else ""),
+                "cache_control": {"type": "ephemeral"},
+            }]
+        elif schema:
             system_prompt += "\n\nYou MUST respond with valid JSON matching this exact format:\n"
             system_prompt += """{
   "utterance": "your response text here (max 500 chars)",
@@ -247,27 +523,38 @@ class AnthropicBackend(LLMBackend):
   "intent": "SMALL_TALK|ANSWER|ASK|JOKE|TOOL_USE",
   "gesture": "none|wave|nod|shake_head|think|celebrate",
   "phoneme_hints": []
-}
-
-CRITICAL: Respond with ONLY the JSON object. No markdown, no explanation, no code blocks."""
+}""" + self.JSON_ONLY_RULE
+        if not prefix:
+            system = system_prompt
 
         try:
             print(f"[Claude] Sending request (model: {self.config.model})...")
             start_time = time.time()
 
-            response = await client.messages.create(
+            request = dict(
                 model=self.config.model,
-                max_tokens=self.config.max_tokens,
+                max_tokens=max_tokens or self.config.max_tokens,
                 temperature=self.config.temperature,
-                system=system_prompt,
+                system=system,
                 messages=[
                     {"role": "user", "content": prompt}
                 ]
             )
+            streamed_tokens = None
+            if schema and self.config.stream_early_stop:
+                response_text, usage, streamed_tokens = await self._stream(client, request)
+            else:
+                response = await client.messages.create(**request)
+                response_text = response.content[0].text.strip()
+                usage = getattr(response, "usage", None)
 
-            response_text = response.content[0].text.strip()
             elapsed = time.time() - start_time
-            print(f"[Claude] Response received in {elapsed:.2f}s")
+            if usage is not None:
+                self._record_usage(usage, elapsed * 1000, output_tokens=streamed_tokens)
+                print(f"[Claude] Response received in {elapsed:.2f}s "
+                      f"(input {usage.input_tokens}, cache read {getattr(usage, 'cache_read_input_tokens', 0) or 0})")
+            else:
+                print(f"[Claude] Response received in {elapsed:.2f}s")
 
             # Parse JSON if schema was requested
             if schema and response_text:
@@ -279,25 +566,17 @@ CRITICAL: Respond with ONLY the JSON object. No markdown, no explanation, no cod
                             response_text = response_text[4:]
                         response_text = response_text.strip()
 
-                    # Try direct parse
-                    return json.loads(response_text)
-                except json.JSONDecodeError as e:
+                    # Direct parse, else the first JSON object in the text
+                    return parse_json_reply(response_text, JSON_NESTED_OBJECT_RE)
+                except TruncatedReply as e:
                     print(f"[WARN] JSON parse error: {e}")
                     print(f"[DEBUG] Raw response: {response_text[:200]}")
-
-                    # Try to extract JSON from text
-                    import re
-                    json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', response_text, re.DOTALL)
-                    if json_match:
-                        try:
-                            return json.loads(json_match.group())
-                        except:
-                            pass
-
-                    raise Exception(f"Failed to parse JSON: {str(e)[:100]}")
+                    raise
 
             return {"response": response_text}
 
+        except TruncatedReply:
+            raise
         except Exception as e:
             raise Exception(f"Claude generation failed: {e}")
 
@@ -371,16 +650,14 @@ class MockLLMBackend(LLMBackend):
         """Mock is always available"""
         return True
 
-    async def generate(self, prompt: str, schema: Optional[Dict] = None) -> Dict[str, Any]:
-        """Generate varied mock response with language detection"""
-        import random
-        import re
-
+    async def generate(self, prompt: str, schema: Optional[Dict] = None, prefix: Optional[str] = None,
+                       max_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """Generate varied mock response with language detection (the static prefix is ignored)"""
         # Simulate processing time
         await asyncio.sleep(0.1)
 
         # Detect language (Chinese vs English)
-        has_chinese = bool(re.search(r'[\u4e00-\u9fff]', prompt))
+        has_chinese = has_cjk(prompt)
         lang_suffix = "_zh" if has_chinese else "_en"
 
         # Detect intent from prompt
@@ -420,6 +697,226 @@ class MockLLMBackend(LLMBackend):
 
         return response
 
+def conforms_to_schema(value: Any, schema: Optional[Dict]) -> bool:
+    """Minimal JSON-schema check (type, required, enum, nested properties) for backend replies"""
+    if not schema:
+        return True
+    expected = schema.get("type")
+    if expected == "object":
+        if not isinstance(value, dict):
+            return False
+        if any(key not in value for key in schema.get("required", [])):
+            return False
+        properties = schema.get("properties", {})
+        return all(conforms_to_schema(value[key], sub) for key, sub in properties.items() if key in value)
+    if expected == "string" and not isinstance(value, str):
+        return False
+    if expected == "number" and (not isinstance(value, (int, float)) or isinstance(value, bool)):
+        return False
+    if expected == "array" and not isinstance(value, list):
+        return False
+    if "enum" in schema and value not in schema["enum"]:
+        return False
+    return True
+
+
+class RouterBackend(LLMBackend):
+    """
+    Runtime failover and hedging across LLM backends
+    - Keeps rolling latency / error stats per backend (resilience.RollingStats)
+    - Sends each request to the first healthy backend in preference order
+    - Once the primary passes its own p90, the next backend is fired as a hedge;
+      the first schema-conforming reply wins and the loser is cancelled
+    - A non-conforming reply counts as a failure (and trips the breaker like one)
+    """
+
+    def __init__(self, config: LLMConfig, backends: List[Tuple[str, LLMBackend]]):
+        self.config = config
+        self.backends: Dict[str, LLMBackend] = dict(backends)
+        self.order: List[str] = [name for name, _ in backends]
+        self.stats: Dict[str, RollingStats] = {
+            name: RollingStats(cooldown_s=config.failure_cooldown_s) for name in self.order
+        }
+        self.wins: Dict[str, int] = {name: 0 for name in self.order}
+        self.invalid: Dict[str, int] = {name: 0 for name in self.order}
+        self.hedges_fired = 0
+        self.hedges_won = 0
+        self.failovers = 0
+
+    async def is_available(self) -> bool:
+        return any([await backend.is_available() for backend in self.backends.values()])
+
+    def _healthy(self, name: str) -> bool:
+        return self.stats[name].is_healthy(max_error_rate=self.config.max_error_rate)
+
+    def ranked(self) -> List[str]:
+        """Healthy backends first (preference order), unhealthy ones as a last resort"""
+        healthy = [n for n in self.order if self._healthy(n)]
+        return healthy + [n for n in self.order if n not in healthy]
+
+    def _hedge_delay(self, name: str) -> Optional[float]:
+        if not self.config.hedge_requests:
+            return None
+        p = self.stats[name].percentile(self.config.hedge_percentile, min_samples=self.config.hedge_min_samples)
+        return None if p is None else p / 1000.0
+
+    async def _call(self, name: str, prompt: str, schema: Optional[Dict], prefix: Optional[str],
+                    max_tokens: Optional[int] = None) -> Tuple[str, Dict[str, Any]]:
+        backend = self.backends[name]
+        start = time.time()
+        try:
+            result = await asyncio.wait_for(
+                backend.generate(prompt, schema=schema, prefix=prefix, max_tokens=max_tokens), timeout=self.config.timeout
+            )
+        except asyncio.CancelledError:
+            raise  # hedge loser: neither a success nor a failure
+        except asyncio.TimeoutError as e:
+            self.stats[name].record_failure(TimeoutError(f"{name} timed out after {self.config.timeout}s"))
+            raise TimeoutError(f"{name} timed out after {self.config.timeout}s") from e
+        except Exception as e:
+            self.stats[name].record_failure(e)
+            raise
+        if not conforms_to_schema(result, schema):
+            self.invalid[name] += 1
+            error = ValueError(f"{name} reply does not match the response schema")
+            self.stats[name].record_failure(error)
+            raise error
+        self.stats[name].record_success((time.time() - start) * 1000)
+        return name, result
+
+    async def generate(self, prompt: str, schema: Optional[Dict] = None, prefix: Optional[str] = None,
+                       max_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """First valid reply across backends (failover + hedging)"""
+        remaining = self.ranked()
+        errors: List[BaseException] = []
+        first = remaining[0] if remaining else None
+
+        while remaining:
+            primary = remaining.pop(0)
+            tasks = {asyncio.create_task(self._call(primary, prompt, schema, prefix, max_tokens))}
+            hedge_after = self._hedge_delay(primary) if remaining else None
+            hedge_task: Optional[asyncio.Task] = None
+            try:
+                while tasks:
+                    done, _ = await asyncio.wait(tasks, timeout=hedge_after, return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        # Primary is slower than its p90: race the next backend
+                        backup = remaining.pop(0)
+                        print(f"[LLM] {primary} past p{self.config.hedge_percentile:.0f} "
+                              f"({hedge_after * 1000:.0f}ms), hedging with {backup}")
+                        hedge_task = asyncio.create_task(self._call(backup, prompt, schema, prefix, max_tokens))
+                        tasks.add(hedge_task)
+                        self.hedges_fired += 1
+                        hedge_after = None
+                        continue
+                    for task in done:
+                        tasks.discard(task)
+                        if task.exception() is None:
+                            name, result = task.result()
+                            self.wins[name] += 1
+                            if task is hedge_task:
+                                self.hedges_won += 1
+                            if name != first:
+                                self.failovers += 1
+                            return result
+                        errors.append(task.exception())
+                        print(f"[WARN] LLM backend failed, trying next: {task.exception()}")
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+        message = f"All LLM backends failed: {'; '.join(map(str, errors)) or 'no backends configured'}"
+        if errors and all(isinstance(e, TruncatedReply) for e in errors):
+            raise TruncatedReply(message)  # a larger budget may still succeed
+        raise RuntimeError(message)
+
+    def snapshot(self) -> dict:
+        total_wins = sum(self.wins.values())
+        backends = {}
+        for name in self.order:
+            snap = self.stats[name].snapshot()
+            snap["healthy"] = self._healthy(name)
+            snap["p90_ms"] = self.stats[name].percentile(90)
+            snap["wins"] = self.wins[name]
+            snap["win_rate"] = round(self.wins[name] / total_wins, 3) if total_wins else 0.0
+            snap["invalid_replies"] = self.invalid[name]
+            usage = getattr(self.backends[name], "snapshot", None)
+            if callable(usage):
+                snap["usage"] = usage()
+            backends[name] = snap
+        return {
+            "order": self.order,
+            "active": self.ranked()[0] if self.order else None,
+            "hedges_fired": self.hedges_fired,
+            "hedges_won": self.hedges_won,
+            "failovers": self.failovers,
+            "backends": backends,
+        }
+
+
+BACKEND_CLASSES = {
+    "ollama": OllamaBackend,
+    "openai": OpenAIBackend,
+    "anthropic": AnthropicBackend,
+    "mock": MockLLMBackend,
+}
+
+
+SCHEMA_DESCRIPTION = """
+You must respond with valid JSON matching this exact format:
+{
+  "utterance": "your response text here (max 500 chars)",
+  "emote": {
+    "type": "joy|sad|anger|surprise|neutral|excited|confused|embarrassed|determined|relaxed",
+    "intensity": 0.0-1.0
+  },
+  "intent": "SMALL_TALK|ANSWER|ASK|JOKE|TOOL_USE",
+  "gesture": "none|wave|nod|shake_head|think|celebrate",
+  "phoneme_hints": []
+}
+
+Emotion guide:
+- joy: happy, cheerful (basic happiness)
+- excited: very enthusiastic, energetic (stronger than joy)
+- sad: unhappy, melancholy
+- anger: frustrated, upset
+- surprise: shocked, amazed
+- confused: puzzled, uncertain
+- embarrassed: shy, flustered
+- determined: focused, resolute
+- relaxed: calm, peaceful
+- neutral: no strong emotion
+
+Gesture guide:
+- wave: for greetings
+- nod: for agreement/understanding
+- shake_head: for disagreement/confusion
+- think: for pondering/considering
+- celebrate: for excitement/achievement
+
+IMPORTANT RULES:
+- DO NOT use emojis or emoticons in utterance
+- Use ONLY plain text in utterance - emojis will be read aloud by TTS and sound weird
+- Express emotions through words and the "emote" field, not symbols
+- Keep utterance SHORT (1-2 sentences, under 80-100 characters) - this is a voice conversation
+- 中文场景优先使用自然口语化中文，句子简短、直白，避免书面语
+- 先回应用户，再给出一个自然的跟进问题（如需要，以便延续对话）
+"""
+
+
+PLAN_INSTRUCTION = """
+PLANNING: After all the fields above, add a "plan" object as the LAST field:
+  "plan": {"intent": "string", "key_points": ["bullet", "bullet"], "tone": "brief, friendly, colloquial Chinese", "follow_up": "a natural short question if needed"}
+Keep the field order: utterance, emote, intent, gesture first; the plan is never spoken.
+"""
+
+
+@functools.lru_cache(maxsize=8)
+def render_static_prefix(character_name: str, character_personality: str, include_plan: bool = False) -> str:
+    """Static prompt template, rendered once per character config"""
+    return f"""You are {character_name}, a {character_personality}.
+{SCHEMA_DESCRIPTION}{PLAN_INSTRUCTION if include_plan else ""}"""
+
 
 class LLMPipeline:
     """
@@ -430,16 +927,36 @@ class LLMPipeline:
         self.config = config or LLMConfig()
         self.backend: Optional[LLMBackend] = None
         self.is_ready = False
+        self.singleflight = SingleFlight("llm")  # identical concurrent prompts share one backend call
+        self.prompt_assembler = PromptAssembler(self.config.prompt_context_tokens)
+
+        # Output budget: observed reply sizes (estimated tokens) per language
+        self._reply_tokens: Dict[str, deque] = {"zh": deque(maxlen=50), "en": deque(maxlen=50)}
+        self.generation = {"turns": 0, "output_tokens_est": 0, "generation_ms": 0.0, "budget_retries": 0}
 
-        # Optional conversation memory and knowledge base (RAG)
+        # Optional conversation memory (a default one plus one per session) and knowledge base (RAG)
         try:
-            from memory import ConversationMemory
-            self.memory = ConversationMemory(max_turns=8, summary_interval=4)
+            from memory import SessionStore, SessionStoreConfig
+            from long_term_memory import LongTermMemory, LongTermMemoryConfig
+            store = self._open_memory_store()
+            ltm_config = LongTermMemoryConfig.from_env()
+            self.long_term = LongTermMemory(
+                ltm_config, loader=store.history if store is not None else None
+            ) if ltm_config.enabled else None
+            self.memory = self._new_memory()
+            self.sessions = SessionStore(self._new_memory, SessionStoreConfig.from_env(), persistence=store)
         except Exception:
             self.memory = None
+            self.sessions = None
+            self.long_term = None
+        try:
+            from response_cache import ResponseCache, ResponseCacheConfig
+            self.response_cache = ResponseCache(ResponseCacheConfig.from_env())
+        except Exception:
+            self.response_cache = None
         try:
             from rag.knowledge import KnowledgeBase
-            self.kb = KnowledgeBase()
+            self.kb = KnowledgeBase(lazy=True)  # records are read in initialize(), off the event loop
         except Exception:
             self.kb = None
 
@@ -473,12 +990,34 @@ class LLMPipeline:
         }
 
     async def initialize(self):
-        """Initialize LLM backend"""
+        """Initialize LLM backend while the knowledge base loads in a worker thread"""
+        kb_load = None
+        if self.kb is not None:
+            kb_load = asyncio.get_running_loop().run_in_executor(None, self.kb.ensure_loaded)
+        await self._init_backend()
+        if kb_load is not None:
+            try:
+                await kb_load
+            except Exception as e:
+                print(f"[WARN] Knowledge base load failed: {e}")
+
+    async def _init_backend(self):
+        """Pick the configured backend, falling back to Mock"""
         print(f"Initializing LLM pipeline (backend: {self.config.backend})...")
 
         try:
+            # Several backends behind a hedging router
+            if self.config.backend == "router":
+                router = await self._init_router()
+                if router is not None:
+                    self.backend = router
+                    print(f"[OK] LLM router initialized ({' -> '.join(router.order)})")
+                    self.is_ready = True
+                    return
+                print("[WARN] No router backend available, falling back to Mock")
+
             # Try Anthropic Claude
-            if self.config.backend == "anthropic":
+            elif self.config.backend == "anthropic":
                 anthropic_backend = AnthropicBackend(self.config)
                 if await anthropic_backend.is_available():
                     self.backend = anthropic_backend
@@ -522,143 +1061,281 @@ class LLMPipeline:
             self.is_ready = True
             print("[WARN] Using Mock backend as fallback")
 
-    def _build_prompt(self, user_input: str) -> str:
-        """Build prompt with memory + optional RAG + JSON schema requirements (中文口语化强化)"""
-        schema_description = """
-You must respond with valid JSON matching this exact format:
-{
-  "utterance": "your response text here (max 500 chars)",
-  "emote": {
-    "type": "joy|sad|anger|surprise|neutral|excited|confused|embarrassed|determined|relaxed",
-    "intensity": 0.0-1.0
-  },
-  "intent": "SMALL_TALK|ANSWER|ASK|JOKE|TOOL_USE",
-  "gesture": "none|wave|nod|shake_head|think|celebrate",
-  "phoneme_hints": [],
-  "plan": {
-    "intent": "string",
-    "key_points": ["bullet", "bullet"],
-    "tone": "brief, friendly, colloquial Chinese",
-    "follow_up": "a natural short question if needed"
-  }
-}
-
-Emotion guide:
-- joy: happy, cheerful (basic happiness)
-- excited: very enthusiastic, energetic (stronger than joy)
-- sad: unhappy, melancholy
-- anger: frustrated, upset
-- surprise: shocked, amazed
-- confused: puzzled, uncertain
-- embarrassed: shy, flustered
-- determined: focused, resolute
-- relaxed: calm, peaceful
-- neutral: no strong emotion
-
-Gesture guide:
-- wave: for greetings
-- nod: for agreement/understanding
-- shake_head: for disagreement/confusion
-- think: for pondering/considering
-- celebrate: for excitement/achievement
-
-IMPORTANT RULES:
-- DO NOT use emojis or emoticons in utterance
-- Use ONLY plain text in utterance - emojis will be read aloud by TTS and sound weird
-- Express emotions through words and the "emote" field, not symbols
-- Keep utterance SHORT (1-2 sentences, under 80-100 characters) - this is a voice conversation
-- 中文场景优先使用自然口语化中文，句子简短、直白，避免书面语
-- 先回应用户，再给出一个自然的跟进问题（如需要，以便延续对话）
-"""
-
-        # Conversation memory block
-        memory_block = ""
-        if getattr(self, "memory", None):
-            mem_txt = self.memory.get_context_block()
-            if mem_txt:
-                memory_block = f"\n[对话上下文]\n{mem_txt}\n"
-
-        # RAG block (命中→要点→润色 的闭环：先提供事实要点，模型据此规划+表述)
-        rag_block = ""
-        if getattr(self, "kb", None):
+    async def _init_router(self) -> Optional[RouterBackend]:
+        """Create the configured router backends; the unavailable ones are left out"""
+        candidates: List[Tuple[str, LLMBackend]] = []
+        for name in self.config.router_backends:
+            backend_cls = BACKEND_CLASSES.get(name)
+            if backend_cls is None:
+                print(f"[WARN] Unknown router backend: {name}")
+                continue
             try:
-                hits = self.kb.search(user_input, top_k=3)
-                if hits:
-                    rag_lines = []
-                    for h in hits:
-                        title = str(h.get('title', ''))
-                        snippet = str(h.get('snippet', ''))
-                        rag_lines.append(f"- {title}: {snippet}")
-                    facts = "\n".join(rag_lines)
-                    rag_block = (
-                        "\n[已知事实(STRICT FACTS)]\n"
-                        + facts
-                        + "\n\n规则:\n"
-                          "- 回答必须严格以以上事实为依据, 不得臆测或编造(尤其价格/时效).\n"
-                          "- 若事实不足以回答, 先简短回应, 再给出一个自然的澄清问题或引导动作.\n"
-                          "- 语气口语化, 1-2 句为宜.\n"
-                    )
-            except Exception:
-                pass
-
-        # Detect user's language
-        import re
-        user_language = "Chinese" if re.search(r'[\u4e00-\u9fff]', user_input) else "English"
+                overrides = self.config.router_overrides.get(name, {})
+                candidates.append((name, backend_cls(replace(self.config, backend=name, **overrides))))
+            except Exception as e:
+                print(f"[WARN] Router backend {name} not configured: {e}")
+
+        available = await asyncio.gather(*(backend.is_available() for _, backend in candidates))
+        backends = [(name, backend) for (name, backend), ok in zip(candidates, available) if ok]
+        for (name, _), ok in zip(candidates, available):
+            if not ok:
+                print(f"[WARN] Router backend {name} not available")
+        if not backends:
+            return None
+        return RouterBackend(self.config, backends)
+
+    def static_prefix(self) -> str:
+        return render_static_prefix(
+            self.config.character_name, self.config.character_personality, self.config.include_plan
+        )
 
-        prompt = f"""You are {self.config.character_name}, a {self.config.character_personality}.
+    def max_tokens_for(self, language: str) -> int:
+        """
+        Output budget for a reply in `language`: p95 of observed reply sizes plus
+        headroom, within [min_max_tokens, max_tokens]
+        """
+        cap = self.config.max_tokens
+        observed = self._reply_tokens.get(language)
+        if not self.config.adaptive_max_tokens or not observed or len(observed) < 5:
+            return cap
+        p95 = sorted(observed)[int(0.95 * (len(observed) - 1))]
+        return max(self.config.min_max_tokens, min(cap, int(p95 * 1.5) + 32))
+
+    async def _generate(self, prefix: str, suffix: str, language: str) -> Dict[str, Any]:
+        """Backend call under the adaptive budget; a reply truncated by a reduced budget retries at the cap"""
+        max_tokens = self.max_tokens_for(language)
+        start = time.time()
+
+        async def call(budget: int):
+            # Stateless given the prompt: identical concurrent prompts coalesce
+            key = (type(self.backend).__name__, self.config.model, prefix, suffix, budget)
+            return await self.singleflight.do(
+                key, lambda: self.backend.generate(suffix, schema=self.response_schema, prefix=prefix, max_tokens=budget)
+            )
 
-LANGUAGE RULE: User is speaking {user_language}. You MUST respond ONLY in {user_language}. Never mix languages.
-{memory_block}{rag_block}
+        try:
+            shared = await call(max_tokens)
+        except TruncatedReply:
+            # Only a cut-off reply is worth a second call: timeouts and transport errors would just repeat
+            if max_tokens >= self.config.max_tokens:
+                raise
+            self.generation["budget_retries"] += 1
+            shared = await call(self.config.max_tokens)
+
+        output_tokens = estimate_tokens(json.dumps(shared, ensure_ascii=False))
+        self._reply_tokens.setdefault(language, deque(maxlen=50)).append(output_tokens)
+        self.generation["turns"] += 1
+        self.generation["output_tokens_est"] += output_tokens
+        self.generation["generation_ms"] += (time.time() - start) * 1000
+        return copy.deepcopy(shared)  # cleaned and annotated per caller
+
+    def _prompt_components(self, user_input: str, memory) -> List[PromptComponent]:
+        """Per-turn context blocks, most important first"""
+        components = []
+
+        # Conversation memory (its own token budget already bounds it)
+        if memory:
+            components.append(PromptComponent(
+                "memory", memory.get_context_block, header="[对话上下文]", priority=80, keep="end",
+                max_tokens=self.config.memory_max_tokens + self.config.memory_summary_max_tokens + 16
+            ))
+
+        # RAG (命中→要点→润色 的闭环：先提供事实要点，模型据此规划+表述)
+        if getattr(self, "kb", None):
+            def rag_facts() -> str:
+                hits = [h for h in self.kb.search(user_input, top_k=3) if h.get("score", 0) > 0]  # unrelated records are noise
+                return "\n".join(f"- {h.get('title', '')}: {h.get('snippet', '')}" for h in hits)
+
+            components.append(PromptComponent(
+                "rag", rag_facts, header="[已知事实(STRICT FACTS)]",
+                footer="\n规则:\n"
+                       "- 回答必须严格以以上事实为依据, 不得臆测或编造(尤其价格/时效).\n"
+                       "- 若事实不足以回答, 先简短回应, 再给出一个自然的澄清问题或引导动作.\n"
+                       "- 语气口语化, 1-2 句为宜.\n",
+                priority=60, max_tokens=self.config.rag_max_tokens,
+                in_thread=True, deadline_ms=self.config.rag_deadline_ms
+            ))
+
+        # Long-term memory: earlier turns relevant to this input (never the ones still in the window).
+        # Recall takes microseconds, so it runs inline while the RAG thread works.
+        archive = getattr(memory, "archive", None)
+        if archive is not None:
+            def recalled() -> str:
+                before_seq = memory.turns[0].seq if memory.turns else None
+                return "\n".join(f"- {line}" for line in archive.recall(user_input, before_seq=before_seq))
+
+            components.append(PromptComponent(
+                "recall", recalled, header="[长期记忆]", priority=40, max_tokens=self.config.recall_max_tokens
+            ))
+        return components
+
+    def _render_suffix(self, user_input: str, blocks: Dict[str, str]) -> str:
+        user_language = "Chinese" if detect_language(user_input) == "zh" else "English"
+        context = blocks.get("recall", "") + blocks.get("memory", "") + blocks.get("rag", "")
+        return f"""LANGUAGE RULE: User is speaking {user_language}. You MUST respond ONLY in {user_language}. Never mix languages.
+{context}
 User said: "{user_input}"
 
-{schema_description}
-
 CRITICAL RULES:
 1. Respond ONLY in {user_language} - do not use any other language
 2. Keep utterance SHORT (1-2 sentences) - this is voice conversation
 3. Be concise, natural, and conversational
-PLANNING: Produce an internal plan object in the JSON field "plan" (intent, key_points, tone, follow_up) then craft the final utterance from it.
 
 Respond as {self.config.character_name} in JSON format:"""
 
-        return prompt
+    async def _assemble_prompt(self, user_input: str, memory=None) -> Tuple[str, str, Dict[str, Any]]:
+        """
+        (static prefix, per-turn suffix, assembly report)
+        The prefix (persona, schema, guides) is byte-identical every turn for a given
+        config so providers can cache it; context blocks and the user text go in the
+        suffix. RAG runs in a worker thread under its deadline while the other blocks
+        are built; the blocks are then fitted to their budgets.
+        """
+        memory = memory if memory is not None else getattr(self, "memory", None)
+        blocks, report = await self.prompt_assembler.assemble(self._prompt_components(user_input, memory))
+        return self.static_prefix(), self._render_suffix(user_input, blocks), report
 
-    def _clean_utterance(self, text: str) -> str:
-        """Remove emojis and emoticons from utterance for TTS (conservative approach)"""
-        import re
-
-        # Remove emoji (Unicode ranges) - these are always safe to remove
-        emoji_pattern = re.compile(
-            "["
-            "\U0001F600-\U0001F64F"  # emoticons
-            "\U0001F300-\U0001F5FF"  # symbols & pictographs
-            "\U0001F680-\U0001F6FF"  # transport & map symbols
-            "\U0001F1E0-\U0001F1FF"  # flags
-            "\U0001F900-\U0001F9FF"  # supplemental symbols
-            "\U0001FA70-\U0001FAFF"
-            "]+",
-            flags=re.UNICODE
-        )
-        text = emoji_pattern.sub('', text)
+    def _build_prompt_parts(self, user_input: str, memory=None) -> Tuple[str, str]:
+        """Same as _assemble_prompt, built inline (no deadlines) for sync callers"""
+        memory = memory if memory is not None else getattr(self, "memory", None)
+        blocks, _ = self.prompt_assembler.assemble_sync(self._prompt_components(user_input, memory))
+        return self.static_prefix(), self._render_suffix(user_input, blocks)
 
-        # Remove ONLY obvious emoticon patterns, nothing else
-        # Pattern: (*^_^*), (^_^), (≧▽≦), etc.
-        text = re.sub(r'\([*^_~=><]+[^)]*\)', '', text)
+    def _build_prompt(self, user_input: str) -> str:
+        """Build prompt with memory + optional RAG + JSON schema requirements (中文口语化强化)"""
+        prefix, suffix = self._build_prompt_parts(user_input)
+        return f"{prefix}\n{suffix}"
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Backend usage (e.g. Anthropic cache hits) plus prompt prefix size"""
+        metrics: Dict[str, Any] = {"backend": type(self.backend).__name__ if self.backend else None}
+        snapshot = getattr(self.backend, "snapshot", None)
+        if callable(snapshot):
+            metrics.update(snapshot())
+        metrics["static_prefix_chars"] = len(self.static_prefix())
+        turns = self.generation["turns"]
+        metrics["generation"] = {
+            **self.generation,
+            "avg_output_tokens_est": round(self.generation["output_tokens_est"] / turns, 1) if turns else 0.0,
+            "avg_generation_ms": round(self.generation["generation_ms"] / turns, 1) if turns else 0.0,
+            "max_tokens": {lang: self.max_tokens_for(lang) for lang in self._reply_tokens},
+        }
+        if self.response_cache is not None:
+            metrics["response_cache"] = self.response_cache.snapshot()
+        if getattr(self, "memory", None) is not None:
+            metrics["memory"] = self.memory.snapshot()
+        if getattr(self, "long_term", None) is not None:
+            metrics["long_term_memory"] = self.long_term.snapshot()
+        metrics["prompt"] = self.prompt_assembler.snapshot()
+        return metrics
+
+    async def summarize_history(self, previous: str, lines: List[str]) -> str:
+        """Memory summarizer: fold older turns into the running summary (plain text, off the reply path)"""
+        if not self.is_ready or self.backend is None:
+            raise RuntimeError("LLM backend not ready")
+        budget = self.config.memory_summary_max_tokens
+        prompt = (
+            f"把下面的对话压缩成不超过{budget}个字的摘要，保留人名、事实、偏好和未完成的话题。只输出摘要。\n"
+            f"[已有摘要]{previous or '无'}\n[新对话]\n" + "\n".join(lines)
+        )
+        result = await self.backend.generate(prompt, schema=None, max_tokens=budget * 2)
+        summary = result.get("response") if isinstance(result, dict) else None
+        if not isinstance(summary, str):
+            raise ValueError("backend returned no plain-text summary")
+        return summary
+
+    def _new_memory(self, session: Optional[str] = None):
+        from memory import ConversationMemory
+        memory = ConversationMemory(
+            summary_interval=4,
+            max_tokens=self.config.memory_max_tokens,
+            summary_max_tokens=self.config.memory_summary_max_tokens,
+            summarizer=self.summarize_history if self.config.memory_summarizer else None,
+        )
+        if self.long_term is not None:
+            memory.archive = self.long_term.archive(session or "local")
+        return memory
+
+    def _open_memory_store(self):
+        """Durable session memory if ANI_MEMORY_DB is set"""
+        from memory_store import MemoryStore, MemoryStoreConfig
+        config = MemoryStoreConfig.from_env()
+        if not config.enabled:
+            return None
+        try:
+            store = MemoryStore(config)
+            print(f"[OK] Conversation memory persisted to {config.path}")
+            return store
+        except Exception as e:
+            print(f"[WARN] Conversation memory persistence disabled ({config.path}): {e}")
+            return None
+
+    async def close(self):
+        """Flush persisted memory and release backend connections"""
+        if getattr(self, "sessions", None) is not None:
+            await asyncio.to_thread(self.sessions.close)
+        self.prompt_assembler.close()
+        close = getattr(self.backend, "close", None)
+        if callable(close):
+            await close()
+
+    def memory_for(self, session: Optional[str] = None, memory=None):
+        """Memory to use for a turn: explicit `memory`, else the session's, else the pipeline default"""
+        if memory is not None:
+            return memory
+        if session is not None and getattr(self, "sessions", None) is not None:
+            return self.sessions.get(session)
+        return getattr(self, "memory", None)
+
+    def record_turn(self, user_input: str, response: Dict[str, Any], memory=None, session: Optional[str] = None):
+        """Add a user/assistant pair produced outside generate_response (cache hit, committed speculation)"""
+        memory = self.memory_for(session, memory)
+        if not memory:
+            return
+        try:
+            memory.add_user(user_input)
+            memory.add_assistant(response["utterance"], emote=(response.get("emote") or {}).get("type"))
+        except Exception:
+            pass
 
-        # Remove standalone sequences: ^_^, ===, ~~~, etc. (but not single chars)
-        text = re.sub(r'(?<!\w)[\^_~=><]{2,}(?!\w)', '', text)
+    def cached_response(self, user_input: str, memory=None, session: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Reply from the response cache, or None on a miss
+        A hit is recorded in memory like a generated turn; "cache_key" lets the
+        caller fetch/attach the reply's audio.
+        """
+        if self.response_cache is None or not self.response_cache.cacheable(user_input):
+            return None
+        from response_cache import fingerprint_for
 
-        # Clean up extra spaces
-        text = re.sub(r'\s+', ' ', text).strip()
+        memory = self.memory_for(session, memory)
+        start_time = time.time()
+        entry = self.response_cache.get(user_input, fingerprint_for(user_input, memory))
+        if entry is None:
+            return None
+        response = dict(entry.response)
+        self.record_turn(user_input, response, memory)
+        return {
+            **response,
+            "cache_hit": True,
+            "cache_key": entry.key,
+            "llm_latency_ms": (time.time() - start_time) * 1000
+        }
 
-        return text
+    def _clean_utterance(self, text: str) -> str:
+        """Remove emojis and emoticons from utterance for TTS (conservative approach)"""
+        return clean_utterance(text)
 
-    async def generate_response(self, user_input: str) -> Dict[str, Any]:
+    async def generate_response(self, user_input: str, lookup_cache: bool = True, memory=None,
+                                session: Optional[str] = None) -> Dict[str, Any]:
         """
         Generate character response from user input
 
         Args:
             user_input: User's text input
+            lookup_cache: Check the response cache first (False when the caller already did)
+            memory: Conversation memory to read and update (speculative turns pass a copy)
+            session: Session id whose memory to use (default: the pipeline's own memory)
 
         Returns:
             Dict with utterance, emote, intent, phoneme_hints
@@ -666,21 +1343,31 @@ Respond as {self.config.character_name} in JSON format:"""
         if not self.is_ready or not self.backend:
             raise RuntimeError("LLM pipeline not initialized")
 
+        memory = self.memory_for(session, memory)
+        if lookup_cache:
+            cached = self.cached_response(user_input, memory)
+            if cached is not None:
+                return cached
+
         start_time = time.time()
+        cache_fingerprint = None
+        if self.response_cache is not None and self.response_cache.cacheable(user_input):
+            from response_cache import fingerprint_for
+            cache_fingerprint = fingerprint_for(user_input, memory)  # context the question was asked in
 
         try:
             # Add to memory (user)
-            if getattr(self, "memory", None):
+            if memory:
                 try:
-                    self.memory.add_user(user_input)
+                    memory.add_user(user_input)
                 except Exception:
                     pass
 
-            # Build prompt
-            prompt = self._build_prompt(user_input)
+            # Build prompt (cacheable static prefix + per-turn suffix within its token budget)
+            prefix, suffix, prompt_report = await self._assemble_prompt(user_input, memory)
 
             # Generate response
-            response = await self.backend.generate(prompt, schema=self.response_schema)
+            response = await self._generate(prefix, suffix, detect_language(user_input))
 
             # Validate response has required fields
             required_fields = ["utterance", "emote", "intent"]
@@ -707,23 +1394,32 @@ Respond as {self.config.character_name} in JSON format:"""
                 response["phoneme_hints"] = []
 
             # Update memory (assistant)
-            if getattr(self, "memory", None):
+            if memory:
                 try:
                     em = None
                     try:
                         em = response.get("emote", {}).get("type")
                     except Exception:
                         pass
-                    self.memory.add_assistant(response["utterance"], emote=em)
+                    memory.add_assistant(response["utterance"], emote=em)
                 except Exception:
                     pass
 
             # Calculate latency
             latency_ms = (time.time() - start_time) * 1000
 
+            cache_key = None
+            # A reply that drew on recalled memories or RAG facts is specific to this user: never shared
+            recalled = any(prompt_report["components"].get(name, {}).get("tokens") for name in PERSONAL_COMPONENTS)
+            if cache_fingerprint is not None and not recalled:
+                cache_key = self.response_cache.put(user_input, cache_fingerprint, response)
+
             return {
                 **response,
-                "llm_latency_ms": latency_ms
+                "cache_hit": False,
+                "cache_key": cache_key,
+                "llm_latency_ms": latency_ms,
+                "prompt": prompt_report
             }
 
         except Exception as e:
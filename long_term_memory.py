@@ -0,0 +1,271 @@
+"""
+Long-term conversation memory for Ani v0
+ConversationMemory keeps a token-bounded window plus a short summary; older
+turns would otherwise be forgotten. Here every turn that leaves the window (and
+every LLM summary) is indexed per session/user in an inverted index over the
+same EN-word / CJK-bigram tokens as rag.knowledge. Each turn, the best matches
+for the user's input are recalled into the prompt under a strict token budget.
+
+Recall touches only the postings of the query's tokens (IDF-weighted, very
+common tokens skipped), so it stays far below a millisecond per turn.
+With persistence enabled, a returning user's history is indexed from the
+memory store in a worker thread; recall works from the live index meanwhile.
+"""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import math
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+from text_utils import estimate_tokens, extract_tokens
+
+# History loader: session -> [(seq, role, text, ts)] oldest first (memory_store.MemoryStore.history)
+HistoryLoader = Callable[[str], List[Tuple[int, str, str, float]]]
+
+
+@dataclass
+class LongTermMemoryConfig:
+    """Recall limits (ANI_LTM, ANI_LTM_MAX_TOKENS, ANI_LTM_TOP_K)"""
+    enabled: bool = True
+    max_tokens: int = 120  # hard cap on the recalled block
+    top_k: int = 3
+    min_score: float = 3.0  # summed IDF of shared tokens (one rare token, or several common ones)
+    max_df_ratio: float = 0.25  # tokens in more than this share of a user's docs are skipped
+    snippet_chars: int = 80
+    max_docs: int = 2000  # per user; the oldest are dropped beyond this
+    max_users: int = 1000  # least recently used indexes are dropped beyond this
+
+    @classmethod
+    def from_env(cls) -> "LongTermMemoryConfig":
+        config = cls()
+        config.enabled = os.getenv("ANI_LTM", "1").lower() in {"1", "true", "yes", "on"}
+        try:
+            config.max_tokens = int(os.getenv("ANI_LTM_MAX_TOKENS", config.max_tokens))
+            config.top_k = int(os.getenv("ANI_LTM_TOP_K", config.top_k))
+        except ValueError:
+            pass
+        return config
+
+
+class _Index:
+    """One user's documents and token postings"""
+
+    __slots__ = ("docs", "postings")
+
+    def __init__(self):
+        self.docs: Dict[Hashable, Tuple[str, int, float]] = {}  # key -> (text, seq, ts)
+        self.postings: Dict[str, List[Hashable]] = {}
+
+    def add(self, key: Hashable, text: str, seq: int, ts: float) -> bool:
+        if key in self.docs or not text:
+            return False
+        self.docs[key] = (text, seq, ts)
+        for token in set(extract_tokens(text)):
+            self.postings.setdefault(token, []).append(key)
+        return True
+
+    def rebuilt(self, keep: int) -> "_Index":
+        """Index of the newest `keep` documents"""
+        index = _Index()
+        for key, (text, seq, ts) in sorted(self.docs.items(), key=lambda kv: kv[1][1])[-keep:]:
+            index.add(key, text, seq, ts)
+        return index
+
+
+class LongTermMemory:
+    """Per-session inverted index of turns that left the conversation window"""
+
+    def __init__(self, config: Optional[LongTermMemoryConfig] = None, loader: Optional[HistoryLoader] = None):
+        self.config = config or LongTermMemoryConfig()
+        self.loader = loader
+        self._indexes: "OrderedDict[str, _Index]" = OrderedDict()
+        self.stats = {
+            "indexed": 0, "recalls": 0, "hits": 0, "recalled_tokens": 0, "recall_ms": 0.0,
+            "loads": 0, "load_failures": 0,
+        }
+
+    def archive(self, session: str) -> "MemoryArchive":
+        """Handle for one session (ConversationMemory.archive)"""
+        return MemoryArchive(self, session)
+
+    def _index(self, session: str) -> _Index:
+        index = self._indexes.get(session)
+        if index is not None:
+            self._indexes.move_to_end(session)
+            return index
+        index = self._indexes[session] = _Index()
+        while len(self._indexes) > self.config.max_users:
+            self._indexes.popitem(last=False)
+        if self.loader is not None:
+            self._load(session)
+        return index
+
+    def _load(self, session: str):
+        """Index persisted history off the event loop, then merge in what arrived meanwhile"""
+        def build() -> _Index:
+            built = _Index()
+            for seq, role, text, ts in self.loader(session)[-self.config.max_docs:]:
+                built.add(("turn", seq), _line(role, text), seq, ts)
+            return built
+
+        def merge(built: _Index):
+            live = self._indexes.get(session)
+            if live is None:
+                return  # evicted while loading
+            for key, (text, seq, ts) in live.docs.items():
+                built.add(key, text, seq, ts)
+            self._indexes[session] = built
+            self.stats["loads"] += 1
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None:
+            try:
+                merge(build())
+            except Exception as e:
+                self.stats["load_failures"] += 1
+                print(f"[WARN] Long-term memory load failed for {session}: {e}")
+            return
+
+        def done(future: asyncio.Future):
+            if future.cancelled() or future.exception() is not None:
+                self.stats["load_failures"] += 1
+                print(f"[WARN] Long-term memory load failed for {session}: {future.exception()}")
+                return
+            merge(future.result())
+
+        loop.run_in_executor(None, build).add_done_callback(done)
+
+    def add(self, session: str, key: Hashable, text: str, seq: int, ts: Optional[float] = None):
+        index = self._index(session)
+        if index.add(key, text, seq, ts or time.time()):
+            self.stats["indexed"] += 1
+            if len(index.docs) > self.config.max_docs * 5 // 4:
+                self._indexes[session] = index.rebuilt(self.config.max_docs)
+
+    def recall(self, session: str, query: str, before_seq: Optional[int] = None,
+               max_tokens: Optional[int] = None) -> List[str]:
+        """
+        Snippets most relevant to `query`, best first, within `max_tokens`
+        Documents at or after `before_seq` (still in the window) are skipped.
+        """
+        start = time.perf_counter()
+        self.stats["recalls"] += 1
+        index = self._indexes.get(session)
+        snippets: List[str] = []
+        if index is not None and index.docs:
+            scores: Dict[Hashable, float] = {}
+            total = len(index.docs)
+            max_df = max(1, int(total * self.config.max_df_ratio)) if total >= 20 else total
+            for token in set(extract_tokens(query)):
+                keys = index.postings.get(token)
+                if not keys or len(keys) > max_df:
+                    continue
+                idf = math.log(1 + total / len(keys))
+                for key in keys:
+                    scores[key] = scores.get(key, 0.0) + idf
+            # Ties go to the more recent document
+            best = heapq.nlargest(
+                self.config.top_k * 2, scores.items(), key=lambda kv: (kv[1], index.docs[kv[0]][1])
+            )
+            budget = self.config.max_tokens if max_tokens is None else max_tokens
+            for key, score in best:
+                text, seq, _ = index.docs[key]
+                if score < self.config.min_score or len(snippets) >= self.config.top_k:
+                    break
+                if before_seq is not None and seq >= before_seq:
+                    continue
+                if len(text) > self.config.snippet_chars:
+                    text = text[:self.config.snippet_chars - 3] + "..."
+                tokens = estimate_tokens(text)
+                if tokens > budget:
+                    continue
+                budget -= tokens
+                snippets.append(text)
+                self.stats["recalled_tokens"] += tokens
+        if snippets:
+            self.stats["hits"] += 1
+        self.stats["recall_ms"] += (time.perf_counter() - start) * 1000
+        return snippets
+
+    def snapshot(self) -> dict:
+        recalls = self.stats["recalls"]
+        return {
+            **self.stats,
+            "recall_ms": round(self.stats["recall_ms"], 2),
+            "avg_recall_us": round(self.stats["recall_ms"] * 1000 / recalls, 1) if recalls else 0.0,
+            "hit_rate": round(self.stats["hits"] / recalls, 3) if recalls else 0.0,
+            "sessions": len(self._indexes),
+            "docs": sum(len(index.docs) for index in self._indexes.values()),
+        }
+
+
+def _line(role: str, text: str) -> str:
+    return f"{'用户' if role == 'user' else 'Ani'}: {text.strip()}"
+
+
+class MemoryArchive:
+    """A session's view of long-term memory (ConversationMemory.archive)"""
+
+    __slots__ = ("ltm", "session")
+
+    def __init__(self, ltm: LongTermMemory, session: str):
+        self.ltm = ltm
+        self.session = session
+        ltm._index(session)  # start loading persisted history now, not on the first recall
+
+    def add_turn(self, turn):
+        self.ltm.add(self.session, ("turn", turn.seq), _line(turn.role, turn.text), turn.seq, turn.ts)
+
+    def add_summary(self, summary: str, through_seq: int):
+        self.ltm.add(self.session, ("summary", through_seq), f"摘要: {summary}", through_seq)
+
+    def recall(self, query: str, before_seq: Optional[int] = None) -> List[str]:
+        return self.ltm.recall(self.session, query, before_seq)
+
+    def release(self):
+        """Drop the in-memory index (the session ended; persisted history reloads on return)"""
+        self.ltm._indexes.pop(self.session, None)
+
+
+# Testing
+def test_long_term_memory():
+    """Recall latency and relevance over a synthetic multi-session history"""
+    import random
+    from memory import ConversationMemory
+
+    print("=" * 60)
+    print("Testing LongTermMemory")
+    print("=" * 60)
+
+    random.seed(0)
+    ltm = LongTermMemory()
+    memory = ConversationMemory(max_tokens=200)
+    memory.archive = ltm.archive("user:demo")
+    topics = ["天气", "电影", "音乐", "猫", "咖啡", "旅行", "考试", "游戏", "football", "python"]
+    memory.add_user("我的猫叫小白，它最喜欢晒太阳")
+    memory.add_assistant("小白听起来好可爱！")
+    for i in range(900):  # ~1800 evicted turns, within max_docs
+        topic = random.choice(topics)
+        memory.add_user(f"我们再聊聊{topic}吧，第{i}次")
+        memory.add_assistant(f"好呀，关于{topic}我有很多想说的！")
+
+    for query in ["你还记得我的猫叫什么吗", "第42次我们聊了什么", "随便说点什么"]:
+        before = memory.turns[0].seq
+        start = time.perf_counter()
+        for _ in range(100):
+            snippets = ltm.recall("user:demo", query, before)
+        us = (time.perf_counter() - start) * 1e6 / 100
+        print(f"{query!r}: {us:.0f}us -> {snippets}")
+    print(f"Stats: {ltm.snapshot()}")
+
+
+if __name__ == "__main__":
+    test_long_term_memory()
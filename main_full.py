@@ -6,17 +6,29 @@ import asyncio
 import json
 import os
 import time
+import uuid
+
+PROCESS_START = time.time()  # startup timeline origin, taken before the heavy imports below
+
+from dotenv import load_dotenv
+load_dotenv()  # Load environment variables from .env file (before the module-level settings below read them)
+
 from typing import Dict, Optional, List, TYPE_CHECKING
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
 from fastapi.responses import HTMLResponse, FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, Field, field_validator
-import uvicorn
 
 from llm_pipeline import LLMPipeline, LLMConfig
 from tts_pipeline import TTSPipeline, TTSConfig
 from animation_controller import AnimationController
+from session import Turn, TurnManager
+from ws_sender import ConnectionSender
+from admission import AdmissionController, AdmissionConfig, Overloaded
+from speculation import SpeculationConfig, Speculator
+from startup import StartupTimeline, BACKGROUND
+from warmup import WarmupConfig, warm_audio, warm_llm, warm_tts
 
 if TYPE_CHECKING:
     from audio_pipeline import AudioPipeline, AudioConfig
@@ -49,7 +61,9 @@ class LatencyMetrics:
             "vad": [],
             "stt": [],
             "llm": [],
+            "prompt": [],
             "tts": [],
+            "cache": [],
             "total": []
         }
 
@@ -73,140 +87,303 @@ class LatencyMetrics:
 
 metrics = LatencyMetrics()
 
+# Barge-in: new speech cancels the reply in flight (disable if the mic picks up our own audio)
+BARGE_IN_ENABLED = os.getenv("BARGE_IN", "1").lower() in {"1", "true", "yes", "on"}
+
+# ?user_id= resumes a user's conversation memory. The server has no auth, so anyone could claim
+# any id: honour it only behind a trusted front end that sets it (otherwise memory is per connection)
+TRUST_CLIENT_USER_ID = os.getenv("ANI_TRUST_CLIENT_USER_ID", "0").lower() in {"1", "true", "yes", "on"}
+
+# Multi-worker mode: VAD/STT (and optionally TTS) live in a shared model host process
+# (see model_host.py and scripts/launch_workers.py); workers hold no model weights
+MODEL_HOST = os.getenv("MODEL_HOST")
+
+# Startup: "blocking" (default) serves once everything is loaded; "staged" serves at once and
+# reports progress on /health and /ready (rolling restarts put the node back into rotation sooner)
+STARTUP_MODE = os.getenv("ANI_STARTUP_MODE", "blocking").lower()
+startup = StartupTimeline(t0=PROCESS_START)
+startup.mark("imports_done")
+warmup_config = WarmupConfig.from_env()
+
+# Caps on sessions and per-stage concurrency (ANI_MAX_* env overrides); overflow gets a busy clip
+admission = AdmissionController(AdmissionConfig.from_env())
+speculation_config = SpeculationConfig.from_env()
+
+
+def create_audio_pipeline() -> "AudioPipeline":
+    """Local models, or a thin client of the model host when MODEL_HOST is set"""
+    if MODEL_HOST:
+        from model_host import create_remote_audio_pipeline
+        print(f"[INFO] Audio pipeline using model host at {MODEL_HOST}")
+        pipeline = create_remote_audio_pipeline(MODEL_HOST)
+    else:
+        from audio_pipeline import AudioPipeline as RuntimeAudioPipeline, AudioConfig as RuntimeAudioConfig
+        pipeline = RuntimeAudioPipeline(RuntimeAudioConfig())
+    if speculation_config.enabled:
+        # Partials at short pauses feed speculative LLM generation
+        pipeline.config.partial_silence_ms = speculation_config.partial_silence_ms
+    return pipeline
+
 # Global pipelines
 audio_pipeline: Optional["AudioPipeline"] = None
 llm_pipeline: Optional[LLMPipeline] = None
 tts_pipeline: Optional[TTSPipeline] = None
 animation_controller: Optional[AnimationController] = None
+audio_init: Optional[asyncio.Task] = None  # shared audio load, see start_audio_init()
 
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    """Initialize all pipelines on startup and cleanup on shutdown"""
-    global audio_pipeline, llm_pipeline, tts_pipeline, animation_controller
+async def run_warmup(stage: str, routine):
+    """Timeline stage wrapping one warm-up routine; failures only cost the warm-up"""
+    try:
+        async with startup.stage(stage, BACKGROUND) as entry:
+            entry["timings"] = await routine
+            print(f"[OK] {stage}: {entry['timings']}")
+    except Exception as e:
+        print(f"[WARN] {stage} failed: {e}")
 
-    print("=" * 60)
-    print("Initializing Ani v0 - Complete Voice Companion")
-    print("=" * 60)
 
-    # Initialize LLM pipeline
+async def init_llm():
+    """Core stage: LLM backend (+ knowledge base, loaded off the event loop)"""
+    global llm_pipeline
     try:
-        # Choose LLM backend:
-        # Option 1: Claude 3.5 Haiku (fast, intelligent, bilingual) ✨ ACTIVE
-        import os
-        from dotenv import load_dotenv
-        load_dotenv()  # Load environment variables from .env file
-
-        llm_config = LLMConfig(
-            backend="anthropic",
-            model="claude-3-5-haiku-20241022",  # Claude 3.5 Haiku (最新版本)
-            max_tokens=250,  # Increased to prevent JSON truncation (was 150)
-            temperature=0.8,  # More creative
-            openai_api_key=os.getenv("CLAUDE_API_KEY"),  # Load from .env file
-            character_name="Anita",
-            character_personality="""a sweet and energetic anime girl companion. You have a cheerful, bubbly personality and love making people smile! You're caring, supportive, and always eager to chat. You speak in a cute, friendly tone - like a close friend or a sweet younger sister. Express your emotions naturally through your words. You enjoy casual conversations, sharing joy and excitement with people. When speaking in Chinese, use natural spoken language (口语化) instead of formal written language. Keep responses short and conversational since this is voice chat."""
-        )
-
-        # Option 2: Mock (fast, for testing 3D avatar)
-        # llm_config = LLMConfig(
-        #     backend="mock",
-        #     model="mock",
-        #     character_name="Anita",
-        #     character_personality="a sweet and energetic anime girl companion who loves chatting and making people smile"
-        # )
-
-        # Option 3: Ollama (local, free) - using Qwen2.5 for Chinese support
-        # llm_config = LLMConfig(
-        #     backend="ollama",
-        #     model="qwen2.5:7b",  # Bilingual EN+ZH model
-        #     max_tokens=150,  # Shorter responses = faster
-        #     temperature=0.8,  # More creative
-        #     character_name="Anita",
-        #     character_personality="a sweet and energetic anime girl companion who loves chatting and making people smile"
-        # )
-
-        # Option 4: OpenAI (GPT-4, GPT-3.5-turbo) - requires API key with credits
-        # llm_config = LLMConfig(
-        #     backend="openai",
-        #     model="gpt-4o-mini",
-        #     openai_api_key="YOUR_OPENAI_KEY_HERE",
-        #     character_name="Anita",
-        #     character_personality="a sweet and energetic anime girl companion who loves chatting and making people smile"
-        # )
-
-        llm_pipeline = LLMPipeline(llm_config)
-        await llm_pipeline.initialize()
+        async with startup.stage("llm"):
+            # Choose LLM backend:
+            # Option 1: Claude 3.5 Haiku (fast, intelligent, bilingual) ✨ ACTIVE
+            llm_config = LLMConfig(
+                backend="anthropic",
+                model="claude-3-5-haiku-20241022",  # Claude 3.5 Haiku (最新版本)
+                max_tokens=250,  # Increased to prevent JSON truncation (was 150)
+                temperature=0.8,  # More creative
+                openai_api_key=os.getenv("CLAUDE_API_KEY"),  # Load from .env file
+                character_name="Anita",
+                character_personality="""a sweet and energetic anime girl companion. You have a cheerful, bubbly personality and love making people smile! You're caring, supportive, and always eager to chat. You speak in a cute, friendly tone - like a close friend or a sweet younger sister. Express your emotions naturally through your words. You enjoy casual conversations, sharing joy and excitement with people. When speaking in Chinese, use natural spoken language (口语化) instead of formal written language. Keep responses short and conversational since this is voice chat."""
+            )
+
+            # Option 2: Mock (fast, for testing 3D avatar)
+            # llm_config = LLMConfig(
+            #     backend="mock",
+            #     model="mock",
+            #     character_name="Anita",
+            #     character_personality="a sweet and energetic anime girl companion who loves chatting and making people smile"
+            # )
+
+            # Option 3: Ollama (local, free) - using Qwen2.5 for Chinese support
+            # llm_config = LLMConfig(
+            #     backend="ollama",
+            #     model="qwen2.5:7b",  # Bilingual EN+ZH model
+            #     max_tokens=150,  # Shorter responses = faster
+            #     temperature=0.8,  # More creative
+            #     character_name="Anita",
+            #     character_personality="a sweet and energetic anime girl companion who loves chatting and making people smile"
+            # )
+
+            # Option 4: OpenAI (GPT-4, GPT-3.5-turbo) - requires API key with credits
+            # llm_config = LLMConfig(
+            #     backend="openai",
+            #     model="gpt-4o-mini",
+            #     openai_api_key="YOUR_OPENAI_KEY_HERE",
+            #     character_name="Anita",
+            #     character_personality="a sweet and energetic anime girl companion who loves chatting and making people smile"
+            # )
+
+            # Environment overrides (e.g. ANI_LLM_BACKEND=mock for offline load tests)
+            if os.getenv("ANI_LLM_BACKEND"):
+                llm_config.backend = os.getenv("ANI_LLM_BACKEND")
+                llm_config.model = os.getenv("ANI_LLM_MODEL", "mock" if llm_config.backend == "mock" else llm_config.model)
+            if llm_config.backend == "router":
+                # ANI_LLM_ROUTER="anthropic,ollama:qwen2.5:7b" (name[:model], primary first)
+                for item in os.getenv("ANI_LLM_ROUTER", "anthropic,ollama:qwen2.5:7b").split(","):
+                    name, _, model = item.strip().partition(":")
+                    llm_config.router_backends.append(name)
+                    if model:
+                        llm_config.router_overrides.setdefault(name, {})["model"] = model
+                if os.getenv("OPENAI_API_KEY"):
+                    llm_config.router_overrides.setdefault("openai", {})["openai_api_key"] = os.getenv("OPENAI_API_KEY")
+            if os.getenv("OLLAMA_HOST"):
+                llm_config.ollama_host = os.getenv("OLLAMA_HOST")
+            llm_config.ollama_keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", llm_config.ollama_keep_alive)
+
+            pipeline = LLMPipeline(llm_config)
+            await pipeline.initialize()
+            llm_pipeline = pipeline
     except Exception as e:
         print(f"[WARN] LLM initialization failed: {e}")
 
-    # Initialize TTS pipeline
-    try:
-        # Choose TTS engine:
-        # - "edge": Fast (<1s), natural Microsoft voice, supports Chinese ✨ FASTEST
-        # - "coqui": High-quality (5-7s), voice cloning, custom voice
-
-        # Option 1: Edge TTS ✨ ACTIVE - Auto-switching between Chinese and English voices
-        tts_config = TTSConfig(
-            engine="edge",
-            voice="zh-CN-XiaomengNeural",  # Default fallback voice
-            voice_cn="zh-CN-XiaomengNeural",  # Chinese voice - cute, youthful loli voice
-            voice_en="en-US-SaraNeural",  # English voice - friendly, cheerful, expressive loli voice
-            rate="+5%",  # Speech rate
-            pitch="+10Hz",  # Higher pitch for cute anime voice
-            use_ssml=False  # Disabled to prevent XML tags being read aloud
-        )
+    if warmup_config.enabled and warmup_config.llm:
+        if llm_pipeline is None:
+            startup.skip("warmup_llm", "LLM unavailable")
+        else:
+            await run_warmup("warmup_llm", warm_llm(llm_pipeline, warmup_config))
+
 
-        # Option 2: Coqui XTTS-v2 (NOT COMPATIBLE with Python 3.12)
-        # Requires Python 3.9-3.11 only
-        # Auto-switches between Chinese and English voice samples
-        # tts_config = TTSConfig(
-        #     engine="coqui",
-        #     voice="tts_models/multilingual/multi-dataset/xtts_v2",
-        #     speaker_wav_cn="voice_samples/luoli_cn.wav",  # Chinese loli voice
-        #     speaker_wav_en="voice_samples/luoli_en.wav",  # English loli voice
-        #     language="auto"  # Auto-detect language
-        # )
-
-        tts_pipeline = TTSPipeline(tts_config)
-        await tts_pipeline.initialize()
+async def init_tts():
+    """Core stage: TTS engines; then the busy clips in the background"""
+    global tts_pipeline
+    try:
+        async with startup.stage("tts"):
+            # Choose TTS engine:
+            # - "edge": Fast (<1s), natural Microsoft voice, supports Chinese ✨ FASTEST
+            # - "coqui": High-quality (5-7s), voice cloning, custom voice
+
+            # Option 1: Edge TTS ✨ ACTIVE - Auto-switching between Chinese and English voices
+            tts_config = TTSConfig(
+                engine="edge",
+                voice="zh-CN-XiaomengNeural",  # Default fallback voice
+                voice_cn="zh-CN-XiaomengNeural",  # Chinese voice - cute, youthful loli voice
+                voice_en="en-US-SaraNeural",  # English voice - friendly, cheerful, expressive loli voice
+                rate="+5%",  # Speech rate
+                pitch="+10Hz",  # Higher pitch for cute anime voice
+                use_ssml=False,  # Disabled to prevent XML tags being read aloud
+                fallback_engines=["pyttsx3"],  # offline last resort; add "coqui" (with coqui_model) to fail over to XTTS
+            )
+
+            # Option 2: Coqui XTTS-v2 (NOT COMPATIBLE with Python 3.12)
+            # Requires Python 3.9-3.11 only
+            # Auto-switches between Chinese and English voice samples
+            # tts_config = TTSConfig(
+            #     engine="coqui",
+            #     coqui_model="tts_models/multilingual/multi-dataset/xtts_v2",
+            #     speaker_wav_cn="voice_samples/luoli_cn.wav",  # Chinese loli voice
+            #     speaker_wav_en="voice_samples/luoli_en.wav",  # English loli voice
+            #     language="auto"  # Auto-detect language
+            # )
+
+            # Environment overrides (e.g. ANI_TTS_ENGINE=stub for offline load tests)
+            if os.getenv("ANI_TTS_ENGINE"):
+                tts_config.engine = os.getenv("ANI_TTS_ENGINE")
+                if tts_config.engine == "stub":
+                    tts_config.fallback_engines = []
+                    tts_config.stub_latency_ms = float(os.getenv("ANI_TTS_STUB_LATENCY_MS", tts_config.stub_latency_ms))
+
+            if MODEL_HOST and os.getenv("MODEL_HOST_TTS", "0").lower() in {"1", "true", "yes", "on"}:
+                # Multi-worker mode: synthesize on the shared model host, keep Edge as fallback
+                tts_config.fallback_engines = [tts_config.engine] + [
+                    name for name in tts_config.fallback_engines if name != tts_config.engine
+                ]
+                tts_config.engine = "remote"
+
+            pipeline = TTSPipeline(tts_config)
+            await pipeline.initialize()
+            tts_pipeline = pipeline
     except Exception as e:
         print(f"[WARN] TTS initialization failed: {e}")
 
-    # Initialize Audio pipeline (optional)
-    enable_audio = os.getenv("ENABLE_AUDIO_PIPELINE", "0").lower() in {"1", "true", "yes", "on"}
-    if enable_audio:
-        try:
-            from audio_pipeline import AudioPipeline as RuntimeAudioPipeline, AudioConfig as RuntimeAudioConfig
-            audio_config = RuntimeAudioConfig()
-            audio_pipeline = RuntimeAudioPipeline(audio_config)
-            await audio_pipeline.load_models()
-        except ImportError as e:
-            print(f"[WARN] Audio pipeline dependencies missing: {e}")
-        except Exception as e:
-            print(f"[WARN] Audio pipeline initialization failed: {e}")
-    else:
-        print("[INFO] Audio pipeline disabled (set ENABLE_AUDIO_PIPELINE=1 to enable server-side VAD/STT)")
+    if tts_pipeline is None or not tts_pipeline.is_ready:
+        startup.skip("busy_clips", "TTS unavailable")
+        if warmup_config.enabled and warmup_config.tts:
+            startup.skip("warmup_tts", "TTS unavailable")
+        return
+    if warmup_config.enabled and warmup_config.tts:
+        await run_warmup("warmup_tts", warm_tts(tts_pipeline, warmup_config))
+    try:
+        async with startup.stage("busy_clips", BACKGROUND):
+            await admission.prepare_busy_clips(tts_pipeline)
+    except Exception as e:
+        print(f"[WARN] Busy clips not prepared: {e}")
+
 
-    # Initialize Animation Controller (3D character via VSeeFace)
+async def init_audio() -> Optional["AudioPipeline"]:
+    """Background stage: VAD/STT models (torch is imported here, not at startup)"""
+    global audio_pipeline
     try:
-        animation_controller = AnimationController(host="127.0.0.1", port=39539)
-        if animation_controller.connected:
-            print("[OK] Animation controller connected to VSeeFace")
-        else:
-            print("[INFO] VSeeFace not running - animations disabled (voice will work)")
+        async with startup.stage("audio", BACKGROUND):
+            pipeline = create_audio_pipeline()
+            await pipeline.load_models()
+    except ImportError as e:
+        print(f"[WARN] Audio pipeline dependencies missing: {e}")
     except Exception as e:
-        print(f"[WARN] Animation controller initialization failed: {e}")
-        animation_controller = None
+        print(f"[WARN] Audio pipeline initialization failed: {e}")
+    else:
+        # Warm before publishing the pipeline so the first session never pays for it
+        if warmup_config.enabled and warmup_config.audio:
+            await run_warmup("warmup_audio", warm_audio(pipeline, warmup_config))
+        audio_pipeline = pipeline
+        return pipeline
+    if warmup_config.enabled and warmup_config.audio:
+        startup.skip("warmup_audio", "audio pipeline unavailable")
+    return None
+
+
+def start_audio_init() -> "asyncio.Task[Optional[AudioPipeline]]":
+    """
+    The one audio load in progress (started here if there is none): startup and
+    sessions that need audio early all await it instead of loading their own copy.
+    A failed load is retried by the next caller.
+    """
+    global audio_init
+    if audio_init is None or (audio_init.done() and audio_pipeline is None):
+        audio_init = asyncio.create_task(init_audio())
+    return audio_init
 
+
+async def init_animation():
+    """Background stage: VSeeFace OSC connection"""
+    global animation_controller
+    async with startup.stage("animation", BACKGROUND):
+        try:
+            animation_controller = AnimationController(host="127.0.0.1", port=39539)
+            if animation_controller.connected:
+                print("[OK] Animation controller connected to VSeeFace")
+            else:
+                print("[INFO] VSeeFace not running - animations disabled (voice will work)")
+        except Exception as e:
+            print(f"[WARN] Animation controller initialization failed: {e}")
+            animation_controller = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize all pipelines (in parallel) on startup and cleanup on shutdown"""
     print("=" * 60)
-    print("[OK] Ani v0 Server Ready!")
+    print("Initializing Ani v0 - Complete Voice Companion")
     print("=" * 60)
+    startup.mark("lifespan_start")
+
+    startup.expect("llm")
+    startup.expect("tts")
+    startup.expect("busy_clips", BACKGROUND)
+    startup.expect("animation", BACKGROUND)
+    if warmup_config.enabled:
+        # Declared up front so /ready?full=true and "ready" wait for warm-up too
+        if warmup_config.tts:
+            startup.expect("warmup_tts", BACKGROUND)
+        if warmup_config.llm:
+            startup.expect("warmup_llm", BACKGROUND)
+    enable_audio = os.getenv("ENABLE_AUDIO_PIPELINE", "0").lower() in {"1", "true", "yes", "on"}
+    if enable_audio:
+        startup.expect("audio", BACKGROUND)
+        if warmup_config.enabled and warmup_config.audio:
+            startup.expect("warmup_audio", BACKGROUND)
+    else:
+        startup.skip("audio", "ENABLE_AUDIO_PIPELINE=0")
+        print("[INFO] Audio pipeline disabled (set ENABLE_AUDIO_PIPELINE=1 to enable server-side VAD/STT)")
+
+    # Heavy loads run side by side instead of one after another
+    init_tasks = [asyncio.create_task(init_llm()), asyncio.create_task(init_tts()),
+                  asyncio.create_task(init_animation())]
+    if enable_audio:
+        init_tasks.append(start_audio_init())
+
+    if STARTUP_MODE == "staged":
+        # Accept connections now; load balancers poll /ready while models load
+        print("[INFO] Staged startup: serving /health and /ready while pipelines load")
+    else:
+        await asyncio.gather(*init_tasks, return_exceptions=True)
+        print("=" * 60)
+        print(f"[OK] Ani v0 Server Ready! ({startup.snapshot()['ready_after_ms']:.0f}ms since process start)")
+        print("=" * 60)
+    startup.mark("accepting_connections")
 
     yield  # Server runs here
 
     # Cleanup on shutdown
+    for task in init_tasks + ([audio_init] if audio_init is not None else []):
+        if not task.done():
+            task.cancel()
     if animation_controller:
         animation_controller.close()
+    if llm_pipeline:
+        await llm_pipeline.close()
     print("[INFO] Server shutdown complete")
 
 
@@ -264,25 +441,43 @@ app.mount("/animations", StaticFiles(directory="animations"), name="animations")
 async def health():
     return {
         "status": "healthy",
+        "readiness": startup.status,
+        "startup": startup.snapshot(),
         "pipelines": {
             "audio": audio_pipeline.vad.is_loaded if audio_pipeline else False,
             "llm": llm_pipeline.is_ready if llm_pipeline else False,
             "tts": tts_pipeline.is_ready if tts_pipeline else False,
             "animation": animation_controller.connected if animation_controller else False
         },
+        "memory": llm_pipeline.sessions.snapshot() if llm_pipeline and llm_pipeline.sessions is not None else {},
         "latency_stats": {
             stage: metrics.get_stats(stage)
             for stage in metrics.metrics.keys()
-        }
+        },
+        "tts_engines": tts_pipeline.get_health() if tts_pipeline else {},
+        "worker": {"pid": os.getpid(), "model_host": MODEL_HOST}
     }
 
 
+@app.get("/ready")
+async def ready(full: bool = False):
+    """Readiness probe: 200 once core pipelines are up (full=true waits for every stage)"""
+    status = startup.status
+    ok = status == "ready" if full else status != "starting"
+    return Response(
+        content=json.dumps({"status": status, "degraded": startup.degraded}),
+        media_type="application/json",
+        status_code=200 if ok else 503
+    )
+
+
 @app.post("/api/synthesize")
 async def synthesize_speech(request: Request):
     """Synthesize speech from text using Coqui TTS"""
     try:
         body = await request.json()
         text = body.get("text", "")
+        sample_rate = body.get("sample_rate")
 
         if not text:
             return Response(content=b"", status_code=400)
@@ -291,7 +486,9 @@ async def synthesize_speech(request: Request):
             return Response(content=b"", status_code=503)
 
         # Generate speech using Coqui TTS
-        result = await tts_pipeline.synthesize_with_phonemes(text)
+        result = await tts_pipeline.synthesize_with_phonemes(
+            text, sample_rate=int(sample_rate) if sample_rate else None
+        )
         audio_bytes = result["audio"]
 
         # Return audio as WAV
@@ -311,11 +508,22 @@ async def synthesize_speech(request: Request):
 async def get_metrics():
     """Get detailed latency metrics"""
     return {
-        stage: {
-            **metrics.get_stats(stage),
-            "recent": metrics.metrics[stage][-10:] if metrics.metrics[stage] else []
+        **{
+            stage: {
+                **metrics.get_stats(stage),
+                "recent": metrics.metrics[stage][-10:] if metrics.metrics[stage] else []
+            }
+            for stage in metrics.metrics.keys()
+        },
+        "turns": dict(TurnManager.totals),
+        "send_queues": ConnectionSender.snapshot_all(),
+        "admission": admission.snapshot(),
+        "llm": llm_pipeline.get_metrics() if llm_pipeline else {},
+        "speculation": Speculator.snapshot(),
+        "coalescing": {
+            "llm": llm_pipeline.singleflight.snapshot() if llm_pipeline else {},
+            "tts": tts_pipeline.singleflight.snapshot() if tts_pipeline else {}
         }
-        for stage in metrics.metrics.keys()
     }
 
 
@@ -363,34 +571,98 @@ async def websocket_endpoint(websocket: WebSocket):
     Supports: text input, JSON messages
     """
     await websocket.accept()
-    print("[Client] Connected")
+    if not admission.open_session():
+        print("[Admission] Session rejected (at capacity)")
+        await websocket.send_json({"type": "error", "error": "Server busy, please retry shortly", "retry": True})
+        await websocket.close(code=1013)  # Try Again Later
+        return
+    # Conversation memory is per session: a trusted user_id resumes it across reconnects
+    connection_id = uuid.uuid4().hex
+    user_id = websocket.query_params.get("user_id") if TRUST_CLIENT_USER_ID else None
+    session_id = f"user:{user_id}" if user_id else f"conn:{connection_id}"
+    print(f"[Client] Connected ({session_id})")
+
+    # All outgoing messages go through one bounded, prioritized writer task
+    sender = ConnectionSender(websocket)
+    sender.start()
 
     # Per-connection state for streaming audio (optional)
     audio_queue: Optional[asyncio.Queue] = None
     asr_task: Optional[asyncio.Task] = None
+    session_sample_rate: Optional[int] = None  # playback rate requested by the client
+    speculator: Optional[Speculator] = None  # opt-in speculative LLM on partial transcripts
+
+    def send_state(value: str):
+        sender.send({"type": "state", "value": value})
+
+    async def on_interrupted(turn: Turn, spoken_text: str):
+        """Tell the client to stop playback and keep memory honest about what was heard"""
+        memory = llm_pipeline.memory_for(session_id) if turn.assistant_text and llm_pipeline else None
+        if memory is not None:
+            memory.mark_interrupted(spoken_text)
+        sender.drop_turn(turn.turn_id)
+        sender.send({
+            "type": "interrupted",
+            "turn_id": turn.turn_id,
+            "spoken_text": spoken_text
+        })
+
+    turns = TurnManager(on_interrupted=on_interrupted)
+
+    def send_busy(user_text: str, turn: Optional[Turn], stage: str):
+        """Shed this turn: answer instantly with the cached busy clip"""
+        text, clip = admission.busy_clip(user_text, session_sample_rate)
+        turn_id = turn.turn_id if turn is not None else None
+        print(f"[Admission] Turn shed at {stage}")
+        send_state("busy")
+        if clip is not None:
+            import base64
+            sender.send({
+                "type": "audio",
+                "audio": base64.b64encode(clip["audio"]).decode('utf-8'),
+                "text": text,
+                "sample_rate": clip["sample_rate"],
+                "turn_id": turn_id
+            }, turn_id=turn_id)
+        sender.send({"status": "busy", "stage": stage, "data": {"utterance": text}}, turn_id=turn_id)
+
+    async def gated_transcribe(audio, language=None) -> str:
+        """STT behind the admission gate; an overloaded box drops the utterance with a busy reply"""
+        try:
+            async with admission.slot("stt"):
+                return await audio_pipeline.stt.transcribe(audio, language=language)
+        except Overloaded as e:
+            admission.record_shed()
+            send_busy("", None, e.stage)
+            return ""
+
+    async def partial_transcribe(audio, language=None) -> Optional[str]:
+        """Partials are optional: transcribed only on a free STT slot, skipped silently (None) otherwise"""
+        try:
+            async with admission.try_slot("stt"):
+                return await audio_pipeline.stt.transcribe(audio, language=language, partial=True)
+        except Overloaded:
+            return None
 
-    async def send_state(value: str):
+    async def run_turn(user_text: str, turn: Turn):
+        """Turn body: errors are reported to the client, cancellation propagates"""
         try:
-            await websocket.send_json({"type": "state", "value": value})
-        except Exception:
-            pass
+            await generate_and_send(user_text, turn)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[FAIL] Turn error: {e}")
+            sender.send({"status": "error", "error": str(e), "type": type(e).__name__})
+
+    def start_turn(user_text: str) -> Turn:
+        return turns.start(user_text, lambda turn: run_turn(user_text, turn))
 
     async def ensure_audio_pipeline_ready():
-        """Lazily initialize audio pipeline if not ready"""
-        global audio_pipeline
+        """Wait for the shared audio load (starting it lazily if audio is off at startup)"""
         if audio_pipeline:
             return True
-        try:
-            from audio_pipeline import AudioPipeline as RuntimeAudioPipeline, AudioConfig as RuntimeAudioConfig
-            cfg = RuntimeAudioConfig()
-            ap = RuntimeAudioPipeline(cfg)
-            await ap.load_models()
-            audio_pipeline = ap
-            print("[OK] Audio pipeline initialized (lazy)")
-            return True
-        except Exception as e:
-            print(f"[WARN] Unable to initialize audio pipeline lazily: {e}")
-            return False
+        # shield: a session going away must not cancel the load other sessions are waiting on
+        return await asyncio.shield(start_audio_init()) is not None
 
     async def start_asr_loop():
         """Start ASR loop consuming from the connection queue and triggering LLM/TTS on finals"""
@@ -408,30 +680,76 @@ async def websocket_endpoint(websocket: WebSocket):
             if not text:
                 return
             print(f"[ASR] Final: {text}")
-            asyncio.create_task(generate_and_send(text))
+            start_turn(text)
+
+        def on_speech_start():
+            if BARGE_IN_ENABLED:
+                asyncio.create_task(turns.interrupt("speech"))
+
+        def on_partial(text: str):
+            nonlocal speculator
+            if not (llm_pipeline and llm_pipeline.is_ready):
+                return
+            if speculator is None:
+                speculator = Speculator(
+                    llm_pipeline, speculation_config,
+                    gate=admission.gates["llm"],  # speculates only on a free LLM slot
+                    session=session_id
+                )
+            speculator.on_partial(text)
 
         try:
-            await audio_pipeline.process_audio_stream(generator(), on_final=on_final)
+            await audio_pipeline.process_audio_stream(
+                generator(), on_final=on_final, on_speech_start=on_speech_start,
+                on_partial=on_partial if speculation_config.enabled else None,
+                transcribe=gated_transcribe, transcribe_partial=partial_transcribe,
+                stream=connection_id
+            )
         except Exception as e:
             print(f"[FAIL] ASR loop error: {e}")
 
-    async def generate_and_send(user_text: str):
+    async def generate_and_send(user_text: str, turn: Optional[Turn] = None):
         """Shared path: user text -> LLM -> TTS -> frontend events"""
         total_start = time.time()
-        await send_state("thinking")
+        if not admission.admit_turn():
+            send_busy(user_text, turn, "admission")
+            return
+        send_state("thinking")
 
         if llm_pipeline and llm_pipeline.is_ready:
             # Generate LLM response
             llm_start = time.time()
-            llm_response = await llm_pipeline.generate_response(user_text)
+            # A matching speculative reply (started on the partial transcript) or
+            # cached small talk needs no LLM slot
+            llm_response = await speculator.take(user_text) if speculator is not None else None
+            if llm_response is None:
+                llm_response = llm_pipeline.cached_response(user_text, session=session_id)
+            if llm_response is None:
+                try:
+                    async with admission.slot("llm"):
+                        llm_response = await llm_pipeline.generate_response(
+                            user_text, lookup_cache=False, session=session_id
+                        )
+                except Overloaded as e:
+                    admission.record_shed()
+                    send_busy(user_text, turn, e.stage)
+                    return
             llm_latency = (time.time() - llm_start) * 1000
-            metrics.add_metric("llm", llm_latency)
+            cache_hit = llm_response.get("cache_hit", False)
+            if not cache_hit:
+                metrics.add_metric("llm", llm_latency)
+            if "prompt" in llm_response:
+                metrics.add_metric("prompt", llm_response["prompt"]["build_ms"])
 
             utterance = llm_response['utterance']
+            if turn is not None:
+                turn.assistant_text = utterance
+                turn.stage = "tts"
             print(f"[User] {user_text}")
             print(f"[Ani] {utterance}")
             print(f"[Emote] {llm_response['emote']['type']} ({llm_response['emote']['intensity']})")
-            print(f"[LLM Latency] {llm_latency:.0f}ms")
+            tag = " (cached)" if cache_hit else " (speculative)" if llm_response.get("speculative") else ""
+            print(f"[LLM Latency] {llm_latency:.0f}ms{tag}")
 
             # Trigger character expression animation
             if animation_controller and animation_controller.connected:
@@ -440,7 +758,7 @@ async def websocket_endpoint(websocket: WebSocket):
                 asyncio.create_task(animation_controller.set_expression(emotion, intensity))
 
             # Send emotion to frontend
-            await websocket.send_json({
+            sender.send({
                 "type": "emotion",
                 "emotion": llm_response['emote']['type'],
                 "intensity": llm_response['emote']['intensity']
@@ -448,28 +766,55 @@ async def websocket_endpoint(websocket: WebSocket):
 
             # Send gesture to frontend if present
             if 'gesture' in llm_response and llm_response['gesture'] != 'none':
-                await websocket.send_json({
+                sender.send({
                     "type": "gesture",
                     "gesture": llm_response['gesture']
                 })
                 print(f"[Gesture] {llm_response['gesture']}")
 
             # Generate and send audio
-            if tts_pipeline and tts_pipeline.is_ready:
-                import base64
-                await send_state("speaking")
+            tts_result = None
+            cache_key = llm_response.get("cache_key")
+            if cache_hit and llm_pipeline.response_cache is not None:
+                tts_result = llm_pipeline.response_cache.get_audio(cache_key, session_sample_rate)
+                tts_latency = 0.0
+            if tts_result is not None:
+                send_state("speaking")
+            elif tts_pipeline and tts_pipeline.is_ready:
+                send_state("speaking")
                 tts_start = time.time()
-                tts_result = await tts_pipeline.synthesize_with_phonemes(llm_response["utterance"])
+                try:
+                    async with admission.slot("tts"):
+                        tts_result = await tts_pipeline.synthesize_with_phonemes(
+                            llm_response["utterance"], sample_rate=session_sample_rate
+                        )
+                except Overloaded:
+                    # The reply is already generated: degrade to text-only rather than drop it
+                    print("[Admission] TTS at capacity, sending text only")
+                    tts_result = None
                 tts_latency = (time.time() - tts_start) * 1000
-                metrics.add_metric("tts", tts_latency)
+                if tts_result is not None:
+                    metrics.add_metric("tts", tts_latency)
+                    if cache_key is not None and llm_pipeline.response_cache is not None:
+                        llm_pipeline.response_cache.attach_audio(cache_key, session_sample_rate, tts_result)
+
+            if tts_result is not None:
+                import base64
+                audio_base64 = tts_result.get("audio_b64") or base64.b64encode(tts_result["audio"]).decode('utf-8')
 
-                audio_base64 = base64.b64encode(tts_result["audio"]).decode('utf-8')
+                def on_audio_sent():
+                    # Playback starts when the frame actually leaves, not when it is queued
+                    if turn is not None and turn.stage != "interrupted":
+                        turn.audio_sent_at = time.time()
+                        turn.audio_duration_ms = tts_result["duration_ms"]
 
-                await websocket.send_json({
+                sender.send({
                     "type": "audio",
                     "audio": audio_base64,
-                    "text": llm_response["utterance"]
-                })
+                    "text": llm_response["utterance"],
+                    "sample_rate": tts_result["sample_rate"],
+                    "turn_id": turn.turn_id if turn is not None else None
+                }, turn_id=turn.turn_id if turn is not None else None, on_sent=on_audio_sent)
 
                 print(f"[TTS Latency] {tts_latency:.0f}ms")
 
@@ -484,12 +829,15 @@ async def websocket_endpoint(websocket: WebSocket):
                     "phoneme_hints": llm_response.get("phoneme_hints", [])
                 },
                 "llm_latency_ms": llm_latency,
+                "cache_hit": cache_hit,
                 "total_latency_ms": (time.time() - total_start) * 1000
             }
+            if cache_hit:
+                metrics.add_metric("cache", response["total_latency_ms"])
 
-            await websocket.send_json(response)
+            sender.send(response, turn_id=turn.turn_id if turn is not None else None)
         else:
-            await websocket.send_json({
+            sender.send({
                 "status": "error",
                 "error": "LLM pipeline not ready"
             })
@@ -514,7 +862,14 @@ async def websocket_endpoint(websocket: WebSocket):
 
                         if not user_text:
                             continue
-                        await generate_and_send(user_text)
+                        start_turn(user_text)
+
+                    # Session settings (e.g. the client's AudioContext rate)
+                    elif json_msg.get("type") == "session_config":
+                        rate = json_msg.get("sample_rate")
+                        if rate:
+                            session_sample_rate = int(rate)
+                        sender.send({"type": "session_config", "sample_rate": session_sample_rate})
 
                     # Handle audio chunk (JSON base64 -> raw PCM16)
                     elif json_msg.get("type") == "audio_chunk":
@@ -523,7 +878,7 @@ async def websocket_endpoint(websocket: WebSocket):
                         # Beware: noisy, keep minimal
                         # print("[WS] audio_chunk received")
                         if not await ensure_audio_pipeline_ready():
-                            await websocket.send_json({"type": "error", "error": "Audio pipeline unavailable"})
+                            sender.send({"type": "error", "error": "Audio pipeline unavailable"})
                             continue
                         if audio_queue is None:
                             audio_queue = asyncio.Queue(maxsize=50)
@@ -548,7 +903,7 @@ async def websocket_endpoint(websocket: WebSocket):
                     # Handle generic JSON (for testing)
                     elif all(k in json_msg for k in ["utterance", "emote", "intent"]):
                         validated = LLMResponse(**json_msg)
-                        await websocket.send_json({
+                        sender.send({
                             "status": "success",
                             "validated": True,
                             "data": validated.model_dump()
@@ -556,19 +911,19 @@ async def websocket_endpoint(websocket: WebSocket):
 
                     else:
                         # Echo back unknown messages
-                        await websocket.send_json({
+                        sender.send({
                             "status": "success",
                             "validated": False,
                             "echo": json_msg
                         })
 
                 except json.JSONDecodeError:
-                    await websocket.send_json({
+                    sender.send({
                         "status": "error",
                         "error": "Invalid JSON"
                     })
                 except Exception as e:
-                    await websocket.send_json({
+                    sender.send({
                         "status": "error",
                         "error": str(e),
                         "type": type(e).__name__
@@ -576,7 +931,7 @@ async def websocket_endpoint(websocket: WebSocket):
             elif "bytes" in message:
                 # Binary audio chunk (raw PCM16)
                 if not await ensure_audio_pipeline_ready():
-                    await websocket.send_json({"type": "error", "error": "Audio pipeline unavailable"})
+                    sender.send({"type": "error", "error": "Audio pipeline unavailable"})
                     continue
                 if audio_queue is None:
                     audio_queue = asyncio.Queue(maxsize=50)
@@ -594,6 +949,13 @@ async def websocket_endpoint(websocket: WebSocket):
     except WebSocketDisconnect:
         print("[Client] Disconnected")
     finally:
+        if speculator is not None:
+            speculator.cancel()
+        if not user_id and llm_pipeline and llm_pipeline.sessions is not None:
+            llm_pipeline.sessions.drop(session_id)  # anonymous connections can't come back
+        admission.close_session()
+        await turns.close()
+        await sender.close()
         # Cleanup: stop ASR task and drain queue
         if audio_queue is not None:
             try:
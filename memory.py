@@ -1,9 +1,19 @@
 from __future__ import annotations
 
+import asyncio
+import copy
+import os
+from collections import OrderedDict, deque
 from dataclasses import dataclass, field
-from typing import List, Optional
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
 import time
 
+from text_utils import TokenEstimator, estimate_tokens
+
+
+# (previous summary, rendered lines of the turns to fold in) -> new summary
+Summarizer = Callable[[str, List[str]], Awaitable[str]]
+
 
 @dataclass
 class ConversationTurn:
@@ -11,21 +21,52 @@ class ConversationTurn:
     text: str
     emote: Optional[str] = None
     ts: float = field(default_factory=time.time)
+    interrupted: bool = False  # user barged in before the reply finished
+    line: str = field(default="", repr=False)  # rendered prompt line (cached)
+    tokens: int = 0  # estimated tokens of `line`
+    seq: int = 0  # position in the session (persistence key)
 
 
 class ConversationMemory:
     """
-    Lightweight in-memory conversation window + naive summarization.
-    - Keeps the last `max_turns` turns for prompt context.
-    - Every `summary_interval` pairs (user+assistant), builds a short summary.
+    In-memory conversation window bounded by a token budget + rolling summary.
+    - Turns live in a deque; the oldest are evicted once the window exceeds
+      `max_tokens` (and `max_turns`, if set). The latest turn always stays.
+    - Each turn's prompt line and token count are computed once; the context
+      block is cached and rebuilt from those lines only after a change.
+    - Evicted turns are folded into the summary. Without a summarizer the
+      summary is their truncated text, oldest dropped to fit `summary_max_tokens`.
+      With one (e.g. the LLM), every `summary_interval` evicted turns are
+      compressed in a background task; replies never wait for it.
     """
 
-    def __init__(self, max_turns: int = 8, summary_interval: int = 4):
+    def __init__(
+        self,
+        max_turns: Optional[int] = None,
+        summary_interval: int = 4,
+        max_tokens: int = 400,
+        summary_max_tokens: int = 150,
+        estimator: TokenEstimator = estimate_tokens,
+        summarizer: Optional[Summarizer] = None,
+    ):
         self.max_turns = max_turns
         self.summary_interval = summary_interval
-        self.turns: List[ConversationTurn] = []
-        self.summary: str = ""
-        self._pairs_since_summary = 0
+        self.max_tokens = max_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.estimator = estimator
+        self.summarizer = summarizer
+        self.turns: Deque[ConversationTurn] = deque()
+        self.window_tokens = 0
+        self._base_summary = ""  # compressed by the summarizer
+        self._pending: Deque[Tuple[str, int, int]] = deque()  # (piece, tokens, seq) of evicted turns not yet compressed
+        self._pending_tokens = 0
+        self._summary: Optional[str] = None  # rendered summary (cache)
+        self._block: Optional[str] = None  # rendered context block (cache)
+        self._task: Optional[asyncio.Task] = None
+        self._seq = 0
+        self.sink = None  # persistence (memory_store.SessionSink): save_turn(turn), save_summary(text, through_seq)
+        self.archive = None  # long-term memory (long_term_memory.MemoryArchive): evicted turns and summaries
+        self.stats = {"evicted": 0, "summaries": 0, "summary_failures": 0}
 
     def add_user(self, text: str):
         if not text:
@@ -36,40 +77,311 @@ class ConversationMemory:
         if not text:
             return
         self._append(ConversationTurn(role="assistant", text=text, emote=emote))
-        # count after assistant reply (complete one pair)
-        self._pairs_since_summary += 1
-        if self._pairs_since_summary >= self.summary_interval:
-            self._pairs_since_summary = 0
-            self._update_summary()
 
-    def _append(self, turn: ConversationTurn):
+    def mark_interrupted(self, spoken_text: str):
+        """Replace the last assistant reply with the part the user actually heard"""
+        for t in reversed(self.turns):
+            if t.role == "assistant":
+                t.text = spoken_text.strip()
+                t.interrupted = True
+                self.window_tokens -= t.tokens
+                self._render(t)
+                self.window_tokens += t.tokens
+                self._block = None
+                if self.sink is not None:
+                    self.sink.save_turn(t)
+                return
+            if t.role == "user":
+                # Reply never reached memory (cancelled mid-LLM): nothing to truncate
+                return
+
+    def _render(self, t: ConversationTurn):
+        if t.role == "user":
+            t.line = f"用户: {t.text}"
+        elif t.interrupted:
+            t.line = f"Ani: {t.text}…(被用户打断)"
+        else:
+            t.line = f"Ani: {t.text}"
+        t.tokens = self.estimator(t.line)
+
+    def _append(self, turn: ConversationTurn, persist: bool = True):
+        if not turn.seq:
+            self._seq += 1
+            turn.seq = self._seq
+        self._render(turn)
         self.turns.append(turn)
-        if len(self.turns) > self.max_turns:
-            self.turns = self.turns[-self.max_turns :]
-
-    def _update_summary(self):
-        # Build a very compact summary from the last window
-        texts = []
-        for t in self.turns:
-            prefix = "U:" if t.role == "user" else "A:"
-            piece = f"{prefix}{t.text.strip()}"
-            if len(piece) > 120:
-                piece = piece[:117] + "..."
-            texts.append(piece)
-        joined = " | ".join(texts)
-        # Cap summary length
-        self.summary = joined[:500]
+        if persist and self.sink is not None:
+            self.sink.save_turn(turn)
+        self.window_tokens += turn.tokens
+        self._block = None
+        while len(self.turns) > 1 and (
+            self.window_tokens > self.max_tokens
+            or (self.max_turns is not None and len(self.turns) > self.max_turns)
+        ):
+            evicted = self.turns.popleft()
+            self.window_tokens -= evicted.tokens
+            self._fold(evicted)
+
+    def _fold(self, t: ConversationTurn):
+        """Move an evicted turn into the summary"""
+        piece = f"{'U:' if t.role == 'user' else 'A:'}{t.text.strip()}"
+        if len(piece) > 120:
+            piece = piece[:117] + "..."
+            tokens = self.estimator(piece)
+        else:
+            tokens = t.tokens  # same text as the rendered line, near enough
+        self._pending.append((piece, tokens, t.seq))
+        self._pending_tokens += tokens
+        self.stats["evicted"] += 1
+        self._summary = None
+        if self.archive is not None:
+            self.archive.add_turn(t)
+        if self.summarizer is not None:
+            # Keep pieces for the summarizer, but don't let a failing one grow this without bound
+            while len(self._pending) > 8 * self.summary_interval:
+                self._pending_tokens -= self._pending.popleft()[1]
+            self._maybe_summarize()
+        else:
+            while self._pending and self._pending_tokens > self.summary_max_tokens:
+                self._pending_tokens -= self._pending.popleft()[1]
+
+    def _maybe_summarize(self):
+        if len(self._pending) < self.summary_interval:
+            return
+        if self._task is not None and not self._task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # no event loop (sync use): naive summary until the next chance
+        self._task = loop.create_task(self._summarize(list(self._pending)))
+
+    async def _summarize(self, batch: List[Tuple[str, int, int]]):
+        try:
+            summary = (await self.summarizer(self._base_summary, [item[0] for item in batch])).strip()
+            if not summary:
+                raise ValueError("empty summary")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats["summary_failures"] += 1
+            print(f"[WARN] Memory summarizer failed, keeping plain summary: {e}")
+            return
+        # Drop the pieces this summary covers (more may have been folded meanwhile)
+        for item in batch:
+            if self._pending and self._pending[0] is item:
+                self._pending_tokens -= self._pending.popleft()[1]
+        self._base_summary = summary
+        self.stats["summaries"] += 1
+        if self.sink is not None:
+            self.sink.save_summary(summary, batch[-1][2])
+        if self.archive is not None:
+            self.archive.add_summary(summary, batch[-1][2])
+        self._summary = None
+        self._block = None
+        self._task = None
+        self._maybe_summarize()  # turns folded while this one ran
+
+    @property
+    def summary(self) -> str:
+        """Compressed summary plus not-yet-compressed evicted turns, within summary_max_tokens"""
+        if self._summary is None:
+            pieces = list(self._pending)
+            budget = self.summary_max_tokens - (self.estimator(self._base_summary) if self._base_summary else 0)
+            while pieces and sum(item[1] for item in pieces) > budget:
+                pieces.pop(0)
+            parts = ([self._base_summary] if self._base_summary else []) + [item[0] for item in pieces]
+            self._summary = " | ".join(parts)
+        return self._summary
 
     def get_context_block(self) -> str:
-        lines: List[str] = []
-        if self.summary:
-            lines.append("[会话摘要]" + self.summary)
-        if self.turns:
-            lines.append("[最近对话]")
-            for t in self.turns:
-                if t.role == "user":
-                    lines.append(f"用户: {t.text}")
-                else:
-                    lines.append(f"Ani: {t.text}")
-        return "\n".join(lines)
+        if self._block is None:
+            lines: List[str] = []
+            if self.summary:
+                lines.append("[会话摘要]" + self.summary)
+            if self.turns:
+                lines.append("[最近对话]")
+                lines.extend(t.line for t in self.turns)
+            self._block = "\n".join(lines)
+        return self._block
+
+    def fork(self) -> "ConversationMemory":
+        """Independent copy (e.g. for speculative turns); never runs the summarizer"""
+        other = ConversationMemory(
+            max_turns=self.max_turns,
+            summary_interval=self.summary_interval,
+            max_tokens=self.max_tokens,
+            summary_max_tokens=self.summary_max_tokens,
+            estimator=self.estimator,
+        )
+        other.turns = deque(copy.copy(t) for t in self.turns)
+        other.window_tokens = self.window_tokens
+        other._seq = self._seq
+        other.archive = self.archive  # indexing is idempotent per turn, so a fork may evict into it
+        other._base_summary = self._base_summary
+        other._pending = deque(self._pending)
+        other._pending_tokens = self._pending_tokens
+        return other
+
+    def restore(self, turns: List[ConversationTurn], summary: str = "", last_seq: int = 0):
+        """
+        Load persisted state into an empty memory (nothing is written back)
+        New turns are numbered after `last_seq` (the highest seq persisted for the session).
+        """
+        self._base_summary = summary
+        self._seq = last_seq
+        for turn in turns:
+            self._append(turn, persist=False)
+            self._seq = max(self._seq, turn.seq)
+        self._summary = None
+        self._block = None
+
+    def close(self):
+        """Cancel a running background summary and release the long-term index"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        if self.archive is not None:
+            self.archive.release()
+
+    def footprint(self) -> Tuple[int, int]:
+        """(estimated tokens, UTF-8 bytes of text) held by this memory"""
+        tokens = self.window_tokens + self._pending_tokens
+        size = sum(len(t.text.encode("utf-8")) for t in self.turns)
+        size += sum(len(item[0].encode("utf-8")) for item in self._pending)
+        if self._base_summary:
+            tokens += self.estimator(self._base_summary)
+            size += len(self._base_summary.encode("utf-8"))
+        return tokens, size
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            "turns": len(self.turns),
+            "window_tokens": self.window_tokens,
+            "summary_tokens": self.estimator(self.summary) if self.summary else 0,
+            "pending_summary_turns": len(self._pending),
+            "summarizing": self._task is not None and not self._task.done(),
+        }
+
+
+@dataclass
+class SessionStoreConfig:
+    """Caps for per-session memories (ANI_SESSION_MAX, ANI_SESSION_TTL_S, ANI_SESSION_MAX_TOTAL_TOKENS)"""
+    max_sessions: int = 1000  # least recently used session is dropped beyond this
+    ttl_s: float = 1800.0  # idle sessions expire after this
+    max_total_tokens: int = 2_000_000  # across all sessions (each is bounded by its own token budget)
+    sweep_interval_s: float = 5.0  # how often get() re-checks the total
+
+    @classmethod
+    def from_env(cls) -> "SessionStoreConfig":
+        config = cls()
+        for name, env, field_type in (
+            ("max_sessions", "ANI_SESSION_MAX", int),
+            ("ttl_s", "ANI_SESSION_TTL_S", float),
+            ("max_total_tokens", "ANI_SESSION_MAX_TOTAL_TOKENS", int),
+        ):
+            raw = os.getenv(env)
+            if raw:
+                try:
+                    setattr(config, name, field_type(raw))
+                except ValueError:
+                    print(f"[WARN] Ignoring invalid {env}={raw!r}")
+        return config
+
+
+class SessionStore:
+    """
+    Conversation memory per session (websocket connection or user id)
+    Sessions are kept in LRU order: idle ones expire after `ttl_s`, and the least
+    recently used go first when `max_sessions` or `max_total_tokens` is exceeded.
+    With a `persistence` store (memory_store.MemoryStore), a session missing here
+    is restored from disk on first use, and its turns are written back.
+    """
+
+    def __init__(self, factory: Callable[[str], ConversationMemory], config: Optional[SessionStoreConfig] = None,
+                 persistence=None):
+        self.factory = factory
+        self.config = config or SessionStoreConfig()
+        self.persistence = persistence
+        self._sessions: "OrderedDict[str, Tuple[ConversationMemory, float]]" = OrderedDict()
+        self._last_sweep = time.time()
+        self.stats = {"created": 0, "expired": 0, "evicted_lru": 0, "evicted_size": 0, "dropped": 0}
+
+    def get(self, session_id: str) -> ConversationMemory:
+        """Memory for `session_id`, created on first use"""
+        now = time.time()
+        self._expire(now)
+        entry = self._sessions.pop(session_id, None)
+        memory = entry[0] if entry is not None else None
+        if memory is None:
+            memory = self.factory(session_id)
+            self.stats["created"] += 1
+            if self.persistence is not None and self.persistence.durable(session_id):
+                try:
+                    self.persistence.restore(session_id, memory)
+                except Exception as e:
+                    print(f"[WARN] Could not restore session {session_id}: {e}")
+        self._sessions[session_id] = (memory, now)
+        while len(self._sessions) > self.config.max_sessions:
+            self._evict("evicted_lru")
+        if now - self._last_sweep >= self.config.sweep_interval_s:
+            self.sweep(now)
+        return memory
+
+    def peek(self, session_id: str) -> Optional[ConversationMemory]:
+        """Memory for `session_id` if it exists (does not refresh it)"""
+        entry = self._sessions.get(session_id)
+        return entry[0] if entry is not None else None
+
+    def drop(self, session_id: str):
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            entry[0].close()
+            self.stats["dropped"] += 1
+
+    def _evict(self, reason: str):
+        _, (memory, _) = self._sessions.popitem(last=False)
+        memory.close()
+        self.stats[reason] += 1
+
+    def _expire(self, now: float):
+        # LRU order is last-use order, so expired sessions are all at the front
+        while self._sessions:
+            _, last_used = next(iter(self._sessions.values()))
+            if now - last_used < self.config.ttl_s:
+                break
+            self._evict("expired")
+
+    def sweep(self, now: Optional[float] = None) -> Tuple[int, int]:
+        """Expire idle sessions and enforce the total cap; returns (tokens, bytes) held"""
+        now = now or time.time()
+        self._last_sweep = now
+        self._expire(now)
+        sizes = {sid: memory.footprint() for sid, (memory, _) in self._sessions.items()}
+        tokens = sum(t for t, _ in sizes.values())
+        while len(self._sessions) > 1 and tokens > self.config.max_total_tokens:
+            sid = next(iter(self._sessions))
+            tokens -= sizes.pop(sid)[0]
+            self._evict("evicted_size")
+        return tokens, sum(b for _, b in sizes.values())
+
+    def close(self):
+        """Flush persistence (sessions stay on disk)"""
+        if self.persistence is not None:
+            self.persistence.close()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
 
+    def snapshot(self) -> dict:
+        tokens, size = self.sweep()
+        return {
+            **self.stats,
+            "sessions": len(self._sessions),
+            "total_tokens": tokens,
+            "total_bytes": size,
+            "avg_tokens": round(tokens / len(self._sessions), 1) if self._sessions else 0.0,
+            "max_sessions": self.config.max_sessions,
+            "max_total_tokens": self.config.max_total_tokens,
+            "persistence": self.persistence.snapshot() if self.persistence is not None else None,
+        }
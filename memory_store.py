@@ -0,0 +1,345 @@
+"""
+Durable conversation memory for Ani v0
+Turns and summaries are written to a local SQLite database in WAL mode, so
+sessions survive restarts.
+- Writes never touch the event loop: memories enqueue records and one writer
+  thread commits them in batches (one transaction, and at most one WAL append,
+  per flush interval). With synchronous=NORMAL the WAL is fsynced at checkpoints,
+  not per commit.
+- Sessions are restored lazily when they're first used again (one indexed
+  query for the latest turns). Records still queued for the writer are merged
+  in, so a quick reconnect sees everything.
+- The writer thread periodically compacts: it keeps the latest `keep_turns` per
+  session, drops sessions idle for `retention_days` and truncates the WAL.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Tuple
+
+from memory import ConversationMemory, ConversationTurn
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    session TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    text TEXT NOT NULL,
+    emote TEXT,
+    ts REAL NOT NULL,
+    interrupted INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (session, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS summaries (
+    session TEXT PRIMARY KEY,
+    summary TEXT NOT NULL,
+    through_seq INTEGER NOT NULL,
+    ts REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Queued record: ("turn", session, (seq, role, text, emote, ts, interrupted)) or ("summary", session, (summary, through_seq, ts))
+Record = Tuple[str, str, tuple]
+
+
+@dataclass
+class MemoryStoreConfig:
+    """Persistence settings (ANI_MEMORY_DB enables it; ANI_MEMORY_FLUSH_MS, ANI_MEMORY_KEEP_TURNS)"""
+    path: str = ""  # empty: conversation memory is not persisted
+    flush_interval_ms: float = 200.0  # writer commits at most this often
+    max_batch: int = 512
+    synchronous: str = "NORMAL"  # FULL fsyncs every commit
+    restore_turns: int = 32  # latest turns loaded on restore (older ones are covered by the summary)
+    keep_turns: int = 2000  # compaction keeps this many turns per session (long-term memory indexes them)
+    retention_days: float = 30.0  # sessions idle longer are deleted
+    compact_interval_s: float = 600.0
+    session_prefix: str = "user:"  # only these sessions are persisted (per-connection ones can't come back)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    @classmethod
+    def from_env(cls) -> "MemoryStoreConfig":
+        config = cls(path=os.getenv("ANI_MEMORY_DB", ""))
+        try:
+            config.flush_interval_ms = float(os.getenv("ANI_MEMORY_FLUSH_MS", config.flush_interval_ms))
+            config.keep_turns = int(os.getenv("ANI_MEMORY_KEEP_TURNS", config.keep_turns))
+        except ValueError:
+            pass
+        return config
+
+
+class SessionSink:
+    """A session's write handle (ConversationMemory.sink)"""
+
+    __slots__ = ("store", "session")
+
+    def __init__(self, store: "MemoryStore", session: str):
+        self.store = store
+        self.session = session
+
+    def save_turn(self, turn: ConversationTurn):
+        self.store.enqueue(("turn", self.session, (
+            turn.seq, turn.role, turn.text, turn.emote, turn.ts, int(turn.interrupted)
+        )))
+
+    def save_summary(self, summary: str, through_seq: int):
+        self.store.enqueue(("summary", self.session, (summary, through_seq, time.time())))
+
+
+class MemoryStore:
+    """SQLite (WAL) persistence for conversation memories with a batching writer thread"""
+
+    def __init__(self, config: MemoryStoreConfig):
+        self.config = config
+        Path(config.path).parent.mkdir(parents=True, exist_ok=True)
+        # Records move from _queue to _unflushed under _lock, so restore() always sees them in one of the two
+        self._queue: Deque[Record] = deque()
+        self._unflushed: List[Record] = []  # taken by the writer, not committed yet
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._reader = self._connect()
+        self._reader.executescript(SCHEMA)
+        self._reader.commit()
+        self._closed = False
+        self.stats = {
+            "enqueued": 0, "written": 0, "commits": 0, "write_errors": 0,
+            "restores": 0, "restore_ms": 0.0, "compactions": 0, "compacted_rows": 0,
+        }
+        self._thread = threading.Thread(target=self._run, name="memory-store", daemon=True)
+        self._thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.config.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.config.synchronous}")
+        return conn
+
+    def durable(self, session: str) -> bool:
+        return session.startswith(self.config.session_prefix)
+
+    def sink(self, session: str) -> SessionSink:
+        return SessionSink(self, session)
+
+    def enqueue(self, record: Record):
+        with self._ready:
+            if self._closed:
+                return
+            self.stats["enqueued"] += 1
+            self._queue.append(record)
+            self._ready.notify()
+
+    # Restore (event loop, milliseconds)
+
+    def restore(self, session: str, memory: ConversationMemory):
+        """Load `session` into an empty memory and attach its sink"""
+        start = time.perf_counter()
+        # Snapshot uncommitted records first: anything the writer commits after this is on disk
+        with self._lock:
+            pending = self._unflushed + list(self._queue)
+        row = self._reader.execute(
+            "SELECT summary, through_seq FROM summaries WHERE session = ?", (session,)
+        ).fetchone()
+        summary, through = (row[0], row[1]) if row else ("", 0)
+        rows = self._reader.execute(
+            "SELECT seq, role, text, emote, ts, interrupted FROM turns WHERE session = ? AND seq > ? "
+            "ORDER BY seq DESC LIMIT ?", (session, through, self.config.restore_turns)
+        ).fetchall()
+        # New turns continue after the highest seq ever written, not after the restored window
+        last_seq = self._reader.execute("SELECT MAX(seq) FROM turns WHERE session = ?", (session,)).fetchone()[0] or 0
+        last_seq = max(last_seq, through)
+        turns: Dict[int, tuple] = {r[0]: r for r in rows}
+        for kind, record_session, values in pending:  # not committed yet: newer than what's on disk
+            if record_session != session:
+                continue
+            if kind == "turn":
+                last_seq = max(last_seq, values[0])
+                if values[0] > through:
+                    turns[values[0]] = values
+            elif values[1] >= through:
+                summary, through = values[0], values[1]
+                last_seq = max(last_seq, through)
+        seqs = sorted(seq for seq in turns if seq > through)[-self.config.restore_turns:]
+
+        memory.restore([
+            ConversationTurn(role=turns[s][1], text=turns[s][2], emote=turns[s][3], ts=turns[s][4],
+                             interrupted=bool(turns[s][5]), seq=s)
+            for s in seqs
+        ], summary, last_seq)
+        memory.sink = self.sink(session)
+        self.stats["restores"] += 1
+        self.stats["restore_ms"] += (time.perf_counter() - start) * 1000
+
+    def history(self, session: str, limit: int = 2000) -> List[Tuple[int, str, str, float]]:
+        """Committed turns of `session` as (seq, role, text, ts), oldest first (any thread)"""
+        if not self.durable(session):
+            return []
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT seq, role, text, ts FROM turns WHERE session = ? ORDER BY seq DESC LIMIT ?", (session, limit)
+            ).fetchall()
+        finally:
+            conn.close()
+        rows.reverse()
+        return rows
+
+    # Writer thread
+
+    def _run(self):
+        conn = self._connect()
+        flush_s = self.config.flush_interval_ms / 1000.0
+        max_batch = self.config.max_batch
+        next_compact = time.time() + self.config.compact_interval_s
+        running = True
+        while running:
+            with self._ready:
+                if self._ready.wait_for(lambda: self._queue or self._closed, timeout=1.0) and not self._closed:
+                    # Collect a batch for one flush interval (records stay visible to restore() meanwhile)
+                    self._ready.wait_for(lambda: len(self._queue) >= max_batch or self._closed, timeout=flush_s)
+                running = not self._closed
+                take = len(self._queue) if not running else min(len(self._queue), max_batch)  # shutting down: take all
+                batch = [self._queue.popleft() for _ in range(take)]
+                self._unflushed = batch
+            if batch:
+                self._write(conn, batch)
+                with self._lock:
+                    self._unflushed = []
+            if time.time() >= next_compact:
+                self.compact(conn)
+                next_compact = time.time() + self.config.compact_interval_s
+        conn.close()
+
+    def _write(self, conn: sqlite3.Connection, batch: List[Record]):
+        # Last write per key wins (an interrupted reply rewrites its turn)
+        turns: Dict[Tuple[str, int], tuple] = {}
+        summaries: Dict[str, tuple] = {}
+        for kind, session, values in batch:
+            if kind == "turn":
+                turns[(session, values[0])] = (session, *values)
+            else:
+                summaries[session] = (session, *values)
+        try:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT OR REPLACE INTO turns (session, seq, role, text, emote, ts, interrupted) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", list(turns.values())
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO summaries (session, summary, through_seq, ts) VALUES (?, ?, ?, ?)",
+                list(summaries.values())
+            )
+            conn.execute("COMMIT")
+            self.stats["written"] += len(turns) + len(summaries)
+            self.stats["commits"] += 1
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            self.stats["write_errors"] += 1
+            print(f"[WARN] Memory store write failed ({len(batch)} records dropped): {e}")
+
+    def compact(self, conn: Optional[sqlite3.Connection] = None):
+        """Trim old turns and idle sessions, then truncate the WAL (writer thread)"""
+        conn = conn or self._reader
+        cutoff = time.time() - self.config.retention_days * 86400
+        try:
+            removed = conn.execute(
+                "DELETE FROM turns WHERE seq <= (SELECT MAX(t.seq) FROM turns t WHERE t.session = turns.session) - ?",
+                (self.config.keep_turns,)
+            ).rowcount
+            stale = [r[0] for r in conn.execute(
+                "SELECT session FROM turns GROUP BY session HAVING MAX(ts) < ?", (cutoff,)
+            )]
+            for session in stale:
+                removed += conn.execute("DELETE FROM turns WHERE session = ?", (session,)).rowcount
+                conn.execute("DELETE FROM summaries WHERE session = ?", (session,))
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.stats["compactions"] += 1
+            self.stats["compacted_rows"] += removed
+        except sqlite3.Error as e:
+            print(f"[WARN] Memory store compaction failed: {e}")
+
+    def close(self):
+        """Flush queued records and stop the writer"""
+        with self._ready:
+            if self._closed:
+                return
+            self._closed = True
+            self._ready.notify()
+        self._thread.join(timeout=10)
+        self._reader.close()
+
+    def disk_bytes(self) -> int:
+        return sum(
+            os.path.getsize(p) for p in (self.config.path, self.config.path + "-wal")
+            if os.path.exists(p)
+        )
+
+    def snapshot(self) -> dict:
+        restores = self.stats["restores"]
+        written = self.stats["written"]
+        return {
+            **self.stats,
+            "restore_ms": round(self.stats["restore_ms"], 2),
+            "avg_restore_ms": round(self.stats["restore_ms"] / restores, 3) if restores else 0.0,
+            "rows_per_commit": round(written / self.stats["commits"], 1) if self.stats["commits"] else 0.0,
+            "queued": len(self._queue),
+            "disk_bytes": self.disk_bytes(),
+        }
+
+
+# Testing
+def test_memory_store():
+    """Write amplification and restore latency on a temporary database"""
+    import tempfile
+
+    print("=" * 60)
+    print("Testing MemoryStore")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config = MemoryStoreConfig(path=os.path.join(tmp, "memory.sqlite3"), compact_interval_s=3600)
+        store = MemoryStore(config)
+        sessions, pairs = 200, 20
+        start = time.perf_counter()
+        for s in range(sessions):
+            memory = ConversationMemory()
+            memory.sink = store.sink(f"user:{s}")
+            for i in range(pairs):
+                memory.add_user(f"第{i}个问题：今天我们聊点什么好呢？")
+                memory.add_assistant(f"Sure! Let's talk about topic number {i}.", emote="joy")
+        enqueue_ms = (time.perf_counter() - start) * 1000
+        turns = sessions * pairs * 2
+
+        # A reconnect before the writer caught up still sees every turn
+        quick = ConversationMemory()
+        store.restore("user:199", quick)
+        print(f"Restore while queued: {len(quick.turns)} turns in window, last seq {quick.turns[-1].seq}")
+
+        store.close()
+        text_bytes = turns * len("Sure! Let's talk about topic number 10.".encode("utf-8"))
+        print(f"{turns} turns enqueued in {enqueue_ms:.1f}ms ({enqueue_ms * 1000 / turns:.1f}us/turn), "
+              f"{store.stats['commits']} commits")
+        print(f"On disk: {store.disk_bytes() / turns:.0f} bytes/turn (~{text_bytes / turns:.0f} bytes of text)")
+
+        store = MemoryStore(config)
+        times = []
+        for s in range(0, sessions, 10):
+            memory = ConversationMemory()
+            start = time.perf_counter()
+            store.restore(f"user:{s}", memory)
+            times.append((time.perf_counter() - start) * 1000)
+        print(f"Restore: avg {sum(times) / len(times):.3f}ms, max {max(times):.3f}ms "
+              f"({len(memory.turns)} turns in window, summary {len(memory.summary)} chars)")
+        store.compact()
+        print(f"After compaction: {store.disk_bytes() / turns:.0f} bytes/turn, stats {store.snapshot()}")
+        store.close()
+
+
+if __name__ == "__main__":
+    test_memory_store()
@@ -0,0 +1,434 @@
+"""
+Model host for Ani v0 multi-worker deployments
+One process owns the heavy models (Silero VAD, Faster-Whisper STT, Coqui TTS)
+and serves N stateless websocket workers over a local IPC channel (unix
+socket, or TCP on localhost where unix sockets are unavailable).
+
+Wire format (both directions), per frame:
+    4-byte big-endian header length | JSON header | 4-byte payload length | payload
+Requests carry {"id", "op", ...}; responses echo "id" with "ok" and "result"/"error".
+Audio travels as raw payload bytes (float32 PCM in, WAV out), never as JSON.
+
+Concurrent requests from all workers are grouped per op and run back-to-back
+on that model's thread (one thread hop per group; the models still see one
+input at a time, there is no batched forward pass). VAD, STT and TTS each own
+a thread, so a long transcription or synthesis never stalls the VAD of live
+streams; VAD requests carry a stream id and Silero's recurrent state is kept
+per stream.
+
+Usage
+  python model_host.py --address /tmp/ani_model_host.sock
+  python model_host.py --address tcp://127.0.0.1:8765 --tts-engine coqui
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import struct
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+DEFAULT_ADDRESS = "tcp://127.0.0.1:8765" if sys.platform == "win32" else "/tmp/ani_model_host.sock"
+
+
+# ---------------------------------------------------------------------------
+# Framing
+# ---------------------------------------------------------------------------
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[Dict[str, Any], bytes]:
+    (header_len,) = struct.unpack(">I", await reader.readexactly(4))
+    header = json.loads(await reader.readexactly(header_len))
+    (payload_len,) = struct.unpack(">I", await reader.readexactly(4))
+    payload = await reader.readexactly(payload_len) if payload_len else b""
+    return header, payload
+
+
+def write_frame(writer: asyncio.StreamWriter, header: Dict[str, Any], payload: bytes = b""):
+    raw = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    writer.write(struct.pack(">I", len(raw)) + raw + struct.pack(">I", len(payload)))
+    if payload:
+        writer.write(payload)
+
+
+async def open_connection(address: str):
+    if address.startswith("tcp://"):
+        host, port = address[len("tcp://"):].rsplit(":", 1)
+        return await asyncio.open_connection(host, int(port))
+    return await asyncio.open_unix_connection(address)
+
+
+# ---------------------------------------------------------------------------
+# Server side
+# ---------------------------------------------------------------------------
+
+class RequestGrouper:
+    """
+    Collects requests for one op across all workers for up to `window_ms`
+    (or `max_group` items) and hands them to the model thread as one job,
+    which runs them one after another (serialization, not a batched forward pass)
+    """
+
+    def __init__(self, name: str, run_group: Callable[[List[Any]], List[Any]],
+                 executor: ThreadPoolExecutor, window_ms: float = 2.0, max_group: int = 32):
+        self.name = name
+        self.run_group = run_group
+        self.executor = executor
+        self.window_ms = window_ms
+        self.max_group = max_group
+        self.pending: List[Tuple[Any, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self.groups = 0
+        self.items = 0
+
+    def submit(self, item: Any) -> "asyncio.Future":
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((item, future))
+        if len(self.pending) >= self.max_group:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window_ms / 1000.0, self._flush)
+        return future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        group, self.pending = self.pending, []
+        if group:
+            asyncio.ensure_future(self._run(group))
+
+    async def _run(self, group: List[Tuple[Any, asyncio.Future]]):
+        items = [item for item, _ in group]
+        self.groups += 1
+        self.items += len(items)
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, self.run_group, items)
+        except Exception as e:
+            for _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(group, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def snapshot(self) -> dict:
+        return {
+            "groups": self.groups,
+            "items": self.items,
+            "avg_group": round(self.items / self.groups, 2) if self.groups else 0.0,
+        }
+
+
+class ModelHost:
+    """Owns the models and answers vad / stt / tts requests from workers"""
+
+    def __init__(self, address: str, tts_engine: Optional[str] = "coqui", tts_voice: Optional[str] = None,
+                 whisper_size: str = "small", group_window_ms: float = 2.0):
+        self.address = address
+        self.tts_engine = tts_engine
+        self.tts_voice = tts_voice
+        self.whisper_size = whisper_size
+        self.group_window_ms = group_window_ms
+        # One thread per model: each model is not safe to call concurrently anyway
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-host")
+        self.vad_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-host-vad")
+        # TTSPipeline is async but its engines may block (Coqui): it runs on its own loop on this thread
+        self.tts_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-host-tts")
+        self._tts_loop = asyncio.new_event_loop()
+        self.audio = None
+        self.tts = None
+        self.groupers: Dict[str, RequestGrouper] = {}
+        self.connections = 0
+        self.started_at = time.time()
+
+    async def load(self):
+        from audio_pipeline import AudioPipeline, AudioConfig
+        self.audio = AudioPipeline(AudioConfig())
+        self.audio.stt.model_size = self.whisper_size
+        await self.audio.load_models()
+
+        if self.tts_engine:
+            from tts_pipeline import TTSPipeline, TTSConfig
+            kwargs = {"engine": self.tts_engine, "fallback_engines": []}
+            if self.tts_voice:
+                kwargs["coqui_model" if self.tts_engine == "coqui" else "voice"] = self.tts_voice
+            try:
+                tts = TTSPipeline(TTSConfig(**kwargs))
+                await self._on_tts_thread(tts.initialize())
+                self.tts = tts
+            except Exception as e:
+                print(f"[WARN] Model host TTS unavailable ({self.tts_engine}): {e}")
+                self.tts = None
+
+        from warmup import WarmupConfig, warm_audio, warm_tts
+        warmup = WarmupConfig.from_env()
+        if warmup.enabled:
+            print(f"[OK] Model host audio warm-up: {await warm_audio(self.audio, warmup)}")
+            if self.tts is not None:
+                print(f"[OK] Model host TTS warm-up: {await self._on_tts_thread(warm_tts(self.tts, warmup))}")
+
+        self.groupers["vad"] = RequestGrouper("vad", self._vad_group, self.vad_executor, self.group_window_ms)
+        self.groupers["stt"] = RequestGrouper("stt", self._stt_group, self.executor, self.group_window_ms, max_group=4)
+
+    async def _on_tts_thread(self, coro):
+        """Run a TTS coroutine to completion on the TTS thread's own event loop"""
+        return await asyncio.get_running_loop().run_in_executor(
+            self.tts_executor, self._tts_loop.run_until_complete, coro
+        )
+
+    def _vad_group(self, chunks: List[Tuple[np.ndarray, Optional[str]]]) -> List[Any]:
+        out: List[Any] = []
+        for chunk, stream in chunks:
+            try:
+                out.append(self.audio.vad.detect_speech(chunk, stream))
+            except Exception as e:
+                out.append(e)
+        return out
+
+    def _stt_group(self, jobs: List[Tuple[np.ndarray, Optional[str], bool]]) -> List[Any]:
+        out: List[Any] = []
+        for audio, language, partial in jobs:
+            try:
+                out.append(self.audio.stt.transcribe_sync(audio, language=language, partial=partial))
+            except Exception as e:
+                out.append(e)
+        return out
+
+    async def handle(self, header: Dict[str, Any], payload: bytes) -> Tuple[Dict[str, Any], bytes]:
+        op = header.get("op")
+        if op == "ping":
+            return {"result": self.snapshot()}, b""
+        if op == "vad":
+            chunk = np.frombuffer(payload, dtype=np.float32)
+            prob = await self.groupers["vad"].submit((chunk, header.get("stream")))
+            return {"result": prob}, b""
+        if op == "stt":
+            audio = np.frombuffer(payload, dtype=np.float32)
+            text = await self.groupers["stt"].submit((audio, header.get("language"), bool(header.get("partial"))))
+            return {"result": text}, b""
+        if op == "tts":
+            if self.tts is None:
+                raise RuntimeError("TTS not hosted")
+            result = await self._on_tts_thread(
+                self.tts.synthesize_with_phonemes(header["text"], sample_rate=header.get("sample_rate"))
+            )
+            return {"result": {"duration_ms": result["duration_ms"], "engine": result["engine"]}}, result["audio"]
+        raise ValueError(f"Unknown op: {op}")
+
+    async def _serve_request(self, writer: asyncio.StreamWriter, header: Dict[str, Any], payload: bytes):
+        req_id = header.get("id")
+        try:
+            resp, resp_payload = await self.handle(header, payload)
+            resp.update({"id": req_id, "ok": True})
+        except Exception as e:
+            resp, resp_payload = {"id": req_id, "ok": False, "error": f"{type(e).__name__}: {e}"}, b""
+        try:
+            write_frame(writer, resp, resp_payload)
+            await writer.drain()
+        except Exception:
+            pass
+
+    async def _on_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        print(f"[Host] Worker connected ({self.connections} total)")
+        try:
+            while True:
+                try:
+                    header, payload = await read_frame(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                # Requests are multiplexed: answer out of order as they finish
+                asyncio.ensure_future(self._serve_request(writer, header, payload))
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def serve(self):
+        await self.load()
+        if self.address.startswith("tcp://"):
+            host, port = self.address[len("tcp://"):].rsplit(":", 1)
+            server = await asyncio.start_server(self._on_client, host, int(port))
+        else:
+            import os
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+            server = await asyncio.start_unix_server(self._on_client, self.address)
+        print(f"[OK] Model host listening on {self.address}")
+        async with server:
+            await server.serve_forever()
+
+    def snapshot(self) -> dict:
+        return {
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "connections": self.connections,
+            "tts": self.tts_engine if self.tts else None,
+            "grouping": {name: g.snapshot() for name, g in self.groupers.items()},
+        }
+
+
+# ---------------------------------------------------------------------------
+# Worker side
+# ---------------------------------------------------------------------------
+
+class ModelHostClient:
+    """One multiplexed connection from a worker to the model host"""
+
+    def __init__(self, address: str = DEFAULT_ADDRESS, timeout: float = 30.0):
+        self.address = address
+        self.timeout = timeout
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._connect_lock = asyncio.Lock()
+
+    async def connect(self):
+        async with self._connect_lock:
+            if self._writer is not None and not self._writer.is_closing():
+                return
+            self._reader, self._writer = await open_connection(self.address)
+            self._reader_task = asyncio.create_task(self._read_loop())
+
+    async def _read_loop(self):
+        try:
+            while True:
+                header, payload = await read_frame(self._reader)
+                future = self._pending.pop(header.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result((header, payload))
+        except Exception as e:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f"model host connection lost: {e}"))
+            self._pending.clear()
+            if self._writer is not None:
+                self._writer.close()
+            self._writer = None
+
+    async def request(self, op: str, payload: bytes = b"", **fields) -> Tuple[Any, bytes]:
+        await self.connect()
+        req_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[req_id] = future
+        write_frame(self._writer, {"id": req_id, "op": op, **fields}, payload)
+        await self._writer.drain()
+        try:
+            header, resp_payload = await asyncio.wait_for(future, timeout=self.timeout)
+        finally:
+            self._pending.pop(req_id, None)
+        if not header.get("ok"):
+            raise RuntimeError(f"model host {op} failed: {header.get('error')}")
+        return header.get("result"), resp_payload
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+
+
+class RemoteVAD:
+    """SileroVAD stand-in that asks the model host"""
+
+    def __init__(self, client: ModelHostClient, config):
+        self.client = client
+        self.config = config
+        self.is_loaded = False
+
+    async def load(self):
+        await self.client.request("ping")
+        self.is_loaded = True
+
+    async def detect_speech_async(self, audio_chunk: np.ndarray, stream: Optional[str] = None) -> float:
+        prob, _ = await self.client.request(
+            "vad", np.ascontiguousarray(audio_chunk, dtype=np.float32).tobytes(), stream=stream
+        )
+        return float(prob)
+
+    def is_speech(self, speech_prob: float) -> bool:
+        return speech_prob >= self.config.vad_threshold
+
+
+class RemoteSTT:
+    """WhisperSTT stand-in that asks the model host"""
+
+    def __init__(self, client: ModelHostClient):
+        self.client = client
+        self.is_loaded = False
+
+    async def load(self):
+        await self.client.request("ping")
+        self.is_loaded = True
+
+    async def transcribe(self, audio: np.ndarray, language: Optional[str] = None, partial: bool = False) -> str:
+        try:
+            text, _ = await self.client.request(
+                "stt", np.ascontiguousarray(audio, dtype=np.float32).tobytes(), language=language, partial=partial
+            )
+            return text or ""
+        except Exception as e:
+            print(f"[FAIL] Remote STT error: {e}")
+            return ""
+
+
+class RemoteTTSEngine:
+    """TTS engine that synthesizes on the model host (e.g. hosted Coqui XTTS)"""
+
+    def __init__(self, config, client: Optional[ModelHostClient] = None):
+        import os
+        self.config = config
+        self.client = client or ModelHostClient(os.getenv("MODEL_HOST", DEFAULT_ADDRESS))
+        self.is_ready = False
+
+    def initialize(self):
+        pass  # connection is opened lazily on the event loop
+
+    async def synthesize(self, text: str, language: Optional[str] = None) -> Tuple[bytes, float]:
+        result, audio = await self.client.request("tts", text=text, sample_rate=self.config.sample_rate)
+        self.is_ready = True
+        return audio, float(result["duration_ms"])
+
+
+def create_remote_audio_pipeline(address: str):
+    """AudioPipeline whose VAD/STT run in the model host (no local model weights)"""
+    from audio_pipeline import AudioPipeline, AudioConfig
+    config = AudioConfig()
+    client = ModelHostClient(address)
+    pipeline = AudioPipeline(config)
+    pipeline.vad = RemoteVAD(client, config)
+    pipeline.stt = RemoteSTT(client)
+    return pipeline
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Ani model host (shared VAD/STT/TTS models)")
+    ap.add_argument("--address", default=DEFAULT_ADDRESS, help="unix socket path or tcp://host:port")
+    ap.add_argument("--tts-engine", default="coqui", help="engine hosted for workers ('' to disable)")
+    ap.add_argument("--tts-voice", default="tts_models/multilingual/multi-dataset/xtts_v2",
+                    help="Coqui model, or the voice of another hosted engine")
+    ap.add_argument("--whisper", default="small", help="faster-whisper model size")
+    ap.add_argument("--group-window-ms", type=float, default=2.0, help="how long requests wait to be grouped")
+    args = ap.parse_args()
+
+    host = ModelHost(args.address, tts_engine=args.tts_engine or None, tts_voice=args.tts_voice,
+                     whisper_size=args.whisper, group_window_ms=args.group_window_ms)
+    try:
+        asyncio.run(host.serve())
+    except KeyboardInterrupt:
+        print("[INFO] Model host stopped")
+
+
+if __name__ == "__main__":
+    main()
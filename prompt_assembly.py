@@ -0,0 +1,252 @@
+"""
+Budgeted prompt assembly for Ani v0
+The per-turn prompt suffix is built from independent context components
+(conversation memory, long-term recall, RAG facts). Each has a token budget and
+a priority:
+- Blocking components (RAG search) run on a small dedicated thread pool,
+  concurrently with the others, under a deadline; one that misses it is left
+  out of this turn. A timed-out search keeps its thread until it finishes, so
+  when every thread is still busy the component is skipped ("saturated")
+  instead of queueing behind them.
+- Every component is trimmed to its own budget, then the lowest-priority ones
+  are trimmed or dropped until the whole context fits `max_tokens`.
+- Each build reports per-component tokens, time and status; totals are kept
+  for /metrics.
+"""
+from __future__ import annotations
+
+import asyncio
+import functools
+import inspect
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from text_utils import TokenEstimator, estimate_tokens
+
+
+@dataclass
+class PromptComponent:
+    """One context block: "\\n{header}\\n{body}\\n{footer}" (nothing when the body is empty)"""
+    name: str
+    fetch: Callable[[], Union[str, Awaitable[str]]]  # body text ("" = nothing to add)
+    header: str = ""
+    footer: str = ""
+    priority: int = 50  # higher survives the total budget
+    max_tokens: Optional[int] = None
+    keep: str = "start"  # end to keep when trimming lines: "start" (ranked results) or "end" (newest turns)
+    in_thread: bool = False  # blocking fetch: run on the assembler's thread pool
+    deadline_ms: Optional[float] = None  # threaded/async fetches only
+
+
+def trim_lines(text: str, max_tokens: int, keep: str = "start", estimator: TokenEstimator = estimate_tokens) -> str:
+    """Drop whole lines from the other end until `text` fits (a single line is cut)"""
+    lines = text.split("\n")
+    sizes = [estimator(line) + 1 for line in lines]
+    total = sum(sizes)
+    while len(lines) > 1 and total > max_tokens:
+        total -= sizes.pop(-1 if keep == "start" else 0)
+        lines.pop(-1 if keep == "start" else 0)
+    text = "\n".join(lines)
+    if total > max_tokens and text:
+        chars = len(text) * max_tokens // max(total, 1) - 3
+        if chars <= 0:
+            return ""
+        text = text[:chars] + "..." if keep == "start" else "..." + text[-chars:]
+    return text
+
+
+class PromptAssembler:
+    """Runs components concurrently and fits them into a token budget"""
+
+    def __init__(self, max_tokens: int, estimator: TokenEstimator = estimate_tokens, max_workers: int = 4):
+        self.max_tokens = max_tokens
+        self.estimator = functools.lru_cache(maxsize=256)(estimator)  # memory blocks repeat between turns
+        self.stats = {"builds": 0, "build_ms": 0.0, "over_budget": 0}
+        self.component_stats: Dict[str, Dict[str, float]] = {}
+        self._overheads: Dict[Tuple[str, str], int] = {}  # headers/footers are constant: estimate once
+        # Own pool: timed-out fetches can't pile up in (and stall) the loop's default executor
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prompt")
+        self._in_flight = 0  # submitted fetches not finished yet (including abandoned ones)
+        self._in_flight_lock = threading.Lock()
+
+    async def assemble(self, components: List[PromptComponent]) -> Tuple[Dict[str, str], Dict[str, Any]]:
+        """Rendered blocks by component name, plus this build's report"""
+        start = time.perf_counter()
+        results = await asyncio.gather(*(self._fetch(c) for c in components))
+        return self._finish(components, results, start)
+
+    def assemble_sync(self, components: List[PromptComponent]) -> Tuple[Dict[str, str], Dict[str, Any]]:
+        """Same, inline and without deadlines (offline tools, benchmarks)"""
+        start = time.perf_counter()
+        results = []
+        for c in components:
+            t0 = time.perf_counter()
+            try:
+                body, status = c.fetch() or "", "ok"
+                if inspect.isawaitable(body):
+                    body.close()
+                    raise TypeError("async component in a sync build")
+            except Exception as e:
+                body, status = "", "error"
+                print(f"[WARN] Prompt component '{c.name}' failed: {e}")
+            results.append((body, status, (time.perf_counter() - t0) * 1000))
+        return self._finish(components, results, start)
+
+    async def _fetch(self, c: PromptComponent) -> Tuple[str, str, float]:
+        start = time.perf_counter()
+        try:
+            if c.in_thread:
+                pending = self._submit(c.fetch)
+                if pending is None:
+                    return "", "saturated", 0.0
+            else:
+                pending = c.fetch()
+            if inspect.isawaitable(pending):
+                timeout = c.deadline_ms / 1000.0 if c.deadline_ms is not None else None
+                pending = await asyncio.wait_for(pending, timeout)  # a timed-out thread finishes unobserved
+            body, status = pending or "", "ok"
+        except asyncio.TimeoutError:
+            body, status = "", "timeout"
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            body, status = "", "error"
+            print(f"[WARN] Prompt component '{c.name}' failed: {e}")
+        return body, status, (time.perf_counter() - start) * 1000
+
+    def _submit(self, fetch: Callable[[], str]) -> Optional[asyncio.Future]:
+        """Run `fetch` on the pool, or None when every thread is taken"""
+        with self._in_flight_lock:
+            if self._in_flight >= self.max_workers:
+                return None
+            self._in_flight += 1
+        future = self._executor.submit(fetch)
+        future.add_done_callback(self._fetch_done)
+        return asyncio.wrap_future(future)
+
+    def _fetch_done(self, _future):
+        with self._in_flight_lock:
+            self._in_flight -= 1
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _finish(self, components: List[PromptComponent], results, start: float):
+        bodies: Dict[str, str] = {}
+        report: Dict[str, Dict[str, Any]] = {}
+        for c, (body, status, ms) in zip(components, results):
+            tokens = self._tokens(c, body)
+            if c.max_tokens is not None and tokens > c.max_tokens:
+                body, status = self._fit(c, body, c.max_tokens), "trimmed"
+                tokens = self._tokens(c, body)
+            if not body and status == "ok":
+                status = "empty"
+            bodies[c.name] = body
+            report[c.name] = {"tokens": tokens, "ms": round(ms, 3), "status": status}
+
+        # Over the total: cut from the lowest priority up
+        total = sum(r["tokens"] for r in report.values())
+        if total > self.max_tokens:
+            self.stats["over_budget"] += 1
+            for c in sorted(components, key=lambda c: c.priority):
+                if total <= self.max_tokens:
+                    break
+                entry = report[c.name]
+                if not entry["tokens"]:
+                    continue
+                allowed = entry["tokens"] - (total - self.max_tokens)
+                body = self._fit(c, bodies[c.name], allowed) if allowed - self._overhead(c) > 8 else ""
+                total -= entry["tokens"]
+                entry["tokens"] = self._tokens(c, body)
+                entry["status"] = "trimmed" if body else "dropped"
+                total += entry["tokens"]
+                bodies[c.name] = body
+
+        blocks = {
+            c.name: f"\n{c.header}\n{bodies[c.name]}\n{c.footer}" if bodies[c.name] else ""
+            for c in components
+        }
+        build_ms = (time.perf_counter() - start) * 1000
+        self._record(report, build_ms)
+        return blocks, {"components": report, "total_tokens": total, "build_ms": round(build_ms, 3)}
+
+    def _fit(self, c: PromptComponent, body: str, max_tokens: int) -> str:
+        return trim_lines(body, max(0, max_tokens - self._overhead(c)), c.keep, self.estimator)
+
+    def _overhead(self, c: PromptComponent) -> int:
+        """Header, footer and separators"""
+        key = (c.header, c.footer)
+        overhead = self._overheads.get(key)
+        if overhead is None:
+            overhead = self._overheads[key] = self.estimator(c.header) + self.estimator(c.footer) + 3
+        return overhead
+
+    def _tokens(self, c: PromptComponent, body: str) -> int:
+        return self.estimator(body) + self._overhead(c) if body else 0
+
+    def _record(self, report: Dict[str, Dict[str, Any]], build_ms: float):
+        self.stats["builds"] += 1
+        self.stats["build_ms"] += build_ms
+        for name, entry in report.items():
+            s = self.component_stats.setdefault(
+                name, {"builds": 0, "tokens": 0, "ms": 0.0, "max_ms": 0.0, "timeout": 0, "error": 0,
+                       "saturated": 0, "trimmed": 0, "dropped": 0}
+            )
+            s["builds"] += 1
+            s["tokens"] += entry["tokens"]
+            s["ms"] += entry["ms"]
+            s["max_ms"] = max(s["max_ms"], entry["ms"])
+            if entry["status"] in ("timeout", "error", "saturated", "trimmed", "dropped"):
+                s[entry["status"]] += 1
+
+    def snapshot(self) -> dict:
+        builds = self.stats["builds"]
+        return {
+            "builds": builds,
+            "over_budget": self.stats["over_budget"],
+            "max_tokens": self.max_tokens,
+            "avg_build_ms": round(self.stats["build_ms"] / builds, 3) if builds else 0.0,
+            "threads_busy": self._in_flight,
+            "components": {
+                name: {
+                    **{k: v for k, v in s.items() if k not in ("tokens", "ms")},
+                    "max_ms": round(s["max_ms"], 3),
+                    "avg_tokens": round(s["tokens"] / s["builds"], 1),
+                    "avg_ms": round(s["ms"] / s["builds"], 3),
+                }
+                for name, s in self.component_stats.items()
+            },
+        }
+
+
+# Testing
+async def test_prompt_assembly():
+    """A slow component misses its deadline; an oversized one is trimmed to the total"""
+    print("=" * 60)
+    print("Testing PromptAssembler")
+    print("=" * 60)
+
+    def slow_search():
+        time.sleep(0.2)
+        return "- late fact"
+
+    assembler = PromptAssembler(max_tokens=60)
+    components = [
+        PromptComponent("memory", lambda: "\n".join(f"用户: 第{i}句话" for i in range(20)),
+                        header="[对话上下文]", priority=80, keep="end"),
+        PromptComponent("rag", slow_search, header="[已知事实]", priority=60, in_thread=True, deadline_ms=50),
+        PromptComponent("recall", lambda: "- 用户: 我的猫叫小白", header="[长期记忆]", priority=40),
+    ]
+    blocks, report = await assembler.assemble(components)
+    for name, entry in report["components"].items():
+        print(f"{name:8} {entry}")
+    print(f"total {report['total_tokens']} tokens in {report['build_ms']:.1f}ms")
+    print(blocks["memory"])
+
+
+if __name__ == "__main__":
+    asyncio.run(test_prompt_assembly())
@@ -2,26 +2,19 @@ from __future__ import annotations
 
 import csv
 import json
-import re
-from dataclasses import dataclass
+import threading
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Dict, Iterable, List, Optional
 
+from text_utils import extract_tokens, is_cjk
 
 Record = Dict[str, object]
 
 
-def _is_cjk(ch: str) -> bool:
-    return '\u4e00' <= ch <= '\u9fff'
-
-
-def _extract_tokens(text: str) -> List[str]:
-    """Return simple tokens for scoring (EN words + CJK bigrams)."""
-    t = text or ""
-    words = re.findall(r"[A-Za-z0-9]+", t.lower())
-    cjks = [c for c in t if _is_cjk(c)]
-    bigrams = [cjks[i] + cjks[i + 1] for i in range(len(cjks) - 1)] if len(cjks) > 1 else []
-    return words + bigrams
+# Tokenization lives in text_utils so memory and caching share the scheme
+_is_cjk = is_cjk
+_extract_tokens = extract_tokens
 
 
 def _score(query: str, text: str) -> float:
@@ -95,13 +88,23 @@ def _read_csv(path: Path) -> List[Record]:
 class KnowledgeBase:
     root: Path = Path("rag/data")
     records: Optional[List[Record]] = None
+    lazy: bool = False  # defer reading root until ensure_loaded()/first search
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
 
     def __post_init__(self):
         self.root = Path(self.root)
         self.root.mkdir(parents=True, exist_ok=True)
-        if self.records is None:
+        if self.records is None and not self.lazy:
             self.records = self._load_all()
 
+    def ensure_loaded(self) -> int:
+        """Load records if not loaded yet (safe to call from a worker thread)"""
+        if self.records is None:
+            with self._lock:
+                if self.records is None:
+                    self.records = self._load_all()
+        return len(self.records)
+
     def _load_all(self) -> List[Record]:
         items: List[Record] = []
         if not self.root.exists():
@@ -123,6 +126,7 @@ class KnowledgeBase:
         self.records = self._load_all()
 
     def search(self, query: str, top_k: int = 3, min_score: float = 0.0) -> List[Record]:
+        self.ensure_loaded()
         recs = self.records or []
         scored = []
         for r in recs:
@@ -0,0 +1,101 @@
+"""
+Rolling health statistics for Ani v0 backends
+Shared by the TTS engine router (and any other component that has to
+route around slow or failing dependencies at runtime)
+"""
+import time
+from collections import deque
+from typing import Deque, Optional
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 1)
+
+
+class RollingStats:
+    """
+    Rolling latency / error window for one backend
+    - Keeps the last `window` outcomes; latencies only for successes
+    - Opens a circuit after `failure_threshold` consecutive failures and
+      keeps it open for `cooldown_s`, then lets one probe request through
+    """
+
+    def __init__(self, window: int = 50, failure_threshold: int = 3, cooldown_s: float = 30.0):
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.cooldown_s = cooldown_s
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.total_requests = 0
+        self.total_failures = 0
+        self.last_error: Optional[str] = None
+        self.opened_at: Optional[float] = None
+
+    def record_success(self, latency_ms: float):
+        self.latencies.append(latency_ms)
+        self.outcomes.append(True)
+        self.total_requests += 1
+        self.consecutive_failures = 0
+        self.opened_at = None
+
+    def record_abandoned(self, elapsed_ms: float):
+        """A request cancelled unfinished (hedge loser): its elapsed time is a latency lower bound"""
+        self.latencies.append(elapsed_ms)
+
+    def record_failure(self, error: BaseException):
+        self.outcomes.append(False)
+        self.total_requests += 1
+        self.total_failures += 1
+        self.consecutive_failures += 1
+        self.last_error = f"{type(error).__name__}: {error}"[:200]
+        if self.consecutive_failures >= self.failure_threshold:
+            self.opened_at = time.time()
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    @property
+    def circuit_open(self) -> bool:
+        """True while the cooldown after repeated failures is running"""
+        if self.opened_at is None:
+            return False
+        return (time.time() - self.opened_at) < self.cooldown_s
+
+    def percentile(self, p: float, min_samples: int = 1) -> Optional[float]:
+        """Latency percentile over the window, or None with too few samples"""
+        if len(self.latencies) < max(1, min_samples):
+            return None
+        ordered = sorted(self.latencies)
+        idx = min(len(ordered) - 1, int(round((p / 100.0) * (len(ordered) - 1))))
+        return ordered[idx]
+
+    def is_healthy(self, max_error_rate: float = 0.5, min_samples: int = 5) -> bool:
+        if self.opened_at is not None:
+            # Open: skip. Cooldown over: half-open, let a probe through
+            return not self.circuit_open
+        if len(self.outcomes) >= min_samples and self.error_rate > max_error_rate:
+            return False
+        return True
+
+    def score(self) -> float:
+        """0..1 health score: success rate discounted by median latency"""
+        p50 = self.percentile(50)
+        latency_factor = 1.0 if p50 is None else 1.0 / (1.0 + p50 / 1000.0)
+        return round((1.0 - self.error_rate) * latency_factor, 3)
+
+    def snapshot(self) -> dict:
+        return {
+            "healthy": self.is_healthy(),
+            "score": self.score(),
+            "circuit_open": self.circuit_open,
+            "error_rate": round(self.error_rate, 3),
+            "p50_ms": _round(self.percentile(50)),
+            "p95_ms": _round(self.percentile(95)),
+            "requests": self.total_requests,
+            "failures": self.total_failures,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,215 @@
+"""
+Response cache for Ani v0
+Short, repeated small talk ("你好", "hello", "谢谢") doesn't need a fresh LLM
+round trip every time. Replies are cached under the normalized user input plus
+a coarse context fingerprint (language, last emote, memory summary), with TTL
+and LRU eviction. The cache is shared by all sessions, so only replies the LLM
+classified as small talk are stored (and the pipeline never stores one whose
+prompt carried recalled memories or RAG facts). An entry can also hold its synthesized audio (per output
+sample rate), so a hit skips both the LLM and TTS.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, Optional, Tuple
+
+from text_utils import detect_language, extract_tokens
+
+
+NON_WORD_RE = re.compile(r"[\W_]+", re.UNICODE)
+
+CacheKey = Tuple[str, str]  # (normalized input, context fingerprint)
+CACHEABLE_INTENTS = frozenset({"SMALL_TALK"})  # other replies may depend on who is asking
+
+
+def normalize_input(text: str) -> str:
+    """Case/width/punctuation-insensitive form: "Hello!!" == "hello", "你好～" == "你好" """
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return NON_WORD_RE.sub(" ", text).strip()
+
+
+def context_fingerprint(language: str, last_emote: Optional[str], summary: str = "") -> str:
+    """Coarse conversation state: a reply cached in one mood/topic isn't reused in another"""
+    summary_hash = hashlib.blake2s(summary.encode("utf-8"), digest_size=4).hexdigest() if summary else "-"
+    return f"{language}|{last_emote or '-'}|{summary_hash}"
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+@dataclass
+class ResponseCacheConfig:
+    """Cache limits (ANI_RESPONSE_CACHE, ANI_RESPONSE_CACHE_TTL_S, ANI_RESPONSE_CACHE_FUZZY, ...)"""
+    enabled: bool = True
+    max_entries: int = 256
+    ttl_s: float = 600.0
+    max_input_chars: int = 32  # only short inputs are small talk worth caching
+    fuzzy: bool = False  # token-set Jaccard match when there is no exact hit
+    fuzzy_threshold: float = 0.8
+    max_audio_bytes: int = 32 * 1024 * 1024
+
+    @classmethod
+    def from_env(cls) -> "ResponseCacheConfig":
+        config = cls()
+        config.enabled = os.getenv("ANI_RESPONSE_CACHE", "1").lower() in {"1", "true", "yes", "on"}
+        config.fuzzy = os.getenv("ANI_RESPONSE_CACHE_FUZZY", "0").lower() in {"1", "true", "yes", "on"}
+        for name, cast in (("max_entries", int), ("ttl_s", float), ("fuzzy_threshold", float)):
+            value = os.getenv(f"ANI_RESPONSE_CACHE_{name.upper()}")
+            if value:
+                try:
+                    setattr(config, name, cast(value))
+                except ValueError:
+                    pass
+        return config
+
+
+@dataclass
+class CacheEntry:
+    key: CacheKey
+    response: Dict[str, Any]
+    tokens: FrozenSet[str]
+    created: float = field(default_factory=time.time)
+    hits: int = 0
+    audio: Dict[int, dict] = field(default_factory=dict)  # sample_rate -> TTS result
+    audio_bytes: int = 0
+
+
+class ResponseCache:
+    """LRU + TTL cache of LLM replies (and their audio) keyed by input and context"""
+
+    def __init__(self, config: Optional[ResponseCacheConfig] = None):
+        self.config = config or ResponseCacheConfig()
+        self.entries: "OrderedDict[CacheKey, CacheEntry]" = OrderedDict()
+        self.audio_bytes = 0
+        self.stats = {"hits": 0, "fuzzy_hits": 0, "audio_hits": 0, "misses": 0,
+                      "stores": 0, "not_small_talk": 0, "evictions": 0, "expired": 0}
+
+    def cacheable(self, user_input: str) -> bool:
+        normalized = normalize_input(user_input)
+        return self.config.enabled and bool(normalized) and len(normalized) <= self.config.max_input_chars
+
+    def _drop(self, key: CacheKey):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.audio_bytes -= entry.audio_bytes
+
+    def _fresh(self, entry: CacheEntry, now: float) -> bool:
+        if now - entry.created <= self.config.ttl_s:
+            return True
+        self._drop(entry.key)
+        self.stats["expired"] += 1
+        return False
+
+    def get(self, user_input: str, fingerprint: str) -> Optional[CacheEntry]:
+        if not self.cacheable(user_input):
+            return None
+        now = time.time()
+        key = (normalize_input(user_input), fingerprint)
+        entry = self.entries.get(key)
+        if entry is not None and self._fresh(entry, now):
+            self.entries.move_to_end(key)
+            entry.hits += 1
+            self.stats["hits"] += 1
+            return entry
+
+        if self.config.fuzzy:
+            tokens = frozenset(extract_tokens(user_input))
+            best, best_score = None, self.config.fuzzy_threshold
+            for candidate in list(self.entries.values()):
+                if candidate.key[1] != fingerprint or not self._fresh(candidate, now):
+                    continue
+                score = jaccard(tokens, candidate.tokens)
+                if score >= best_score:
+                    best, best_score = candidate, score
+            if best is not None:
+                self.entries.move_to_end(best.key)
+                best.hits += 1
+                self.stats["hits"] += 1
+                self.stats["fuzzy_hits"] += 1
+                return best
+
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, user_input: str, fingerprint: str, response: Dict[str, Any]) -> Optional[CacheKey]:
+        """Store a validated small-talk reply; returns the key to attach audio to later"""
+        if not self.cacheable(user_input) or response.get("error"):
+            return None
+        if response.get("intent") not in CACHEABLE_INTENTS:
+            self.stats["not_small_talk"] += 1
+            return None
+        key = (normalize_input(user_input), fingerprint)
+        self._drop(key)
+        stored = {k: v for k, v in response.items() if not k.startswith("llm_") and not k.startswith("cache_")}
+        self.entries[key] = CacheEntry(key=key, response=stored, tokens=frozenset(extract_tokens(user_input)))
+        self.stats["stores"] += 1
+        self._evict()
+        return key
+
+    def attach_audio(self, key: Optional[CacheKey], sample_rate: int, tts_result: dict):
+        """Keep a synthesized reply (plus its base64 form) for later hits"""
+        entry = self.entries.get(key) if key else None
+        if entry is None or not tts_result or not tts_result.get("audio"):
+            return
+        import base64
+
+        cached = {k: v for k, v in tts_result.items() if k != "tts_latency_ms"}
+        cached["audio_b64"] = base64.b64encode(tts_result["audio"]).decode("utf-8")
+        size = len(tts_result["audio"]) + len(cached["audio_b64"])
+        old = entry.audio.get(sample_rate)
+        if old is not None:
+            size -= len(old["audio"]) + len(old["audio_b64"])
+        entry.audio[sample_rate] = cached
+        entry.audio_bytes += size
+        self.audio_bytes += size
+        self._evict()
+
+    def get_audio(self, key: Optional[CacheKey], sample_rate: int) -> Optional[dict]:
+        entry = self.entries.get(key) if key else None
+        audio = entry.audio.get(sample_rate) if entry is not None else None
+        if audio is not None:
+            self.stats["audio_hits"] += 1
+        return audio
+
+    def _evict(self):
+        while self.entries and (
+            len(self.entries) > self.config.max_entries or self.audio_bytes > self.config.max_audio_bytes
+        ):
+            key = next(iter(self.entries))
+            self._drop(key)
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.audio_bytes = 0
+
+    def snapshot(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "enabled": self.config.enabled,
+            "entries": len(self.entries),
+            "audio_bytes": self.audio_bytes,
+            "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+        }
+
+
+def fingerprint_for(user_input: str, memory=None) -> str:
+    """Context fingerprint from a ConversationMemory (or none)"""
+    last_emote, summary = None, ""
+    if memory is not None:
+        summary = getattr(memory, "summary", "") or ""
+        for turn in reversed(getattr(memory, "turns", [])):
+            if turn.role == "assistant":
+                last_emote = turn.emote
+                break
+    return context_fingerprint(detect_language(user_input), last_emote, summary)
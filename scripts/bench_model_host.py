@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Concurrent-sessions-per-box benchmark for the shared model host
+
+Each simulated session streams 512-sample VAD chunks at real-time pace
+(one per 32ms) and submits an STT job for every utterance it "finishes".
+Session counts are ramped until VAD or STT latency misses its budget; the
+last passing step is the sessions-per-box figure for this machine.
+
+Start the host first (or pass --spawn):
+  python model_host.py --address /tmp/ani_model_host.sock --tts-engine ""
+
+Usage
+  python scripts/bench_model_host.py --sessions 1,2,4,8,16,32 --duration 10
+  python scripts/bench_model_host.py --spawn --vad-budget-ms 32 --stt-budget-ms 800
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from model_host import DEFAULT_ADDRESS, ModelHostClient  # noqa: E402
+
+SAMPLE_RATE = 16000
+CHUNK = 512
+
+
+def pct(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(p / 100.0 * (len(ordered) - 1)))], 2)
+
+
+async def run_session(client: ModelHostClient, duration_s: float, utterance_s: float,
+                      vad_ms: List[float], stt_ms: List[float], lag: List[int]):
+    rng = np.random.default_rng()
+    chunk_period = CHUNK / SAMPLE_RATE
+    utterance = (rng.standard_normal(int(SAMPLE_RATE * utterance_s)) * 0.05).astype(np.float32)
+    chunks_per_utterance = int(utterance_s / chunk_period)
+    stt_tasks = []
+    start = time.perf_counter()
+    n = 0
+    while time.perf_counter() - start < duration_s:
+        chunk = (rng.standard_normal(CHUNK) * 0.05).astype(np.float32)
+        t0 = time.perf_counter()
+        await client.request("vad", chunk.tobytes())
+        vad_ms.append((time.perf_counter() - t0) * 1000)
+        n += 1
+        if n % chunks_per_utterance == 0:
+            stt_tasks.append(asyncio.create_task(timed_stt(client, utterance, stt_ms)))
+        # Real-time pacing: a session that falls behind its microphone counts as lagging
+        next_at = start + n * chunk_period
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        elif -delay > chunk_period:
+            lag.append(1)
+    if stt_tasks:
+        await asyncio.gather(*stt_tasks, return_exceptions=True)
+
+
+async def timed_stt(client: ModelHostClient, audio: np.ndarray, stt_ms: List[float]):
+    t0 = time.perf_counter()
+    await client.request("stt", audio.tobytes(), language="zh")
+    stt_ms.append((time.perf_counter() - t0) * 1000)
+
+
+async def run_step(address: str, sessions: int, args) -> Dict:
+    # One connection per simulated worker, sessions spread across them (like uvicorn workers)
+    clients = [ModelHostClient(address, timeout=60.0) for _ in range(min(sessions, args.workers))]
+    vad_ms: List[float] = []
+    stt_ms: List[float] = []
+    lag: List[int] = []
+    await asyncio.gather(*[
+        run_session(clients[i % len(clients)], args.duration, args.utterance_s, vad_ms, stt_ms, lag)
+        for i in range(sessions)
+    ])
+    for client in clients:
+        await client.close()
+    result = {
+        "sessions": sessions,
+        "vad_p50_ms": pct(vad_ms, 50),
+        "vad_p95_ms": pct(vad_ms, 95),
+        "stt_p50_ms": pct(stt_ms, 50),
+        "stt_p95_ms": pct(stt_ms, 95),
+        "stt_jobs": len(stt_ms),
+        "lagging_chunks": len(lag),
+    }
+    result["pass"] = (result["vad_p95_ms"] <= args.vad_budget_ms
+                      and (not stt_ms or result["stt_p95_ms"] <= args.stt_budget_ms))
+    return result
+
+
+async def bench(args) -> Dict:
+    steps = []
+    for sessions in [int(s) for s in args.sessions.split(",")]:
+        result = await run_step(args.address, sessions, args)
+        mark = "[OK]" if result["pass"] else "[FAIL]"
+        print(f"{mark} {sessions:>3} sessions  VAD p95 {result['vad_p95_ms']:7.2f}ms  "
+              f"STT p95 {result['stt_p95_ms']:8.1f}ms  lagging {result['lagging_chunks']}")
+        steps.append(result)
+        if not result["pass"] and not args.keep_going:
+            break
+    passing = [s["sessions"] for s in steps if s["pass"]]
+    return {"address": args.address, "steps": steps, "max_sessions": max(passing) if passing else 0}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark sessions per box against the model host")
+    ap.add_argument("--address", default=DEFAULT_ADDRESS)
+    ap.add_argument("--sessions", default="1,2,4,8,16,32", help="comma-separated ramp")
+    ap.add_argument("--workers", type=int, default=4, help="simulated worker connections")
+    ap.add_argument("--duration", type=float, default=10.0, help="seconds per step")
+    ap.add_argument("--utterance-s", type=float, default=2.0, help="speech length per STT job")
+    ap.add_argument("--vad-budget-ms", type=float, default=32.0, help="VAD p95 must keep up with real time")
+    ap.add_argument("--stt-budget-ms", type=float, default=800.0)
+    ap.add_argument("--keep-going", action="store_true", help="run every step even after a failure")
+    ap.add_argument("--spawn", action="store_true", help="start model_host.py (no TTS) for the run")
+    ap.add_argument("--out", default="", help="write the JSON report here")
+    args = ap.parse_args()
+
+    host_proc = None
+    if args.spawn:
+        host_proc = subprocess.Popen([sys.executable, str(ROOT / "model_host.py"),
+                                      "--address", args.address, "--tts-engine", ""], cwd=str(ROOT))
+        from launch_workers import wait_for_host
+        asyncio.run(wait_for_host(args.address, 600.0))
+    try:
+        report = asyncio.run(bench(args))
+    finally:
+        if host_proc is not None:
+            host_proc.terminate()
+            host_proc.wait(timeout=10)
+
+    print(f"\nMax concurrent sessions within budget: {report['max_sessions']}")
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"Report written to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Offline per-stage benchmark suite for Ani v0
+
+Times each pipeline stage in isolation on fixed, seeded inputs:
+- KnowledgeBase.search over 1k / 10k / 100k synthetic records
+- LLMPipeline._build_prompt (full memory window + RAG) and _clean_utterance
+- ConversationMemory add / render
+- SimplePhonemizer.estimate_phonemes
+- Silero VAD per 512-sample chunk and Faster-Whisper on fixed WAVs
+  (skipped with a note when torch / faster-whisper / the model are unavailable)
+
+Each case gets warmup iterations, then runs until --repeat samples or its
+time budget is used up. Reports p50/p99 and throughput, and compares p50
+against a stored baseline: anything slower by more than --threshold is
+flagged as a regression.
+
+Usage
+  python scripts/bench_stages.py
+  python scripts/bench_stages.py --only kb --repeat 200
+  python scripts/bench_stages.py --save-baseline            # refresh scripts/bench_baseline.json
+  python scripts/bench_stages.py --fail-on-regression --json reports/bench.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import gc
+import json
+import platform
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+DEFAULT_BASELINE = ROOT / "scripts" / "bench_baseline.json"
+
+ZH_WORDS = ["耳机", "降噪", "续航", "价格", "蓝牙", "音质", "动漫", "天气", "咖啡", "推荐", "手机", "电池", "舒适", "游戏"]
+EN_WORDS = ["wireless", "headphones", "battery", "anime", "coffee", "price", "bluetooth", "comfort", "gaming", "review"]
+QUERIES = ["降噪耳机推荐", "battery life", "蓝牙耳机价格", "anime recommendation", "咖啡", "gaming headphones 续航"]
+UTTERANCES = [
+    "你好呀！我是Ani，很高兴见到你！(*^_^*) 有什么我可以帮你的吗？",
+    "Hey there! 😀 I'm doing great, thanks for asking~~",
+    "今天天气真不错呢，要不要出去走走？^_^",
+    "我超喜欢 Attack on Titan 的！你最喜欢哪个角色？",
+]
+
+
+class Skip(Exception):
+    """Raised by a case setup when its optional dependency is missing"""
+
+
+def pct(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100.0 * (len(ordered) - 1)))]
+
+
+def run_case(fn: Callable[[int], object], warmup: int, repeat: int, budget_s: float) -> Dict[str, float]:
+    for i in range(warmup):
+        fn(i)
+    gc.collect()
+    samples: List[float] = []
+    deadline = time.perf_counter() + budget_s
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - t0) * 1000)
+        if len(samples) >= 3 and time.perf_counter() > deadline:
+            break
+    total_s = sum(samples) / 1000
+    return {
+        "samples": len(samples),
+        "p50_ms": round(pct(samples, 50), 4),
+        "p99_ms": round(pct(samples, 99), 4),
+        "mean_ms": round(sum(samples) / len(samples), 4),
+        "ops_per_s": round(len(samples) / total_s, 1) if total_s else 0.0,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Cases (each setup returns fn(i) -> None, or raises Skip)
+# ---------------------------------------------------------------------------
+
+def synthetic_records(n: int, seed: int = 7) -> List[dict]:
+    rng = random.Random(seed)
+    records = []
+    for i in range(n):
+        words = rng.sample(ZH_WORDS, 4) + rng.sample(EN_WORDS, 3)
+        rng.shuffle(words)
+        text = "".join(w if w in ZH_WORDS else f" {w} " for w in words)
+        records.append({"id": f"syn:{i}", "title": text[:20], "text": text, "tags": [], "meta": {}, "source": "synthetic"})
+    return records
+
+
+def setup_kb(n: int):
+    def factory():
+        from rag.knowledge import KnowledgeBase
+        kb = KnowledgeBase(root=Path(tempfile.mkdtemp(prefix="ani_bench_kb_")), records=synthetic_records(n))
+        return lambda i: kb.search(QUERIES[i % len(QUERIES)], top_k=3)
+    return factory
+
+
+def make_llm():
+    from llm_pipeline import LLMPipeline, LLMConfig
+    llm = LLMPipeline(LLMConfig(backend="mock", model="mock", character_name="Anita"))
+    if llm.memory is not None:
+        for k in range(4):
+            llm.memory.add_user(f"第{k}个问题：推荐一款降噪耳机？")
+            llm.memory.add_assistant(UTTERANCES[k % len(UTTERANCES)], emote="joy")
+    return llm
+
+
+def setup_build_prompt():
+    llm = make_llm()
+    return lambda i: llm._build_prompt(QUERIES[i % len(QUERIES)])
+
+
+def setup_clean_utterance():
+    llm = make_llm()
+    return lambda i: llm._clean_utterance(UTTERANCES[i % len(UTTERANCES)])
+
+
+def setup_memory_add():
+    from memory import ConversationMemory
+    memory = ConversationMemory(max_turns=8, summary_interval=4)
+
+    def fn(i):
+        memory.add_user(QUERIES[i % len(QUERIES)])
+        memory.add_assistant(UTTERANCES[i % len(UTTERANCES)], emote="joy")
+    return fn
+
+
+def setup_memory_render():
+    from memory import ConversationMemory
+    memory = ConversationMemory(max_turns=8, summary_interval=4)
+    for i in range(8):
+        memory.add_user(QUERIES[i % len(QUERIES)])
+        memory.add_assistant(UTTERANCES[i % len(UTTERANCES)], emote="joy")
+    return lambda i: memory.get_context_block()
+
+
+def setup_phonemizer():
+    from tts_pipeline import SimplePhonemizer
+    return lambda i: SimplePhonemizer.estimate_phonemes(UTTERANCES[i % len(UTTERANCES)], 2500.0)
+
+
+def fixed_wavs(seconds: float = 3.0):
+    """Fixed 16 kHz float32 clips from the repo's PCM WAVs"""
+    import numpy as np
+    from tts_pipeline import AudioPostProcessor, TTSConfig
+    post = AudioPostProcessor(TTSConfig())
+    clips = []
+    for name in ["voice_samples/lin.wav", "voice_samples/wei.wav", "voice_samples/wzy.wav"]:
+        path = ROOT / name
+        if path.exists():
+            pcm = post.to_pcm16(path.read_bytes(), 16000)
+            if pcm is not None:
+                clips.append(pcm[:int(seconds * 16000)].astype(np.float32) / 32768.0)
+    if not clips:
+        raise Skip("no fixed WAVs found")
+    return clips
+
+
+def setup_vad():
+    try:
+        from audio_pipeline import SileroVAD, AudioConfig
+    except ImportError as e:
+        raise Skip(f"torch unavailable ({e})")
+    vad = SileroVAD(AudioConfig())
+    try:
+        asyncio.run(vad.load())
+    except Exception as e:
+        raise Skip(f"Silero VAD not loadable ({e})")
+    clip = fixed_wavs()[0]
+    chunks = [clip[o:o + 512] for o in range(0, len(clip) - 511, 512)]
+    return lambda i: vad.detect_speech(chunks[i % len(chunks)])
+
+
+def setup_stt(model_size: str):
+    def factory():
+        try:
+            from audio_pipeline import WhisperSTT
+            import faster_whisper  # noqa: F401
+        except ImportError as e:
+            raise Skip(f"torch / faster-whisper unavailable ({e})")
+        stt = WhisperSTT(model_size=model_size)
+        try:
+            asyncio.run(stt.load())
+        except Exception as e:
+            raise Skip(f"Whisper model not loadable ({e})")
+        clips = fixed_wavs()
+        return lambda i: stt.transcribe_sync(clips[i % len(clips)], language="zh")
+    return factory
+
+
+def build_cases(args) -> Dict[str, tuple]:
+    """name -> (setup, warmup, repeat, budget_s)"""
+    heavy = dict(warmup=1, repeat=min(args.repeat, 20), budget=args.budget_s * 4)
+    return {
+        "kb.search@1k": (setup_kb(1_000), args.warmup, args.repeat, args.budget_s),
+        "kb.search@10k": (setup_kb(10_000), args.warmup, args.repeat, args.budget_s),
+        "kb.search@100k": (setup_kb(100_000), 1, min(args.repeat, 30), args.budget_s * 4),
+        "llm.build_prompt": (setup_build_prompt, args.warmup, args.repeat, args.budget_s),
+        "llm.clean_utterance": (setup_clean_utterance, args.warmup, args.repeat, args.budget_s),
+        "memory.add_pair": (setup_memory_add, args.warmup, args.repeat, args.budget_s),
+        "memory.context_block": (setup_memory_render, args.warmup, args.repeat, args.budget_s),
+        "tts.estimate_phonemes": (setup_phonemizer, args.warmup, args.repeat, args.budget_s),
+        "vad.chunk": (setup_vad, args.warmup, args.repeat, args.budget_s),
+        "stt.wav3s": (setup_stt(args.whisper), heavy["warmup"], heavy["repeat"], heavy["budget"]),
+    }
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    regressions = []
+    for name, res in results.items():
+        base = baseline.get(name)
+        if not base or "p50_ms" not in res or "p50_ms" not in base or base["p50_ms"] <= 0:
+            continue
+        ratio = res["p50_ms"] / base["p50_ms"]
+        res["vs_baseline"] = round(ratio, 3)
+        if ratio > 1.0 + threshold:
+            regressions.append(f"{name}: p50 {res['p50_ms']:.4f}ms vs baseline {base['p50_ms']:.4f}ms (x{ratio:.2f})")
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Per-stage offline benchmarks with baseline comparison")
+    ap.add_argument("--only", default="", help="comma-separated substrings of case names")
+    ap.add_argument("--warmup", type=int, default=20)
+    ap.add_argument("--repeat", type=int, default=500)
+    ap.add_argument("--budget-s", type=float, default=2.0, help="time cap per case")
+    ap.add_argument("--whisper", default="small", help="faster-whisper model size for stt")
+    ap.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+    ap.add_argument("--threshold", type=float, default=0.25, help="allowed p50 slowdown vs baseline")
+    ap.add_argument("--save-baseline", action="store_true", help="write results as the new baseline")
+    ap.add_argument("--fail-on-regression", action="store_true", help="exit 1 if anything regressed")
+    ap.add_argument("--json", default="", help="write full results here")
+    args = ap.parse_args()
+
+    random.seed(0)
+    filters = [f.strip() for f in args.only.split(",") if f.strip()]
+    results: Dict[str, dict] = {}
+    print(f"{'case':<24} {'p50 ms':>10} {'p99 ms':>10} {'ops/s':>12}  samples")
+    for name, (setup, warmup, repeat, budget) in build_cases(args).items():
+        if filters and not any(f in name for f in filters):
+            continue
+        try:
+            fn = setup()
+        except Skip as e:
+            results[name] = {"skipped": str(e)}
+            print(f"{name:<24} {'skipped':>10}  ({e})")
+            continue
+        res = run_case(fn, warmup, repeat, budget)
+        results[name] = res
+        print(f"{name:<24} {res['p50_ms']:>10.4f} {res['p99_ms']:>10.4f} {res['ops_per_s']:>12.1f}  {res['samples']}")
+
+    baseline_path = Path(args.baseline)
+    regressions: List[str] = []
+    if baseline_path.exists() and not args.save_baseline:
+        stored = json.loads(baseline_path.read_text(encoding="utf-8"))
+        if stored.get("machine") != platform.node():
+            print(f"\n[WARN] Baseline recorded on '{stored.get('machine')}', comparing anyway")
+        regressions = compare(results, stored.get("results", {}), args.threshold)
+        if regressions:
+            print(f"\n[FAIL] {len(regressions)} regression(s) beyond +{args.threshold:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+        else:
+            print(f"\n[OK] No regressions beyond +{args.threshold:.0%} vs {baseline_path.name}")
+
+    report = {
+        "machine": platform.node(),
+        "python": platform.python_version(),
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+        "regressions": regressions,
+    }
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(report, indent=2, sort_keys=True, ensure_ascii=False) + "\n", encoding="utf-8")
+        print(f"\n[OK] Baseline saved to {baseline_path}")
+    if args.json:
+        Path(args.json).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.json).write_text(json.dumps(report, indent=2, sort_keys=True, ensure_ascii=False) + "\n", encoding="utf-8")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
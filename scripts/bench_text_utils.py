@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark for text_utils (language detection, span splitting, cleaning)
+
+Corpus
+- Every canned utterance in MockLLMBackend (real bilingual replies)
+- Typical user inputs, including code-switched ones
+
+Compares the shared precompiled helpers with the previous inline
+implementations (re.search/re.sub with pattern strings on every call).
+
+Usage
+  python scripts/bench_text_utils.py --repeat 2000
+"""
+
+from __future__ import annotations
+
+import argparse
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from llm_pipeline import LLMConfig, MockLLMBackend  # noqa: E402
+from text_utils import clean_utterance, detect_language, split_language_spans  # noqa: E402
+
+
+USER_INPUTS = [
+    "你好", "hello", "谢谢", "how are you", "今天天气怎么样？",
+    "我喜欢 Taylor Swift 的歌", "Can you recommend 一个好吃的餐厅?",
+    "我刚看完 Attack on Titan, 太好看了！", "What's your favorite anime?",
+    "明天 3 点在 Starbucks 见面吧", "Tell me a joke (^_^)", "好开心呀~~ 😀",
+]
+
+
+def build_corpus() -> List[str]:
+    mock = MockLLMBackend(LLMConfig(character_name="Anita"))
+    corpus = [r["utterance"] for rs in mock.responses.values() for r in rs]
+    return corpus + USER_INPUTS
+
+
+def legacy_detect(text: str) -> str:
+    if re.search(r'[\u4e00-\u9fff]', text):
+        return "zh"
+    return "en"
+
+
+def legacy_clean(text: str) -> str:
+    emoji_pattern = re.compile(
+        "["
+        "\U0001F600-\U0001F64F"
+        "\U0001F300-\U0001F5FF"
+        "\U0001F680-\U0001F6FF"
+        "\U0001F1E0-\U0001F1FF"
+        "\U0001F900-\U0001F9FF"
+        "\U0001FA70-\U0001FAFF"
+        "]+",
+        flags=re.UNICODE
+    )
+    text = emoji_pattern.sub('', text)
+    text = re.sub(r'\([*^_~=><]+[^)]*\)', '', text)
+    text = re.sub(r'(?<!\w)[\^_~=><]{2,}(?!\w)', '', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def bench(name: str, fn: Callable[[str], object], corpus: List[str], repeat: int) -> float:
+    for text in corpus:  # warmup
+        fn(text)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in corpus:
+            fn(text)
+    elapsed = time.perf_counter() - start
+    per_call_us = elapsed / (repeat * len(corpus)) * 1e6
+    print(f"  {name:<28} {per_call_us:8.2f} us/call")
+    return per_call_us
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark shared text utilities")
+    ap.add_argument("--repeat", type=int, default=2000, help="passes over the corpus")
+    args = ap.parse_args()
+
+    corpus = build_corpus()
+    print(f"Corpus: {len(corpus)} utterances, {args.repeat} passes\n")
+
+    print("Language detection")
+    old = bench("legacy re.search", legacy_detect, corpus, args.repeat)
+    new = bench("text_utils.detect_language", detect_language, corpus, args.repeat)
+    print(f"  speedup x{old / new:.2f}\n")
+
+    print("Utterance cleaning")
+    old = bench("legacy _clean_utterance", legacy_clean, corpus, args.repeat)
+    new = bench("text_utils.clean_utterance", clean_utterance, corpus, args.repeat)
+    print(f"  speedup x{old / new:.2f}\n")
+
+    print("Mixed-language spans")
+    bench("split_language_spans", split_language_spans, corpus, args.repeat)
+    for text in USER_INPUTS[5:10]:
+        print(f"  {text!r} -> {split_language_spans(text)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fake Ollama server for offline testing of the Ollama backend
+
+Implements /api/tags, /api/generate and /api/chat with Ollama's response
+fields and simulated costs:
+- a model load (load_duration) on the first request and after keep_alive expires
+- a per-model KV cache: only prompt tokens after the longest common prefix with
+  the previous request are evaluated (prompt_eval_count / prompt_eval_duration)
+- eval_count / eval_duration for the generated tokens, capped by num_predict
+  (a truncated JSON reply is what a real model returns when the budget is too small)
+- "stream": true sends NDJSON chunks; a client that disconnects stops generation
+  (counted as stopped_early, with the tokens actually generated)
+
+Replies are canned JSON from MockLLMBackend, plus a "plan" object when the
+prompt asks for one. Times are simulated (the server really sleeps), so
+end-to-end latency moves with prefix reuse and output length as well.
+
+Usage
+  python scripts/fake_ollama.py --port 11434                 # serve
+  python scripts/fake_ollama.py --selftest --turns 6         # drive LLMPipeline against it
+  python scripts/fake_ollama.py --selftest --no-chat         # compare with /api/generate
+  python scripts/fake_ollama.py --selftest --no-stream --plan  # old behaviour: full reply incl. plan
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from aiohttp import web  # noqa: E402
+
+from llm_pipeline import LLMConfig, LLMPipeline, MockLLMBackend  # noqa: E402
+from text_utils import detect_language  # noqa: E402
+
+TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+PIECE_RE = re.compile(r"\w{1,4}|\s+|[^\w\s]", re.UNICODE)  # output "tokens" (concatenate back to the text)
+DURATION_RE = re.compile(r"^(-?\d+(?:\.\d+)?)(ms|s|m|h)?$")
+
+
+def parse_keep_alive(value, default_s: float = 300.0) -> float:
+    """Ollama accepts seconds (number) or duration strings ("30m"); negative = forever"""
+    if value is None:
+        return default_s
+    if isinstance(value, (int, float)):
+        seconds = float(value)
+    else:
+        m = DURATION_RE.match(str(value).strip())
+        if not m:
+            return default_s
+        scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, None: 1}[m.group(2)]
+        seconds = float(m.group(1)) * scale
+    return float("inf") if seconds < 0 else seconds
+
+
+class FakeOllama:
+    def __init__(self, load_ms: float = 1500, prompt_ms_per_token: float = 0.8, eval_ms_per_token: float = 12):
+        self.load_ms = load_ms
+        self.prompt_ms_per_token = prompt_ms_per_token
+        self.eval_ms_per_token = eval_ms_per_token
+        self.loaded_until: Dict[str, float] = {}
+        self.kv_cache: Dict[str, List[str]] = {}
+        self.mock = MockLLMBackend(LLMConfig(backend="mock", character_name="Ani"))
+        self.requests = 0
+        self.stopped_early = 0
+        self.generated_tokens = 0
+
+    async def _reply(self, prompt_text: str, user_text: str, as_json: bool) -> str:
+        reply = dict(await self.mock.generate(user_text))
+        if not as_json:
+            return reply["utterance"]
+        reply.setdefault("gesture", "none")
+        reply.setdefault("phoneme_hints", [])
+        if "PLANNING:" in prompt_text:
+            reply["plan"] = {
+                "intent": reply.get("intent", "SMALL_TALK"),
+                "key_points": ["回应用户的话", "保持轻松友好的语气", "给出一个自然的跟进问题"],
+                "tone": "brief, friendly, colloquial Chinese",
+                "follow_up": "你今天过得怎么样？有什么想聊的吗？",
+            }
+        return json.dumps(reply, ensure_ascii=False)
+
+    async def _run(self, model: str, prompt_text: str, user_text: str, keep_alive, as_json: bool,
+                   num_predict: int = 0, stream_to: web.StreamResponse = None, chat: bool = False) -> dict:
+        self.requests += 1
+        now = time.time()
+        load_ms = 0.0
+        if self.loaded_until.get(model, 0) < now:
+            load_ms = self.load_ms
+            self.kv_cache.pop(model, None)  # unloading drops the KV cache
+        tokens = TOKEN_RE.findall(prompt_text)
+        cached = self.kv_cache.get(model, [])
+        common = 0
+        for a, b in zip(cached, tokens):
+            if a != b:
+                break
+            common += 1
+        prompt_eval = max(1, len(tokens) - common)
+        pieces = PIECE_RE.findall(await self._reply(prompt_text, user_text, as_json))
+        if num_predict and num_predict > 0:
+            pieces = pieces[:num_predict]
+        content = "".join(pieces)
+        eval_count = max(1, len(pieces))
+
+        prompt_ms = prompt_eval * self.prompt_ms_per_token
+        eval_ms = eval_count * self.eval_ms_per_token
+        self.kv_cache[model] = tokens
+        self.loaded_until[model] = time.time() + parse_keep_alive(keep_alive)
+        await asyncio.sleep((load_ms + prompt_ms) / 1000.0)
+        if stream_to is None:
+            await asyncio.sleep(eval_ms / 1000.0)
+            self.generated_tokens += eval_count
+        else:
+            for n, piece in enumerate(pieces, 1):
+                await asyncio.sleep(self.eval_ms_per_token / 1000.0)
+                chunk = {"model": model, "done": False}
+                if chat:
+                    chunk["message"] = {"role": "assistant", "content": piece}
+                else:
+                    chunk["response"] = piece
+                try:
+                    await stream_to.write((json.dumps(chunk, ensure_ascii=False) + "\n").encode("utf-8"))
+                except (ConnectionResetError, asyncio.CancelledError):
+                    self.stopped_early += 1
+                    self.generated_tokens += n
+                    raise ConnectionResetError("client went away")
+            self.generated_tokens += eval_count
+        ns = 1_000_000
+        return {
+            "model": model,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "done": True,
+            "content": content,
+            "total_duration": int((load_ms + prompt_ms + eval_ms) * ns),
+            "load_duration": int(load_ms * ns),
+            "prompt_eval_count": prompt_eval,
+            "prompt_eval_duration": int(prompt_ms * ns),
+            "eval_count": eval_count,
+            "eval_duration": int(eval_ms * ns),
+        }
+
+    async def tags(self, request: web.Request) -> web.Response:
+        return web.json_response({"models": [{"name": m} for m in self.loaded_until] or [{"name": "fake:latest"}]})
+
+    async def _respond(self, request: web.Request, body: dict, prompt: str, user: str, chat: bool):
+        stream = body.get("stream", True)  # Ollama streams unless told otherwise
+        num_predict = (body.get("options") or {}).get("num_predict", 0)
+        args = (body.get("model", "fake"), prompt, user, body.get("keep_alive"), body.get("format") == "json", num_predict)
+        if not stream:
+            out = await self._run(*args)
+            content = out.pop("content")
+            if chat:
+                out["message"] = {"role": "assistant", "content": content}
+            else:
+                out["response"] = content
+            return web.json_response(out)
+
+        resp = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await resp.prepare(request)
+        try:
+            out = await self._run(*args, stream_to=resp, chat=chat)
+        except ConnectionResetError:
+            return resp
+        out.pop("content")
+        if chat:
+            out["message"] = {"role": "assistant", "content": ""}
+        else:
+            out["response"] = ""
+        await resp.write((json.dumps(out) + "\n").encode("utf-8"))
+        await resp.write_eof()
+        return resp
+
+    async def generate(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        prompt = body.get("prompt", "")
+        return await self._respond(request, body, prompt, _user_text(prompt), chat=False)
+
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        messages = body.get("messages", [])
+        # Ollama renders the chat template into one prompt: system first, so it is the shared prefix
+        prompt = "\n".join(f"<{m.get('role')}>{m.get('content', '')}" for m in messages)
+        user = _user_text(messages[-1].get("content", "")) if messages else ""
+        return await self._respond(request, body, prompt, user, chat=True)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/api/tags", self.tags)
+        app.router.add_post("/api/generate", self.generate)
+        app.router.add_post("/api/chat", self.chat)
+        return app
+
+
+def _user_text(prompt: str) -> str:
+    m = re.search(r'User said: "(.*)"', prompt)
+    return m.group(1) if m else prompt[-200:]
+
+
+async def selftest(args):
+    fake = FakeOllama(load_ms=args.load_ms)
+    runner = web.AppRunner(fake.app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", args.port)
+    await site.start()
+
+    config = LLMConfig(backend="ollama", model="fake", ollama_host=f"http://127.0.0.1:{args.port}",
+                       ollama_use_chat=not args.no_chat, ollama_keep_alive=args.keep_alive, max_tokens=250,
+                       stream_early_stop=not args.no_stream, include_plan=args.plan)
+    pipeline = LLMPipeline(config)
+    await pipeline.initialize()
+    inputs = ["你好", "今天天气怎么样？", "讲个笑话吧", "hello", "What's your favorite anime?", "谢谢你"]
+    print(f"\n{'turn':<5} {'latency':>9} {'generated tok':>14} {'max_tokens':>11}")
+    for i in range(args.turns):
+        text = inputs[i % len(inputs)]
+        budget = pipeline.max_tokens_for(detect_language(text))
+        before = fake.generated_tokens
+        result = await pipeline.generate_response(text)
+        await asyncio.sleep(0.05)  # let the server notice a disconnect
+        print(f"{i + 1:<5} {result['llm_latency_ms']:>8.0f}ms {fake.generated_tokens - before:>14} {budget:>11}"
+              f"{'  ERROR ' + result['error'][:60] if result.get('error') else ''}")
+    print(f"\nServer: requests={fake.requests} stopped_early={fake.stopped_early} generated_tokens={fake.generated_tokens}")
+    print(f"{json.dumps(pipeline.get_metrics(), indent=2, ensure_ascii=False)}")
+    await pipeline.backend.close()
+    await runner.cleanup()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Fake Ollama server (load, KV-prefix reuse, timing fields)")
+    ap.add_argument("--port", type=int, default=11434)
+    ap.add_argument("--load-ms", type=float, default=1500.0, help="simulated model load time")
+    ap.add_argument("--selftest", action="store_true", help="run LLMPipeline turns against the fake")
+    ap.add_argument("--turns", type=int, default=6)
+    ap.add_argument("--no-chat", action="store_true", help="selftest with /api/generate instead of /api/chat")
+    ap.add_argument("--keep-alive", default="30m")
+    ap.add_argument("--no-stream", action="store_true", help="selftest without streaming early-stop")
+    ap.add_argument("--plan", action="store_true", help="selftest with the plan object requested")
+    args = ap.parse_args()
+
+    if args.selftest:
+        if args.port == 11434:
+            args.port = 11535  # don't collide with a real Ollama
+        asyncio.run(selftest(args))
+    else:
+        web.run_app(FakeOllama(load_ms=args.load_ms).app(), host="127.0.0.1", port=args.port)
+
+
+if __name__ == '__main__':
+    main()
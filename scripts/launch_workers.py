@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Multi-worker launcher for Ani v0
+
+Starts one model host process (VAD/STT, optionally Coqui TTS) and, once it
+answers a ping, N uvicorn workers of main_full:app that connect to it over
+IPC. Workers are stateless apart from their websocket sessions, so the box
+scales with CPU cores instead of being capped by one event loop.
+
+Usage
+  python scripts/launch_workers.py --workers 4
+  python scripts/launch_workers.py --workers 4 --host-tts coqui --port 8000
+  python scripts/launch_workers.py --workers 2 --address tcp://127.0.0.1:8765   # Windows
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from model_host import DEFAULT_ADDRESS, ModelHostClient  # noqa: E402
+
+
+async def wait_for_host(address: str, timeout_s: float) -> dict:
+    deadline = time.time() + timeout_s
+    last_error = None
+    while time.time() < deadline:
+        client = ModelHostClient(address, timeout=5.0)
+        try:
+            info, _ = await client.request("ping")
+            return info
+        except Exception as e:
+            last_error = e
+            await asyncio.sleep(1.0)
+        finally:
+            await client.close()
+    raise TimeoutError(f"model host at {address} not ready after {timeout_s:.0f}s ({last_error})")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Launch model host + N websocket workers")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    ap.add_argument("--address", default=DEFAULT_ADDRESS, help="model host unix socket or tcp://host:port")
+    ap.add_argument("--host-tts", default="", help="TTS engine to host (e.g. coqui); empty keeps TTS in workers")
+    ap.add_argument("--whisper", default="small")
+    ap.add_argument("--bind", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--ready-timeout", type=float, default=600.0, help="seconds to wait for model loads")
+    args = ap.parse_args()
+
+    host_cmd = [
+        sys.executable, str(ROOT / "model_host.py"),
+        "--address", args.address,
+        "--tts-engine", args.host_tts,
+        "--whisper", args.whisper,
+    ]
+    print(f"[INFO] Starting model host: {' '.join(host_cmd)}")
+    host_proc = subprocess.Popen(host_cmd, cwd=str(ROOT))
+    workers_proc = None
+    try:
+        info = asyncio.run(wait_for_host(args.address, args.ready_timeout))
+        print(f"[OK] Model host ready: {info}")
+
+        env = dict(os.environ)
+        env["MODEL_HOST"] = args.address
+        env["ENABLE_AUDIO_PIPELINE"] = "1"
+        env["MODEL_HOST_TTS"] = "1" if args.host_tts else "0"
+        workers_cmd = [
+            sys.executable, "-m", "uvicorn", "main_full:app",
+            "--host", args.bind, "--port", str(args.port),
+            "--workers", str(args.workers),
+        ]
+        print(f"[INFO] Starting {args.workers} workers on {args.bind}:{args.port}")
+        workers_proc = subprocess.Popen(workers_cmd, cwd=str(ROOT), env=env)
+
+        while True:
+            if host_proc.poll() is not None:
+                print(f"[FAIL] Model host exited ({host_proc.returncode})")
+                break
+            if workers_proc.poll() is not None:
+                print(f"[FAIL] Workers exited ({workers_proc.returncode})")
+                break
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        print("\n[INFO] Shutting down")
+    finally:
+        for proc in (workers_proc, host_proc):
+            if proc is not None and proc.poll() is None:
+                proc.terminate()
+                try:
+                    proc.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+
+
+if __name__ == '__main__':
+    main()
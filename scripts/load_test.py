@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Load generator for the Ani /ws endpoint
+
+Opens N concurrent websocket sessions. Each session runs a number of turns:
+- text turns send a `user_input` message
+- audio turns replay a recorded clip (voice_samples/*.wav, test_*_output.wav)
+  as binary PCM16 frames at real-time pace, followed by trailing silence
+  so server-side VAD closes the utterance
+
+Per turn it measures time-to-first-audio (TTFA) and time to the final
+response. Per session it counts microphone frames that could not be sent on
+schedule. Server-side counters (dropped audio frames, shed turns,
+interruptions) come from /metrics. The JSON report has sorted keys so two
+releases can be diffed directly.
+
+Offline run (mock LLM + stub TTS, no network or model weights):
+  python scripts/load_test.py --spawn --sessions 20 --turns 5 --out reports/load.json
+
+Against a running server (audio turns need ENABLE_AUDIO_PIPELINE=1):
+  python scripts/load_test.py --url ws://localhost:8000/ws --sessions 10 --mode mixed
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.request
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from tts_pipeline import AudioPostProcessor, TTSConfig  # noqa: E402
+
+SAMPLE_RATE = 16000
+CHUNK = 512  # Silero VAD frame (32ms)
+FINAL_STATUSES = {"success", "busy", "error"}
+
+TEXT_INPUTS = [
+    "你好", "hello", "今天天气怎么样？", "讲个笑话吧", "What's your favorite anime?",
+    "我喜欢 Taylor Swift 的歌", "Can you recommend 一个好吃的餐厅?", "谢谢你", "how are you",
+]
+
+
+def pct(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(p / 100.0 * (len(ordered) - 1)))], 1)
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(values),
+        "p50": pct(values, 50),
+        "p90": pct(values, 90),
+        "p95": pct(values, 95),
+        "p99": pct(values, 99),
+        "max": round(max(values), 1) if values else 0.0,
+    }
+
+
+def load_clips(patterns: List[str], max_seconds: float) -> List[np.ndarray]:
+    """Decode every readable clip to 16 kHz mono PCM16 (undecodable files are skipped)"""
+    post = AudioPostProcessor(TTSConfig())
+    clips = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(str(ROOT / pattern))):
+            try:
+                pcm = post.to_pcm16(Path(path).read_bytes(), SAMPLE_RATE)
+            except Exception:
+                pcm = None
+            if pcm is None or len(pcm) < CHUNK:
+                print(f"[WARN] Skipping {Path(path).name} (not PCM WAV; install soundfile to decode MP3)")
+                continue
+            clips.append(np.ascontiguousarray(pcm[:int(max_seconds * SAMPLE_RATE)]))
+    return clips
+
+
+@dataclass
+class SessionResult:
+    ttfa_ms: List[float] = field(default_factory=list)
+    turn_ms: List[float] = field(default_factory=list)
+    statuses: Dict[str, int] = field(default_factory=dict)
+    turns_without_audio: int = 0
+    mic_frames_sent: int = 0
+    mic_frames_late: int = 0  # frames more than one chunk behind real time
+    timeouts: int = 0
+    connect_error: Optional[str] = None
+
+
+async def stream_pcm(ws, pcm: np.ndarray, result: SessionResult, trailing_silence_s: float = 1.0):
+    """Send PCM16 frames at real-time pace"""
+    period = CHUNK / SAMPLE_RATE
+    silence = np.zeros(int(trailing_silence_s * SAMPLE_RATE), dtype=np.int16)
+    audio = np.concatenate([pcm, silence])
+    start = time.perf_counter()
+    for i, offset in enumerate(range(0, len(audio) - CHUNK + 1, CHUNK)):
+        due = start + i * period
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        elif -delay > period:
+            result.mic_frames_late += 1
+        await ws.send(audio[offset:offset + CHUNK].tobytes())
+        result.mic_frames_sent += 1
+
+
+async def await_turn(ws, t0: float, result: SessionResult, timeout_s: float):
+    """Read until the turn's final message; record TTFA and total latency"""
+    first_audio = None
+    deadline = t0 + timeout_s
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            result.timeouts += 1
+            return
+        try:
+            raw = await asyncio.wait_for(ws.recv(), timeout=remaining)
+        except asyncio.TimeoutError:
+            result.timeouts += 1
+            return
+        if isinstance(raw, bytes):
+            continue
+        msg = json.loads(raw)
+        if msg.get("type") == "audio" and first_audio is None:
+            first_audio = time.perf_counter()
+            result.ttfa_ms.append((first_audio - t0) * 1000)
+        status = msg.get("status")
+        if status in FINAL_STATUSES:
+            result.statuses[status] = result.statuses.get(status, 0) + 1
+            result.turn_ms.append((time.perf_counter() - t0) * 1000)
+            if status == "success" and first_audio is None:
+                result.turns_without_audio += 1
+            return
+
+
+async def run_session(idx: int, args, clips: List[np.ndarray], all_done: asyncio.Event,
+                      release: asyncio.Event, finished: List[int], total: int) -> SessionResult:
+    import websockets
+
+    result = SessionResult()
+    rng = random.Random(args.seed + idx)
+    await asyncio.sleep(rng.uniform(0, args.ramp_s))
+    try:
+        ws = await websockets.connect(args.url, max_size=None)
+    except Exception as e:
+        result.connect_error = str(e)
+        finished.append(idx)
+        if len(finished) == total:
+            all_done.set()
+        return result
+
+    try:
+        for turn in range(args.turns):
+            use_audio = clips and (args.mode == "audio" or (args.mode == "mixed" and turn % 2 == 1))
+            if use_audio:
+                clip = clips[rng.randrange(len(clips))]
+                await stream_pcm(ws, clip, result)
+                t0 = time.perf_counter()  # utterance end: server VAD closes it ~silence window later
+            else:
+                t0 = time.perf_counter()
+                await ws.send(json.dumps({"type": "user_input", "text": rng.choice(TEXT_INPUTS)}))
+            await await_turn(ws, t0, result, args.turn_timeout)
+            await asyncio.sleep(rng.uniform(0, args.think_s))
+    finally:
+        # Keep the connection open until every session is done so /metrics still sees it
+        finished.append(idx)
+        if len(finished) == total:
+            all_done.set()
+        await release.wait()
+        await ws.close()
+    return result
+
+
+def fetch_metrics(http_base: str) -> Optional[dict]:
+    try:
+        with urllib.request.urlopen(f"{http_base}/metrics", timeout=5) as resp:
+            return json.loads(resp.read().decode("utf-8"))
+    except Exception as e:
+        print(f"[WARN] /metrics unavailable: {e}")
+        return None
+
+
+def server_counters(metrics: Optional[dict]) -> Dict[str, int]:
+    if not metrics:
+        return {}
+    queues = metrics.get("send_queues", {})
+    admission = metrics.get("admission", {})
+    counters = {
+        "dropped_audio_frames": queues.get("dropped_audio_total", 0),
+        "turns_shed": admission.get("turns_shed", 0),
+        "sessions_rejected": admission.get("sessions_rejected", 0),
+    }
+    for key, value in metrics.get("turns", {}).items():
+        counters[f"turns_{key}"] = value
+    return counters
+
+
+async def run_load(args) -> dict:
+    clips = load_clips(args.clips, args.max_clip_s) if args.mode != "text" else []
+    if args.mode != "text" and not clips:
+        print("[WARN] No decodable clips, falling back to text turns")
+    http_base = args.url.replace("ws://", "http://").replace("wss://", "https://").rsplit("/ws", 1)[0]
+
+    loop = asyncio.get_running_loop()
+    before = await loop.run_in_executor(None, fetch_metrics, http_base)
+    all_done = asyncio.Event()
+    release = asyncio.Event()
+    finished: List[int] = []
+    start = time.perf_counter()
+    tasks = [asyncio.create_task(run_session(i, args, clips, all_done, release, finished, args.sessions))
+             for i in range(args.sessions)]
+    await all_done.wait()
+    during = await loop.run_in_executor(None, fetch_metrics, http_base)
+    release.set()
+    results: List[SessionResult] = await asyncio.gather(*tasks)
+    wall_s = time.perf_counter() - start
+
+    # Per-connection drops vanish when a session closes, so read them while all are open
+    b, d = server_counters(before), server_counters(during)
+    server = {key: d[key] - (0 if key == "dropped_audio_frames" else b.get(key, 0)) for key in d}
+
+    statuses: Dict[str, int] = {}
+    for r in results:
+        for key, value in r.statuses.items():
+            statuses[key] = statuses.get(key, 0) + value
+    ttfa = [v for r in results for v in r.ttfa_ms]
+    turn = [v for r in results for v in r.turn_ms]
+    return {
+        "config": {
+            "url": args.url,
+            "sessions": args.sessions,
+            "turns_per_session": args.turns,
+            "mode": args.mode,
+            "clips": len(clips),
+            "seed": args.seed,
+        },
+        "wall_time_s": round(wall_s, 1),
+        "connect_errors": sum(1 for r in results if r.connect_error),
+        "turns": {
+            "completed": len(turn),
+            "timeouts": sum(r.timeouts for r in results),
+            "statuses": statuses,
+            "without_audio": sum(r.turns_without_audio for r in results),
+            "throughput_per_s": round(len(turn) / wall_s, 2) if wall_s else 0.0,
+        },
+        "ttfa_ms": summarize(ttfa),
+        "turn_latency_ms": summarize(turn),
+        "mic": {
+            "frames_sent": sum(r.mic_frames_sent for r in results),
+            "frames_late": sum(r.mic_frames_late for r in results),
+        },
+        "server": server,
+    }
+
+
+def spawn_server(port: int) -> subprocess.Popen:
+    """Start main_full offline: mock LLM, stub TTS, no audio models"""
+    env = dict(os.environ)
+    env.update({"ANI_LLM_BACKEND": "mock", "ANI_TTS_ENGINE": "stub", "ENABLE_AUDIO_PIPELINE": "0"})
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main_full:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=str(ROOT), env=env,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/ready", timeout=1)
+            return proc
+        except Exception:
+            if proc.poll() is not None:
+                raise RuntimeError("server exited during startup")
+            time.sleep(0.5)
+    proc.terminate()
+    raise TimeoutError("server did not become ready within 60s")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Concurrent voice-session load test for /ws")
+    ap.add_argument("--url", default="ws://localhost:8000/ws")
+    ap.add_argument("--sessions", type=int, default=10)
+    ap.add_argument("--turns", type=int, default=5, help="turns per session")
+    ap.add_argument("--mode", choices=["text", "audio", "mixed"], default="text")
+    ap.add_argument("--clips", nargs="*", default=["voice_samples/*.wav", "test_*_output.wav"])
+    ap.add_argument("--max-clip-s", type=float, default=4.0, help="truncate replayed clips")
+    ap.add_argument("--ramp-s", type=float, default=2.0, help="spread session starts over this window")
+    ap.add_argument("--think-s", type=float, default=0.5, help="max pause between turns")
+    ap.add_argument("--turn-timeout", type=float, default=30.0)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--spawn", action="store_true", help="start an offline server (mock LLM, stub TTS)")
+    ap.add_argument("--port", type=int, default=8765, help="port for --spawn")
+    ap.add_argument("--out", default="", help="write the JSON report here")
+    args = ap.parse_args()
+
+    server = None
+    if args.spawn:
+        args.url = f"ws://127.0.0.1:{args.port}/ws"
+        server = spawn_server(args.port)
+    try:
+        report = asyncio.run(run_load(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+    text = json.dumps(report, indent=2, sort_keys=True, ensure_ascii=False)
+    print(text)
+    if args.out:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+        print(f"[OK] Report written to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
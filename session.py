@@ -0,0 +1,132 @@
+"""
+Per-connection turn management for Ani v0
+One websocket session has at most one turn (LLM -> TTS -> send -> playback)
+in flight. Starting a new utterance barges in: the previous turn's task is
+cancelled (aborting its LLM request, TTS synthesis and pending sends) and
+the part of the reply the user actually heard is reported back.
+"""
+import asyncio
+import itertools
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Optional
+
+
+@dataclass
+class Turn:
+    """One user utterance and the assistant reply it triggers"""
+    turn_id: int
+    user_text: str
+    started_at: float = field(default_factory=time.time)
+    stage: str = "llm"  # llm | tts | playback | done
+    assistant_text: str = ""
+    audio_sent_at: Optional[float] = None
+    audio_duration_ms: float = 0.0
+    task: Optional[asyncio.Task] = None
+
+    def playback_remaining_ms(self, now: Optional[float] = None) -> float:
+        if self.audio_sent_at is None:
+            return 0.0
+        elapsed_ms = ((now or time.time()) - self.audio_sent_at) * 1000
+        return max(0.0, self.audio_duration_ms - elapsed_ms)
+
+    def is_active(self) -> bool:
+        """Still generating, or the client is still playing our audio"""
+        if self.task is not None and not self.task.done():
+            return True
+        return self.playback_remaining_ms() > 0
+
+    def spoken_text(self, now: Optional[float] = None) -> str:
+        """Approximate prefix of assistant_text the user heard before barging in"""
+        if not self.assistant_text or self.audio_sent_at is None or self.audio_duration_ms <= 0:
+            return ""
+        elapsed_ms = ((now or time.time()) - self.audio_sent_at) * 1000
+        fraction = min(1.0, max(0.0, elapsed_ms / self.audio_duration_ms))
+        return self.assistant_text[:int(len(self.assistant_text) * fraction)]
+
+
+class TurnManager:
+    """
+    Owns the in-flight turn of one websocket session
+    - start(): cancels whatever is running, then runs the new turn
+    - interrupt(): cancels the running turn / playback and reports it
+    """
+
+    # Process-wide counters for /metrics
+    totals: Dict[str, int] = {
+        "started": 0,
+        "completed": 0,
+        "interrupted": 0,
+        "interrupted_llm": 0,
+        "interrupted_tts": 0,
+        "interrupted_playback": 0,
+    }
+    _ids = itertools.count(1)
+
+    def __init__(
+        self,
+        on_interrupted: Optional[Callable[[Turn, str], Awaitable[None]]] = None,
+    ):
+        self.current: Optional[Turn] = None
+        self.on_interrupted = on_interrupted
+
+    def start(self, user_text: str, runner: Callable[[Turn], Awaitable[None]]) -> Turn:
+        """Barge in on the previous turn (if any) and start a new one"""
+        previous = self.current
+        turn = Turn(turn_id=next(self._ids), user_text=user_text)
+        self.current = turn
+        TurnManager.totals["started"] += 1
+
+        async def run():
+            if previous is not None:
+                await self._interrupt(previous, reason="new_turn")
+            try:
+                await runner(turn)
+                turn.stage = "playback" if turn.audio_sent_at else "done"
+                TurnManager.totals["completed"] += 1
+            finally:
+                if turn.stage != "playback":
+                    turn.stage = "done"
+
+        turn.task = asyncio.create_task(run())
+        return turn
+
+    async def interrupt(self, reason: str = "speech") -> Optional[Turn]:
+        """Cancel the active turn (VAD heard the user start speaking again)"""
+        turn = self.current
+        if turn is None or not turn.is_active():
+            return None
+        await self._interrupt(turn, reason)
+        return turn
+
+    async def _interrupt(self, turn: Turn, reason: str):
+        if not turn.is_active() or turn.stage == "interrupted":
+            return
+        now = time.time()
+        stage = turn.stage
+        if stage == "done" and turn.playback_remaining_ms(now) > 0:
+            stage = "playback"  # audio left the writer after the turn body returned
+        spoken = turn.spoken_text(now)
+        if turn.task is not None and not turn.task.done():
+            turn.task.cancel()
+            # wait() never raises the old task's error/cancellation, but does propagate our own
+            # cancellation: a newer turn must be able to cancel this one while it waits here
+            await asyncio.wait({turn.task})
+        turn.stage = "interrupted"
+        turn.audio_sent_at = None  # stop counting playback
+        TurnManager.totals["interrupted"] += 1
+        if f"interrupted_{stage}" in TurnManager.totals:
+            TurnManager.totals[f"interrupted_{stage}"] += 1
+        print(f"[Turn] #{turn.turn_id} interrupted during {stage} ({reason}); heard: '{spoken[:40]}'")
+        if self.on_interrupted is not None:
+            try:
+                await self.on_interrupted(turn, spoken)
+            except Exception as e:
+                print(f"[WARN] Interrupt handler error: {e}")
+
+    async def close(self):
+        """Cancel any running turn when the connection goes away"""
+        turn = self.current
+        if turn is not None and turn.task is not None and not turn.task.done():
+            turn.task.cancel()
+            await asyncio.wait({turn.task})
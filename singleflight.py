@@ -0,0 +1,111 @@
+"""
+Request coalescing (single-flight) for Ani v0
+Concurrent identical requests (many users saying "你好" at once, several tabs
+synthesizing the same line) share one in-flight backend call instead of each
+starting their own.
+
+Cancellation is reference-counted: a caller that goes away (barge-in, closed
+socket) only detaches itself; the shared call is cancelled once no caller is
+left waiting for it.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class _Call:
+    __slots__ = ("task", "waiters", "abandoned")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+        self.abandoned = False
+
+
+class SingleFlight:
+    """Deduplicate concurrent calls by key"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self.stats = {"calls": 0, "executed": 0, "coalesced": 0, "detached": 0, "abandoned": 0}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Await fn() (or the identical call already in flight)
+        Every caller gets the same result object, so callers that mutate it
+        must copy first.
+        """
+        self.stats["calls"] += 1
+        call = self._calls.get(key)
+        if call is None or call.abandoned:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _t, key=key, call=call: self._finished(key, call))
+            self.stats["executed"] += 1
+        else:
+            self.stats["coalesced"] += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if not call.task.done():
+                # This caller was cancelled, not the shared work
+                self.stats["detached"] += 1
+                if call.waiters == 1:
+                    call.abandoned = True  # late joiners start a fresh call
+                    call.task.cancel()
+                    self.stats["abandoned"] += 1
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _finished(self, key: Hashable, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if not call.task.cancelled():
+            call.task.exception()  # mark retrieved: failures are re-raised to each waiter
+
+    def snapshot(self) -> dict:
+        calls = self.stats["calls"]
+        return {
+            **self.stats,
+            "in_flight": len(self._calls),
+            "dedup_ratio": round(self.stats["coalesced"] / calls, 3) if calls else 0.0,
+        }
+
+
+# Testing
+async def test_singleflight():
+    print("=" * 60)
+    print("Testing SingleFlight")
+    print("=" * 60)
+
+    flight = SingleFlight("demo")
+    runs = []
+
+    async def work(text):
+        runs.append(text)
+        await asyncio.sleep(0.1)
+        return text.upper()
+
+    results = await asyncio.gather(*(flight.do("hi", lambda: work("hi")) for _ in range(5)))
+    print(f"5 identical calls -> {len(runs)} execution(s), results {results}")
+
+    # One caller leaving must not cancel the work for the others
+    leaver = asyncio.create_task(flight.do("bye", lambda: work("bye")))
+    stayer = asyncio.create_task(flight.do("bye", lambda: work("bye")))
+    await asyncio.sleep(0.02)
+    leaver.cancel()
+    print(f"After one caller cancelled, the other got: {await stayer}")
+
+    # Last caller leaving cancels the shared call
+    alone = asyncio.create_task(flight.do("gone", lambda: work("gone")))
+    await asyncio.sleep(0.02)
+    alone.cancel()
+    await asyncio.sleep(0.01)
+    print(f"Stats: {flight.snapshot()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(test_singleflight())
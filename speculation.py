@@ -0,0 +1,199 @@
+"""
+Speculative LLM generation for Ani v0
+The LLM normally starts only after the STT final, which waits for
+min_silence_duration_ms (700ms) of trailing silence. With speculation on, the
+audio pipeline emits a partial transcript at a short pause; once that partial
+has stayed unchanged for `stable_ms`, generation starts on a copy of the
+conversation memory. When the final arrives:
+- same text (normalized): the speculative reply is committed to the real memory
+- different text: the speculative call is cancelled and the turn generates normally
+Speculation only runs on a free LLM slot (held until the call ends) and never
+waits for one.
+
+Hit rate and estimated wasted tokens are tracked for tuning (see /metrics).
+"""
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from admission import StageGate
+from response_cache import normalize_input
+from text_utils import estimate_tokens
+
+
+@dataclass
+class SpeculationConfig:
+    """Opt-in speculation (ANI_SPECULATE, ANI_SPECULATE_STABLE_MS, ANI_SPECULATE_PARTIAL_MS)"""
+    enabled: bool = False
+    stable_ms: float = 150.0  # partial must stay unchanged this long before speculating
+    partial_silence_ms: int = 300  # pause that makes the audio pipeline emit a partial
+
+    @classmethod
+    def from_env(cls) -> "SpeculationConfig":
+        config = cls()
+        config.enabled = os.getenv("ANI_SPECULATE", "0").lower() in {"1", "true", "yes", "on"}
+        try:
+            config.stable_ms = float(os.getenv("ANI_SPECULATE_STABLE_MS", config.stable_ms))
+            config.partial_silence_ms = int(os.getenv("ANI_SPECULATE_PARTIAL_MS", config.partial_silence_ms))
+        except ValueError:
+            pass
+        return config
+
+
+class Speculator:
+    """Per-connection speculative turn (at most one in flight)"""
+
+    # Process-wide counters for /metrics
+    totals: Dict[str, float] = {
+        "partials": 0,
+        "started": 0,
+        "committed": 0,  # final matched: reply reused
+        "discarded": 0,  # final differed (or a newer partial replaced it)
+        "not_started": 0,  # final arrived before the partial was stable
+        "skipped": 0,  # no free LLM slot when the partial became stable
+        "wasted_tokens": 0,  # estimated prompt + completion tokens of discarded speculations
+        "saved_ms": 0.0,  # LLM time already spent when the final arrived (committed only)
+    }
+
+    def __init__(self, llm_pipeline, config: Optional[SpeculationConfig] = None,
+                 gate: Optional[StageGate] = None, session: Optional[str] = None):
+        self.llm = llm_pipeline
+        self.session = session  # conversation memory to speculate on and commit to
+        self.config = config or SpeculationConfig()
+        self.gate = gate  # LLM admission gate: a slot is held while speculating
+        self.pending_text: Optional[str] = None  # normalized partial being speculated on
+        self._timer: Optional[asyncio.Task] = None
+        self._task: Optional[asyncio.Task] = None
+        self._started_at = 0.0
+        self._prompt_tokens = 0
+
+    def on_partial(self, text: str):
+        """Partial transcript from the audio pipeline"""
+        norm = normalize_input(text)
+        if not norm or not self.config.enabled:
+            return
+        Speculator.totals["partials"] += 1
+        if norm == self.pending_text:
+            return  # unchanged: timer or speculation already running
+        self.cancel()
+        self.pending_text = norm
+        self._timer = asyncio.create_task(self._start_when_stable(text))
+
+    async def _start_when_stable(self, text: str):
+        await asyncio.sleep(self.config.stable_ms / 1000.0)
+        if self.gate is not None and not await self.gate.try_acquire():
+            Speculator.totals["skipped"] += 1
+            return  # never speculate under load
+        memory = self.llm.memory_for(self.session)
+        memory = memory.fork() if memory is not None else None
+        self._prompt_tokens = self._estimate_prompt_tokens(text, memory)
+        self._started_at = time.time()
+        self._task = asyncio.create_task(self.llm.generate_response(text, memory=memory))
+        if self.gate is not None:
+            self._task.add_done_callback(lambda _: self.gate.release())  # finished or cancelled
+        Speculator.totals["started"] += 1
+
+    def _estimate_prompt_tokens(self, text: str, memory) -> int:
+        tokens = estimate_tokens(self.llm.static_prefix())
+        tokens += estimate_tokens(text)
+        if memory:
+            tokens += estimate_tokens(memory.get_context_block())
+        return tokens
+
+    async def take(self, final_text: str) -> Optional[dict]:
+        """
+        Speculative reply for this final transcript, committed to memory; or None
+        (nothing speculated, or it didn't match and was cancelled)
+        """
+        task, matched = self._task, normalize_input(final_text) == self.pending_text
+        if task is None:
+            if self.pending_text is not None:
+                Speculator.totals["not_started"] += 1
+            self.cancel()
+            return None
+        if not matched:
+            self.cancel()
+            return None
+
+        self._task = None
+        self.pending_text = None
+        saved_ms = (time.time() - self._started_at) * 1000
+        try:
+            response = await task
+        except asyncio.CancelledError:
+            # The turn was cancelled (barge-in) while waiting: stop the call too
+            task.cancel()
+            Speculator.totals["discarded"] += 1
+            Speculator.totals["wasted_tokens"] += self._prompt_tokens
+            raise
+        Speculator.totals["saved_ms"] += saved_ms
+        if response.get("error"):
+            return None  # fallback reply: let the turn try again for real
+        self.llm.record_turn(final_text, response, session=self.session)
+        Speculator.totals["committed"] += 1
+        return {**response, "speculative": True}
+
+    def cancel(self):
+        """Drop any pending or running speculation"""
+        if self._timer is not None and not self._timer.done():
+            self._timer.cancel()
+        self._timer = None
+        task, self._task = self._task, None
+        self.pending_text = None
+        if task is None:
+            return
+        Speculator.totals["discarded"] += 1
+        wasted = self._prompt_tokens
+        if task.done() and not task.cancelled() and task.exception() is None:
+            wasted += estimate_tokens(task.result().get("utterance", "")) + 20  # + JSON envelope
+        else:
+            task.cancel()
+        Speculator.totals["wasted_tokens"] += wasted
+
+    @classmethod
+    def snapshot(cls) -> dict:
+        decided = cls.totals["committed"] + cls.totals["discarded"] + cls.totals["not_started"]
+        return {
+            **cls.totals,
+            "saved_ms": round(cls.totals["saved_ms"], 1),
+            "hit_rate": round(cls.totals["committed"] / decided, 3) if decided else 0.0,
+        }
+
+
+# Testing
+async def test_speculation():
+    """Replay recorded partial/final transcript pairs against MockLLMBackend"""
+    from llm_pipeline import LLMConfig, LLMPipeline
+
+    print("=" * 60)
+    print("Testing Speculator")
+    print("=" * 60)
+
+    pipeline = LLMPipeline(LLMConfig(backend="mock", model="mock"))
+    await pipeline.initialize()
+    speculator = Speculator(pipeline, SpeculationConfig(enabled=True, stable_ms=50))
+
+    # (partial at the pause, final transcript, ms between them)
+    recorded = [
+        ("你好", "你好。", 400),
+        ("今天天气", "今天天气怎么样", 400),  # user kept talking
+        ("讲个笑话吧", "讲个笑话吧！", 30),  # final before the partial was stable
+        ("What's your name", "what's your name?", 400),
+    ]
+    for partial, final, gap_ms in recorded:
+        speculator.on_partial(partial)
+        await asyncio.sleep(gap_ms / 1000.0)
+        start = time.time()
+        response = await speculator.take(final)
+        if response is None:
+            response = await pipeline.generate_response(final)
+        print(f"{final!r:28} speculative={response.get('speculative', False)!s:5} "
+              f"wait={(time.time() - start) * 1000:.0f}ms -> {response['utterance']}")
+    print(f"Memory turns: {len(pipeline.memory.turns)}")
+    print(f"Stats: {Speculator.snapshot()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(test_speculation())
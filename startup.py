@@ -0,0 +1,100 @@
+"""
+Startup timeline for Ani v0
+Records when each initialization stage started and finished (relative to
+process start) and derives a staged readiness state for /health and /ready:
+- starting: a core stage (needed to answer turns) is still loading
+- serving:  core stages done, background stages (audio models, warm-up) still loading
+- ready:    every stage finished
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+
+CORE = "core"
+BACKGROUND = "background"
+
+
+class StartupTimeline:
+    """Per-stage start/end offsets plus derived readiness"""
+
+    def __init__(self, t0: Optional[float] = None):
+        self.t0 = t0 or time.time()
+        self.stages: Dict[str, dict] = {}
+        self.events: List[dict] = []
+        self.ready_at: Optional[float] = None
+        self.serving_at: Optional[float] = None
+
+    def _offset_ms(self, ts: Optional[float] = None) -> float:
+        return round(((ts or time.time()) - self.t0) * 1000, 1)
+
+    def mark(self, name: str):
+        """Instant event (e.g. 'imports_done', 'accepting_connections')"""
+        self.events.append({"name": name, "at_ms": self._offset_ms()})
+
+    def expect(self, name: str, group: str = CORE):
+        """Declare a stage up front so readiness waits for it"""
+        self.stages.setdefault(name, {"name": name, "group": group, "status": "pending"})
+
+    def skip(self, name: str, reason: str, group: str = BACKGROUND):
+        self.stages[name] = {"name": name, "group": group, "status": "skipped", "reason": reason}
+        self._update()
+
+    @asynccontextmanager
+    async def stage(self, name: str, group: str = CORE):
+        entry = self.stages.setdefault(name, {"name": name, "group": group})
+        entry.update({"group": group, "status": "running", "start_ms": self._offset_ms()})
+        start = time.time()
+        try:
+            yield entry
+        except asyncio.CancelledError:
+            entry["status"] = "cancelled"
+            raise
+        except Exception as e:
+            entry["status"] = "failed"
+            entry["error"] = f"{type(e).__name__}: {e}"
+            raise
+        else:
+            entry["status"] = "ok"
+        finally:
+            entry["end_ms"] = self._offset_ms()
+            entry["duration_ms"] = round((time.time() - start) * 1000, 1)
+            self._update()
+
+    def _group_done(self, group: Optional[str] = None) -> bool:
+        return all(
+            s["status"] not in ("pending", "running")
+            for s in self.stages.values()
+            if group is None or s["group"] == group
+        )
+
+    def _update(self):
+        now = time.time()
+        if self.serving_at is None and self._group_done(CORE):
+            self.serving_at = now
+        if self.ready_at is None and self._group_done():
+            self.ready_at = now
+
+    @property
+    def status(self) -> str:
+        if not self._group_done(CORE):
+            return "starting"
+        if not self._group_done():
+            return "serving"
+        return "ready"
+
+    @property
+    def degraded(self) -> bool:
+        return any(s["status"] == "failed" for s in self.stages.values())
+
+    def snapshot(self) -> dict:
+        return {
+            "status": self.status,
+            "degraded": self.degraded,
+            "uptime_s": round(time.time() - self.t0, 1),
+            "serving_after_ms": self._offset_ms(self.serving_at) if self.serving_at else None,
+            "ready_after_ms": self._offset_ms(self.ready_at) if self.ready_at else None,
+            "stages": sorted(self.stages.values(), key=lambda s: s.get("start_ms", float("inf"))),
+            "events": list(self.events),
+        }
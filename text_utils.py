@@ -0,0 +1,248 @@
+"""
+Shared text utilities for Ani v0
+Precompiled patterns and a single script/language classifier used by the
+LLM, TTS and RAG code paths (no per-call regex compilation).
+"""
+from __future__ import annotations
+
+import re
+from typing import Callable, List, Optional, Tuple
+
+
+# Script detection
+CJK_RANGE = "\u4e00-\u9fff"
+CJK_RE = re.compile(f"[{CJK_RANGE}]")
+CJK_RUN_RE = re.compile(f"[{CJK_RANGE}]+")
+LATIN_RE = re.compile(r"[A-Za-z]")
+EN_WORD_RE = re.compile(r"[A-Za-z0-9]+")
+
+# Utterance cleaning (emoji / emoticons are read aloud by TTS)
+EMOJI_RE = re.compile(
+    "["
+    "\U0001F600-\U0001F64F"  # emoticons
+    "\U0001F300-\U0001F5FF"  # symbols & pictographs
+    "\U0001F680-\U0001F6FF"  # transport & map symbols
+    "\U0001F1E0-\U0001F1FF"  # flags
+    "\U0001F900-\U0001F9FF"  # supplemental symbols
+    "\U0001FA70-\U0001FAFF"
+    "]+",
+    flags=re.UNICODE
+)
+EMOTICON_PAREN_RE = re.compile(r'\([*^_~=><]+[^)]*\)')  # (*^_^*), (^_^), (≧▽≦)
+EMOTICON_SEQ_RE = re.compile(r'(?<!\w)[\^_~=><]{2,}(?!\w)')  # ^_^, ===, ~~~
+WHITESPACE_RE = re.compile(r'\s+')
+
+# LLM output parsing
+JSON_OBJECT_RE = re.compile(r'\{.*\}', re.DOTALL)
+JSON_NESTED_OBJECT_RE = re.compile(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', re.DOTALL)
+
+# Sentence splitting (Chinese and English punctuation, kept as separate parts)
+SENTENCE_SPLIT_RE = re.compile(r'([。！？!?；;])')
+
+
+class JsonFieldScanner:
+    """
+    Incremental scanner for a streamed JSON object
+    Tracks which top-level fields are complete so a streaming reply can be cut
+    off once the fields we need have arrived; prefix_object() closes the object
+    after the last complete top-level value. Text before the first '{'
+    (e.g. a markdown fence) is skipped.
+    """
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.pos = 0  # characters consumed since the opening '{'
+        self.started = False
+        self.done = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.expect_key = False
+        self.key_chars: Optional[List[str]] = None
+        self.current_key: Optional[str] = None
+        self.in_primitive = False
+        self.completed: List[str] = []
+        self.last_end = 0
+
+    def _value_done(self, end: int):
+        if self.current_key is not None:
+            self.completed.append(self.current_key)
+            self.current_key = None
+        self.in_primitive = False
+        self.last_end = end
+
+    def feed(self, chunk: str):
+        if self.done:
+            return
+        if not self.started:
+            brace = chunk.find("{")
+            if brace < 0:
+                return
+            chunk = chunk[brace:]
+        self.chunks.append(chunk)
+        for ch in chunk:
+            i = self.pos
+            self.pos += 1
+            if not self.started:
+                self.started, self.depth, self.expect_key = True, 1, True
+                continue
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                    continue
+                elif ch == '"':
+                    self.in_string = False
+                    if self.key_chars is not None:
+                        self.current_key = "".join(self.key_chars)
+                        self.key_chars = None
+                    elif self.depth == 1:
+                        self._value_done(i + 1)
+                    continue
+                if self.key_chars is not None:
+                    self.key_chars.append(ch)
+                continue
+            if ch == '"':
+                self.in_string = True
+                if self.depth == 1 and self.expect_key:
+                    self.key_chars = []
+                    self.expect_key = False
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                if self.depth == 1 and self.in_primitive:
+                    self._value_done(i)
+                self.depth -= 1
+                if self.depth == 1:
+                    self._value_done(i + 1)
+                elif self.depth == 0:
+                    self.done = True
+                    return
+            elif self.depth == 1:
+                if ch == ",":
+                    if self.in_primitive:
+                        self._value_done(i)
+                    self.expect_key = True
+                elif ch != ":" and not ch.isspace() and self.current_key is not None:
+                    self.in_primitive = True
+
+    def has_fields(self, fields) -> bool:
+        return all(name in self.completed for name in fields)
+
+    @property
+    def text(self) -> str:
+        return "".join(self.chunks)
+
+    def prefix_object(self) -> str:
+        """The object so far, closed after the last complete top-level value"""
+        return self.text[:self.last_end] + "}"
+
+
+def is_cjk(ch: str) -> bool:
+    return '\u4e00' <= ch <= '\u9fff'
+
+
+def has_cjk(text: str) -> bool:
+    return bool(text) and CJK_RE.search(text) is not None
+
+
+def detect_language(text: str) -> str:
+    """Whole-text language: "zh" if any CJK character appears, else "en" """
+    return "zh" if has_cjk(text) else "en"
+
+
+def split_language_spans(text: str) -> List[Tuple[str, str]]:
+    """
+    Split mixed text into ordered (language, span) runs
+    - CJK runs are "zh"; gaps containing Latin letters are "en"
+    - Language-neutral text (spaces, digits, punctuation) sticks to the
+      preceding span, or the following one at the start of the text
+    Concatenating the spans always reproduces the input exactly.
+
+    >>> split_language_spans("我喜欢 Taylor Swift 的歌")
+    [('zh', '我喜欢 '), ('en', 'Taylor Swift '), ('zh', '的歌')]
+    """
+    if not text:
+        return []
+    spans: List[List[str]] = []
+    leading = ""
+
+    def push(lang: Optional[str], piece: str):
+        nonlocal leading
+        if lang is None:
+            if spans:
+                spans[-1][1] += piece
+            else:
+                leading += piece
+            return
+        if spans and spans[-1][0] == lang:
+            spans[-1][1] += piece
+        else:
+            spans.append([lang, leading + piece])
+            leading = ""
+
+    def push_gap(gap: str):
+        latin = LATIN_RE.search(gap)
+        if latin is None:
+            push(None, gap)
+            return
+        if latin.start() > 0:
+            push(None, gap[:latin.start()])
+        push("en", gap[latin.start():])
+
+    pos = 0
+    for m in CJK_RUN_RE.finditer(text):
+        if m.start() > pos:
+            push_gap(text[pos:m.start()])
+        push("zh", m.group())
+        pos = m.end()
+    if pos < len(text):
+        push_gap(text[pos:])
+
+    if not spans:
+        # Nothing but digits/punctuation: treat as English
+        return [("en", leading)]
+    return [(lang, piece) for lang, piece in spans]
+
+
+def extract_tokens(text: str) -> List[str]:
+    """Return simple tokens for scoring (EN words + CJK bigrams)."""
+    t = text or ""
+    words = EN_WORD_RE.findall(t.lower())
+    cjks = CJK_RE.findall(t)
+    bigrams = [cjks[i] + cjks[i + 1] for i in range(len(cjks) - 1)] if len(cjks) > 1 else []
+    return words + bigrams
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough LLM token count: one per CJK character, ~1.3 per English word, plus punctuation"""
+    if not text:
+        return 0
+    cjk = sum(map(len, CJK_RUN_RE.findall(text)))
+    words = EN_WORD_RE.findall(text)
+    other = len(text) - cjk - sum(map(len, words)) - text.count(" ")
+    return cjk + int(len(words) * 1.3 + 0.5) + max(0, other) // 2
+
+
+# Any text -> token count function (estimate_tokens, tiktoken_estimator(), ...)
+TokenEstimator = Callable[[str], int]
+
+
+def tiktoken_estimator(encoding: str = "cl100k_base") -> TokenEstimator:
+    """Exact BPE token counts via tiktoken if installed, else estimate_tokens"""
+    try:
+        import tiktoken
+        enc = tiktoken.get_encoding(encoding)
+    except Exception as e:
+        print(f"[WARN] tiktoken unavailable ({e}), using estimate_tokens")
+        return estimate_tokens
+    return lambda text: len(enc.encode(text)) if text else 0
+
+
+def clean_utterance(text: str) -> str:
+    """Remove emojis and obvious emoticons, collapse whitespace (conservative)"""
+    text = EMOJI_RE.sub('', text)
+    text = EMOTICON_PAREN_RE.sub('', text)
+    text = EMOTICON_SEQ_RE.sub('', text)
+    return WHITESPACE_RE.sub(' ', text).strip()
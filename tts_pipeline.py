@@ -4,31 +4,97 @@ Text-to-Speech with phoneme extraction for lipsync
 Target: <700ms latency
 """
 import asyncio
+import concurrent.futures
+import json
+import os
+import queue
+import threading
 import time
 import io
 import wave
-from typing import Optional, List, Tuple
-from dataclasses import dataclass
+import random
+import tempfile
+from typing import Optional, List, Tuple, Dict
+from dataclasses import dataclass, field
 import numpy as np
 
+from resilience import RollingStats
+from singleflight import SingleFlight
+from text_utils import LATIN_RE, SENTENCE_SPLIT_RE, detect_language, split_language_spans
+
 
 @dataclass
 class TTSConfig:
     """TTS configuration"""
     engine: str = "edge"  # edge, pyttsx3, coqui
-    voice: str = "en-US-AriaNeural"  # Edge TTS voice or Coqui model name
+    voice: str = "en-US-AriaNeural"  # Edge TTS default voice
     rate: str = "+0%"  # Speech rate (Edge TTS only)
     pitch: str = "+0Hz"  # Pitch (Edge TTS only)
     sample_rate: int = 24000  # Output sample rate
     format: str = "riff-24khz-16bit-mono-pcm"  # Edge output format (WAV by default)
     use_ssml: bool = False  # Disabled: Edge TTS reads SSML tags as text instead of interpreting them
     ssml_break_ms: int = 180  # default sentence break length
-    speaker_wav: Optional[str] = None  # Path to speaker WAV file (Coqui only)
-    speaker_wav_cn: Optional[str] = None  # Chinese voice sample (Coqui only)
-    speaker_wav_en: Optional[str] = None  # English voice sample (Coqui only)
     voice_cn: Optional[str] = None  # Edge TTS Chinese voice
     voice_en: Optional[str] = None  # Edge TTS English voice
 
+    # Coqui (loaded only when it is `engine` or listed in fallback_engines)
+    coqui_model: str = "tts_models/multilingual/multi-dataset/xtts_v2"
+    speaker_wav: Optional[str] = None  # Path to speaker WAV file
+    speaker_wav_cn: Optional[str] = None  # Chinese voice sample
+    speaker_wav_en: Optional[str] = None  # English voice sample
+
+    # pyttsx3 (OS voices)
+    pyttsx3_voice: Optional[str] = None  # voice id, None = system default
+    pyttsx3_rate: int = 150  # words per minute
+
+    # Runtime failover: engines tried after `engine`, in preference order.
+    # Coqui is opt-in here: it loads a multi-GB model at startup.
+    fallback_engines: List[str] = field(default_factory=lambda: ["edge", "pyttsx3"])
+    engine_timeouts: Dict[str, float] = field(default_factory=lambda: {
+        "edge": 10.0, "coqui": 30.0, "pyttsx3": 15.0, "stub": 5.0,
+    })  # seconds per attempt
+    hedge_requests: bool = True  # fire the next engine once the current one passes its p95
+    hedge_min_samples: int = 10  # successes needed before p95 is trusted (and before an engine is scored)
+    score_preference_margin: float = 0.25  # health score a later engine must gain per step to move ahead
+    max_error_rate: float = 0.5  # rolling error rate above which an engine is skipped
+    failure_cooldown_s: float = 30.0  # circuit-open time after 3 consecutive failures
+    stub_latency_ms: float = 50.0  # StubTTSEngine simulated latency
+
+    # Post-processing (applied to every engine's output)
+    postprocess: bool = True  # enforce sample_rate / loudness / trimming
+    decode_compressed: bool = True  # decode MP3 etc. via soundfile when installed
+    trim_silence: bool = True
+    silence_threshold_dbfs: float = -45.0
+    silence_pad_ms: float = 30.0  # keep a little air around the speech
+    normalize_loudness: bool = True
+    target_rms_dbfs: float = -20.0
+    peak_limit_dbfs: float = -1.0
+
+    # Code-switched text ("我喜欢 Taylor Swift 的歌"): one voice per language run
+    split_mixed_language: bool = True
+    mixed_min_span_chars: int = 3  # shorter English fragments stay with the neighbouring run
+    mixed_gap_ms: float = 40.0  # pause inserted between spliced runs
+
+
+def wav_duration_ms(audio_bytes: bytes) -> Optional[float]:
+    """Read the real duration from a WAV header, or None if it is not a WAV"""
+    try:
+        with wave.open(io.BytesIO(audio_bytes), 'rb') as wav_file:
+            frames = wav_file.getnframes()
+            framerate = wav_file.getframerate()
+            if framerate > 0:
+                return (frames / framerate) * 1000
+    except (wave.Error, EOFError):
+        pass
+    return None
+
+
+def _unlink_quiet(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
 
 class SSMLRenderer:
     """Very simple SSML renderer: split sentences and insert breaks, wrap with prosody."""
@@ -36,9 +102,8 @@ class SSMLRenderer:
     @staticmethod
     def to_ssml(text: str, break_ms: int = 180, rate: str = "+0%", pitch: str = "+0Hz") -> str:
         def split_sentences(s: str):
-            import re
             # Split by Chinese and English punctuation while keeping content
-            parts = re.split(r'([。！？!?；;])', s)
+            parts = SENTENCE_SPLIT_RE.split(s)
             out = []
             for i in range(0, len(parts), 2):
                 seg = parts[i].strip()
@@ -111,6 +176,189 @@ class SimplePhonemizer:
         return phonemes
 
 
+class AudioPostProcessor:
+    """
+    Engine-agnostic output stage: decode -> trim silence -> normalize -> resample
+    Works on numpy views of the engine's bytes; when the audio is already
+    mono 16-bit at the requested rate and nothing needs changing, the
+    original bytes are returned untouched (zero-copy).
+    """
+
+    WAVE_FORMAT_PCM = 0x0001
+    WAVE_FORMAT_IEEE_FLOAT = 0x0003
+    WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+    FRAME_MS = 10  # analysis window for silence detection
+    GAIN_TOLERANCE_DB = 0.5  # skip re-encoding for negligible gain changes
+
+    def __init__(self, config: TTSConfig):
+        self.config = config
+
+    @classmethod
+    def decode_wav(cls, audio_bytes: bytes) -> Optional[Tuple[np.ndarray, int]]:
+        """
+        Parse RIFF/WAVE chunks directly (handles PCM16/32, float32 and
+        WAVE_FORMAT_EXTENSIBLE headers that the wave module rejects)
+        Returns: (samples view shaped [n, channels], sample_rate) or None
+        """
+        if len(audio_bytes) < 12 or audio_bytes[:4] != b'RIFF' or audio_bytes[8:12] != b'WAVE':
+            return None
+        view = memoryview(audio_bytes)
+        pos = 12
+        fmt = None
+        while pos + 8 <= len(audio_bytes):
+            chunk_id = audio_bytes[pos:pos + 4]
+            chunk_size = int.from_bytes(audio_bytes[pos + 4:pos + 8], 'little')
+            body = pos + 8
+            if chunk_id == b'fmt ':
+                tag = int.from_bytes(audio_bytes[body:body + 2], 'little')
+                channels = int.from_bytes(audio_bytes[body + 2:body + 4], 'little')
+                rate = int.from_bytes(audio_bytes[body + 4:body + 8], 'little')
+                bits = int.from_bytes(audio_bytes[body + 14:body + 16], 'little')
+                if tag == cls.WAVE_FORMAT_EXTENSIBLE and chunk_size >= 26:
+                    tag = int.from_bytes(audio_bytes[body + 24:body + 26], 'little')
+                fmt = (tag, channels, rate, bits)
+            elif chunk_id == b'data' and fmt is not None:
+                tag, channels, rate, bits = fmt
+                # Streamed WAVs may carry a placeholder size (0 or 0xFFFFFFFF)
+                end = len(audio_bytes) if chunk_size in (0, 0xFFFFFFFF) else min(len(audio_bytes), body + chunk_size)
+                if tag == cls.WAVE_FORMAT_PCM and bits == 16:
+                    dtype = '<i2'
+                elif tag == cls.WAVE_FORMAT_PCM and bits == 32:
+                    dtype = '<i4'
+                elif tag == cls.WAVE_FORMAT_IEEE_FLOAT and bits == 32:
+                    dtype = '<f4'
+                else:
+                    return None
+                itemsize = np.dtype(dtype).itemsize * max(channels, 1)
+                end -= (end - body) % itemsize
+                samples = np.frombuffer(view[body:end], dtype=dtype)
+                return samples.reshape(-1, max(channels, 1)), rate
+            pos = body + chunk_size + (chunk_size & 1)
+        return None
+
+    def decode(self, audio_bytes: bytes) -> Optional[Tuple[np.ndarray, int]]:
+        """Decode WAV natively; compressed output (Edge MP3) via soundfile if installed"""
+        decoded = self.decode_wav(audio_bytes)
+        if decoded is not None or not self.config.decode_compressed:
+            return decoded
+        try:
+            import soundfile as sf
+            data, rate = sf.read(io.BytesIO(audio_bytes), dtype='int16', always_2d=True)
+            return data, rate
+        except Exception:
+            return None
+
+    @staticmethod
+    def encode_wav(pcm: np.ndarray, sample_rate: int) -> bytes:
+        buf = io.BytesIO()
+        with wave.open(buf, 'wb') as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(sample_rate)
+            wav_file.writeframes(np.ascontiguousarray(pcm, dtype='<i2').tobytes())
+        return buf.getvalue()
+
+    @staticmethod
+    def _to_float_mono(samples: np.ndarray) -> np.ndarray:
+        if samples.dtype == np.int16:
+            data = samples.astype(np.float32) / 32768.0
+        elif samples.dtype.kind == 'i':
+            data = samples.astype(np.float32) / float(np.iinfo(samples.dtype).max)
+        else:
+            data = samples.astype(np.float32, copy=False)
+        return data.mean(axis=1) if data.shape[1] > 1 else data[:, 0]
+
+    def _voiced_bounds(self, mono: np.ndarray, sample_rate: int) -> Tuple[int, int, np.ndarray]:
+        """Return (start, end) sample bounds of non-silent audio plus frame RMS"""
+        win = max(1, int(sample_rate * self.FRAME_MS / 1000))
+        n_frames = len(mono) // win
+        if n_frames == 0:
+            return 0, len(mono), np.zeros(0, dtype=np.float32)
+        frames = mono[:n_frames * win].reshape(n_frames, win)
+        rms = np.sqrt(np.mean(frames * frames, axis=1))
+        threshold = 10 ** (self.config.silence_threshold_dbfs / 20.0)
+        voiced = np.flatnonzero(rms > threshold)
+        if voiced.size == 0:
+            return 0, len(mono), rms
+        pad = int(sample_rate * self.config.silence_pad_ms / 1000)
+        start = max(0, voiced[0] * win - pad)
+        end = min(len(mono), (voiced[-1] + 1) * win + pad)
+        return start, end, rms[voiced]
+
+    @staticmethod
+    def resample(mono: np.ndarray, src_rate: int, dst_rate: int) -> np.ndarray:
+        """Vectorized linear-interpolation resampler (speech-band quality)"""
+        if src_rate == dst_rate or len(mono) == 0:
+            return mono
+        n_out = int(round(len(mono) * dst_rate / src_rate))
+        positions = np.arange(n_out, dtype=np.float64) * (src_rate / dst_rate)
+        return np.interp(positions, np.arange(len(mono), dtype=np.float64), mono).astype(np.float32)
+
+    def to_pcm16(self, audio_bytes: bytes, target_rate: int) -> Optional[np.ndarray]:
+        """Decode to mono int16 at target_rate (a view when nothing changes)"""
+        decoded = self.decode(audio_bytes)
+        if decoded is None:
+            return None
+        samples, src_rate = decoded
+        if samples.dtype == np.int16 and samples.shape[1] == 1 and src_rate == target_rate:
+            return samples[:, 0]
+        mono = self.resample(self._to_float_mono(samples), src_rate, target_rate)
+        return np.clip(mono * 32767.0, -32768, 32767).astype('<i2')
+
+    def process(self, audio_bytes: bytes, target_rate: Optional[int] = None) -> Tuple[bytes, Optional[float], Optional[int], dict]:
+        """
+        Returns: (audio_bytes, duration_ms, sample_rate, stats)
+        duration_ms / sample_rate are None when the input could not be decoded
+        (it is then passed through unchanged)
+        """
+        target_rate = target_rate or self.config.sample_rate
+        decoded = self.decode(audio_bytes)
+        if decoded is None:
+            return audio_bytes, None, None, {"decoded": False}
+        samples, src_rate = decoded
+        stats = {"decoded": True, "source_rate": src_rate, "trimmed_ms": 0.0, "gain_db": 0.0}
+
+        mono = self._to_float_mono(samples)
+        start, end = 0, len(mono)
+        voiced_rms = None
+        if self.config.trim_silence or self.config.normalize_loudness:
+            start, end, voiced_rms = self._voiced_bounds(mono, src_rate)
+        if not self.config.trim_silence:
+            start, end = 0, len(mono)
+        stats["trimmed_ms"] = float((len(mono) - (end - start)) / src_rate * 1000)
+
+        gain = 1.0
+        if self.config.normalize_loudness and voiced_rms is not None and voiced_rms.size:
+            loudness = float(np.sqrt(np.mean(voiced_rms * voiced_rms)))
+            if loudness > 0:
+                gain = (10 ** (self.config.target_rms_dbfs / 20.0)) / loudness
+                peak = float(np.max(np.abs(mono[start:end]))) if end > start else 0.0
+                peak_limit = 10 ** (self.config.peak_limit_dbfs / 20.0)
+                if peak * gain > peak_limit and peak > 0:
+                    gain = peak_limit / peak
+            if abs(20 * np.log10(gain)) < self.GAIN_TOLERANCE_DB:
+                gain = 1.0
+        stats["gain_db"] = round(float(20 * np.log10(gain)), 2)
+
+        untouched = (
+            samples.dtype == np.int16 and samples.shape[1] == 1
+            and src_rate == target_rate and gain == 1.0
+            and start == 0 and end == len(mono)
+            and audio_bytes[:4] == b'RIFF'
+        )
+        if untouched:
+            stats["zero_copy"] = True
+            return audio_bytes, (len(mono) / src_rate) * 1000, src_rate, stats
+
+        out = mono[start:end]
+        if gain != 1.0:
+            out = out * np.float32(gain)
+        out = self.resample(out, src_rate, target_rate)
+        pcm = np.clip(out * 32767.0, -32768, 32767).astype('<i2')
+        stats["zero_copy"] = False
+        return self.encode_wav(pcm, target_rate), (len(pcm) / target_rate) * 1000, target_rate, stats
+
+
 class EdgeTTSEngine:
     """
     Edge TTS engine (Microsoft Azure TTS)
@@ -123,22 +371,19 @@ class EdgeTTSEngine:
 
     def _detect_language(self, text: str) -> str:
         """Detect if text is Chinese or English"""
-        import re
-        # If contains Chinese characters, it's Chinese
-        if re.search(r'[\u4e00-\u9fff]', text):
-            return "zh"
-        return "en"
+        return detect_language(text)
 
-    async def synthesize(self, text: str) -> Tuple[bytes, float]:
+    async def synthesize(self, text: str, language: Optional[str] = None) -> Tuple[bytes, float]:
         """
         Synthesize speech from text
+        language: "zh"/"en" to force a voice (per-span synthesis), else auto-detect
         Returns: (audio_bytes, duration_ms)
         """
         try:
             import edge_tts
 
             # Detect language and choose appropriate voice
-            language = self._detect_language(text)
+            language = language or self._detect_language(text)
             voice = self.config.voice
 
             if language == "zh" and self.config.voice_cn:
@@ -226,26 +471,36 @@ class CoquiTTSEngine:
     """
     Coqui TTS engine with XTTS-v2
     Natural sounding, voice cloning capable
+    tts_to_file() blocks for seconds, so loading and synthesis run on one
+    model thread: the event loop stays free and the router's timeouts and
+    hedges can pre-empt a slow synthesis (which finishes on its thread
+    unobserved; jobs that haven't started yet are dropped).
     """
 
     def __init__(self, config: TTSConfig):
         self.config = config
         self.tts = None
         self.is_ready = False
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="coqui")
+        self._init_lock = threading.Lock()  # the pipeline's init and a lazy first request load one model
 
     def initialize(self):
         """Initialize Coqui TTS engine"""
+        with self._init_lock:
+            if not self.is_ready:
+                self._load()
+
+    def _load(self):
         try:
             import torch
             from TTS.api import TTS
 
             device = "cuda" if torch.cuda.is_available() else "cpu"
 
-            print(f"Loading Coqui TTS model: {self.config.voice}")
+            print(f"Loading Coqui TTS model: {self.config.coqui_model}")
             # Auto-agree to non-commercial CPML license
-            import os
             os.environ["COQUI_TOS_AGREED"] = "1"
-            self.tts = TTS(self.config.voice, progress_bar=False).to(device)
+            self.tts = TTS(self.config.coqui_model, progress_bar=False).to(device)
 
             self.is_ready = True
             print(f"[OK] Coqui TTS initialized on {device}")
@@ -253,35 +508,27 @@ class CoquiTTSEngine:
             print(f"[FAIL] Coqui TTS init error: {e}")
             raise
 
-    async def synthesize(self, text: str) -> Tuple[bytes, float]:
+    async def synthesize(self, text: str, language: Optional[str] = None) -> Tuple[bytes, float]:
         """
-        Synthesize speech from text
+        Synthesize speech from text (on the model thread)
+        language: "zh"/"en" to force a voice (per-span synthesis), else auto-detect
         Returns: (audio_bytes, duration_ms)
         """
+        loop = asyncio.get_running_loop()
         if not self.is_ready:
-            self.initialize()
+            await loop.run_in_executor(self._executor, self.initialize)
+        return await loop.run_in_executor(self._executor, self._synthesize_sync, text, language)
 
+    def _synthesize_sync(self, text: str, language: Optional[str]) -> Tuple[bytes, float]:
         try:
-            import tempfile
-            import os
-            import wave
-            import time
-
             print(f"[Coqui] Synthesizing: '{text[:50]}...'")
             start_time = time.time()
 
             with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as f:
                 temp_path = f.name
 
-            # Auto-detect language (Chinese or English)
-            def detect_language(text):
-                # Simple detection: if contains Chinese characters, use zh-cn
-                import re
-                if re.search(r'[\u4e00-\u9fff]', text):
-                    return "zh-cn"
-                return "en"
-
-            language = detect_language(text)
+            # Auto-detect language (Chinese or English); XTTS wants "zh-cn"
+            language = "zh-cn" if (language or detect_language(text)) == "zh" else "en"
             print(f"[Coqui] Detected language: {language}")
 
             # Choose appropriate speaker_wav based on language
@@ -344,62 +591,336 @@ class CoquiTTSEngine:
 class PyTTSX3Engine:
     """
     pyttsx3 engine (offline, local)
-    Faster but lower quality
+    Faster but lower quality. pyttsx3 is not thread-safe and its
+    runAndWait() blocks, so a single worker thread owns the engine and
+    serves a job queue; callers await futures instead of blocking the loop.
+    If the worker dies the engine is marked not ready and the next request
+    starts a fresh one (queued jobs are kept).
     """
 
+    MAX_BATCH = 8  # jobs rendered per runAndWait() call
+
     def __init__(self, config: TTSConfig):
         self.config = config
         self.engine = None
         self.is_ready = False
+        self._jobs: "queue.Queue[Optional[Tuple[str, concurrent.futures.Future]]]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._started = threading.Event()
+        self._init_error: Optional[BaseException] = None
+        self._init_lock = threading.Lock()  # concurrent first requests start one worker
 
     def initialize(self):
-        """Initialize pyttsx3 engine"""
+        """Start the worker thread and wait until it owns a pyttsx3 engine"""
+        with self._init_lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._started.clear()
+            self._init_error = None
+            self._worker = threading.Thread(target=self._run, name="pyttsx3-worker", daemon=True)
+            self._worker.start()
+            self._started.wait()
+            if self._init_error is not None:
+                print(f"[FAIL] pyttsx3 init error: {self._init_error}")
+                raise self._init_error
+            self.is_ready = True
+            print("[OK] pyttsx3 engine initialized (worker thread)")
+
+    def shutdown(self, timeout: float = 2.0):
+        """Stop the worker thread after the queued jobs are served"""
+        if self._worker is None:
+            return
+        self._jobs.put(None)
+        self._worker.join(timeout=timeout)
+        self._worker = None
+        self.is_ready = False
+
+    def _run(self):
+        """Worker loop: the only thread that ever touches self.engine"""
         try:
             import pyttsx3
             self.engine = pyttsx3.init()
-            self.engine.setProperty('rate', 150)  # Speed
+            self.engine.setProperty('rate', self.config.pyttsx3_rate)  # Speed
             self.engine.setProperty('volume', 1.0)
-            self.is_ready = True
-            print("[OK] pyttsx3 engine initialized")
+            if self.config.pyttsx3_voice:
+                self.engine.setProperty('voice', self.config.pyttsx3_voice)
         except Exception as e:
-            print(f"[FAIL] pyttsx3 init error: {e}")
-            raise
+            self._init_error = e
+            self._started.set()
+            return
+        self._started.set()
+
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            batch = [job]
+            # Drain whatever queued up meanwhile so concurrent requests share one runAndWait()
+            while len(batch) < self.MAX_BATCH:
+                try:
+                    nxt = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    self._jobs.put(None)
+                    break
+                batch.append(nxt)
+            try:
+                self._render_batch(batch)
+            except Exception as e:
+                # The engine is in an unknown state: fail this batch and let the next request restart it
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                with self._init_lock:
+                    self.is_ready = False
+                    self._worker = None
+                print(f"[WARN] pyttsx3 worker stopped, restarting on next request: {e}")
+                return
+
+    def _render_batch(self, batch: List[Tuple[str, "concurrent.futures.Future"]]):
+        """Render a batch of jobs to temp files and resolve their futures"""
+        pending = []
+        for text, future in batch:
+            # Skip jobs whose caller already gave up (cancelled task)
+            if not future.set_running_or_notify_cancel():
+                continue
+            fd, temp_path = tempfile.mkstemp(suffix='.wav')
+            os.close(fd)
+            try:
+                self.engine.save_to_file(text, temp_path)
+            except Exception as e:
+                future.set_exception(e)  # only this job fails
+                _unlink_quiet(temp_path)
+                continue
+            pending.append((text, future, temp_path))
+
+        if not pending:
+            return
+
+        try:
+            self.engine.runAndWait()
+        except Exception as e:
+            for _, future, temp_path in pending:
+                future.set_exception(e)
+                _unlink_quiet(temp_path)
+            raise  # the engine itself failed: restart it
 
-    async def synthesize(self, text: str) -> Tuple[bytes, float]:
+        for text, future, temp_path in pending:
+            try:
+                with open(temp_path, 'rb') as f:
+                    audio_bytes = f.read()
+                duration_ms = wav_duration_ms(audio_bytes)
+                if duration_ms is None:
+                    # Some OS voices (e.g. macOS NSSpeech) write AIFF despite the suffix
+                    duration_ms = len(text) * 60
+                future.set_result((audio_bytes, duration_ms))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                _unlink_quiet(temp_path)
+
+    def submit(self, text: str) -> "concurrent.futures.Future":
+        """Queue a synthesis job; the future resolves to (audio_bytes, duration_ms)"""
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        self._jobs.put((text, future))
+        return future
+
+    async def synthesize(self, text: str, language: Optional[str] = None) -> Tuple[bytes, float]:
         """
-        Synthesize speech from text
+        Synthesize speech from text (single OS voice; language is ignored)
         Returns: (audio_bytes, duration_ms)
         """
         if not self.is_ready:
-            self.initialize()
+            await asyncio.get_running_loop().run_in_executor(None, self.initialize)
 
         try:
-            # Save to temp file
-            import tempfile
-            import os
-
-            with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as f:
-                temp_path = f.name
+            return await asyncio.wrap_future(self.submit(text))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[FAIL] pyttsx3 synthesis error: {e}")
+            raise
 
-            # Generate speech
-            self.engine.save_to_file(text, temp_path)
-            self.engine.runAndWait()
 
-            # Read audio data
-            with open(temp_path, 'rb') as f:
-                audio_bytes = f.read()
+class StubTTSEngine:
+    """
+    Deterministic offline engine (no network, no models)
+    Renders a quiet tone sized to the text. Latency and failures are
+    injectable so failover and load tests can stand in for Edge offline.
+    """
 
-            # Clean up
-            os.unlink(temp_path)
+    def __init__(self, config: TTSConfig, latency_ms: Optional[float] = None, fail_rate: float = 0.0):
+        self.config = config
+        self.latency_ms = config.stub_latency_ms if latency_ms is None else latency_ms
+        self.fail_rate = fail_rate
+        self.is_ready = True
+        self._rng = random.Random(0)
 
-            # Estimate duration
-            duration_ms = len(text) * 60
+    def initialize(self):
+        pass
 
-            return audio_bytes, duration_ms
+    async def synthesize(self, text: str, language: Optional[str] = None) -> Tuple[bytes, float]:
+        """
+        Synthesize a placeholder tone (pitch differs per language so splices are audible)
+        Returns: (audio_bytes, duration_ms)
+        """
+        if self.latency_ms > 0:
+            await asyncio.sleep(self.latency_ms / 1000.0)
+        if self.fail_rate and self._rng.random() < self.fail_rate:
+            raise RuntimeError("stub engine failure (injected)")
+
+        sample_rate = self.config.sample_rate
+        duration_ms = float(max(len(text) * 60, 200))
+        n = int(sample_rate * duration_ms / 1000)
+        t = np.arange(n, dtype=np.float32) / sample_rate
+        freq = 330.0 if language == "zh" else 220.0
+        pcm = (np.sin(2 * np.pi * freq * t) * 0.2 * 32767).astype('<i2')
+
+        buf = io.BytesIO()
+        with wave.open(buf, 'wb') as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(sample_rate)
+            wav_file.writeframes(pcm.tobytes())
+        return buf.getvalue(), duration_ms
+
+
+ENGINE_CLASSES = {
+    "edge": EdgeTTSEngine,
+    "coqui": CoquiTTSEngine,
+    "pyttsx3": PyTTSX3Engine,
+    "stub": StubTTSEngine,
+}
+
+
+class TTSEngineRouter:
+    """
+    Runtime failover across TTS engines
+    - Keeps rolling latency / error stats per engine (resilience.RollingStats)
+    - Routes each request to the best healthy engine by health score,
+      biased towards the configured preference order
+    - Per-engine timeouts; once an engine's latency passes its own p95 the
+      next engine is fired as a hedge and the first success wins
+    """
 
+    def __init__(self, config: TTSConfig, engines: List[Tuple[str, object]]):
+        self.config = config
+        self.engines: Dict[str, object] = dict(engines)
+        self.order: List[str] = [name for name, _ in engines]
+        self.stats: Dict[str, RollingStats] = {
+            name: RollingStats(cooldown_s=config.failure_cooldown_s) for name in self.order
+        }
+        self.hedges_fired = 0
+        self.hedges_won = 0
+        self.failovers = 0
+
+    def _healthy(self, name: str) -> bool:
+        return self.stats[name].is_healthy(max_error_rate=self.config.max_error_rate)
+
+    def _score(self, name: str) -> float:
+        stats = self.stats[name]
+        if len(stats.outcomes) < self.config.hedge_min_samples:
+            return 0.5  # not enough evidence yet: neutral
+        return stats.score()
+
+    def ranked(self) -> List[str]:
+        """Healthy engines by score, unhealthy ones as a last resort (preference order breaks ties)"""
+        margin = self.config.score_preference_margin
+        healthy = sorted(
+            (n for n in self.order if self._healthy(n)),
+            key=lambda n: self._score(n) - margin * self.order.index(n), reverse=True,
+        )
+        return healthy + [n for n in self.order if n not in healthy]
+
+    def _hedge_delay(self, name: str) -> Optional[float]:
+        if not self.config.hedge_requests:
+            return None
+        p95 = self.stats[name].percentile(95, min_samples=self.config.hedge_min_samples)
+        return None if p95 is None else p95 / 1000.0
+
+    async def _call(self, name: str, text: str, language: Optional[str] = None) -> Tuple[str, Tuple[bytes, float]]:
+        engine = self.engines[name]
+        timeout = self.config.engine_timeouts.get(name, 15.0)
+        start = time.time()
+        try:
+            result = await asyncio.wait_for(engine.synthesize(text, language=language), timeout=timeout)
+        except asyncio.CancelledError:
+            raise  # hedge loser: neither a success nor a failure
+        except asyncio.TimeoutError as e:
+            self.stats[name].record_failure(TimeoutError(f"{name} timed out after {timeout}s"))
+            raise TimeoutError(f"{name} timed out after {timeout}s") from e
         except Exception as e:
-            print(f"[FAIL] pyttsx3 synthesis error: {e}")
+            self.stats[name].record_failure(e)
             raise
+        self.stats[name].record_success((time.time() - start) * 1000)
+        return name, result
+
+    async def synthesize(self, text: str, language: Optional[str] = None) -> Tuple[str, bytes, float]:
+        """
+        Synthesize with failover and hedging
+        Returns: (engine_name, audio_bytes, duration_ms)
+        """
+        remaining = self.ranked()
+        errors: List[str] = []
+        first = remaining[0] if remaining else None
+
+        while remaining:
+            primary = remaining.pop(0)
+            tasks = {asyncio.create_task(self._call(primary, text, language))}
+            started = {next(iter(tasks)): (primary, time.time())}
+            hedge_after = self._hedge_delay(primary) if remaining else None
+            hedge_task: Optional[asyncio.Task] = None
+            try:
+                while tasks:
+                    done, _ = await asyncio.wait(tasks, timeout=hedge_after, return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        # Primary is slower than its p95: race the next engine
+                        backup = remaining.pop(0)
+                        print(f"[TTS] {primary} past p95 ({hedge_after * 1000:.0f}ms), hedging with {backup}")
+                        hedge_task = asyncio.create_task(self._call(backup, text, language))
+                        tasks.add(hedge_task)
+                        started[hedge_task] = (backup, time.time())
+                        self.hedges_fired += 1
+                        hedge_after = None
+                        continue
+                    for task in done:
+                        tasks.discard(task)
+                        if task.exception() is None:
+                            name, (audio_bytes, duration_ms) = task.result()
+                            if task is hedge_task:
+                                self.hedges_won += 1
+                            if name != first:
+                                self.failovers += 1
+                            # The loser was at least this slow: keep it out of its own p50/p95 blind spot
+                            for loser in tasks:
+                                if not loser.done():
+                                    loser_name, t0 = started[loser]
+                                    self.stats[loser_name].record_abandoned((time.time() - t0) * 1000)
+                            return name, audio_bytes, duration_ms
+                        errors.append(str(task.exception()))
+                        print(f"[WARN] TTS engine failed, trying next: {task.exception()}")
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+        raise RuntimeError(f"All TTS engines failed: {'; '.join(errors) or 'no engines configured'}")
+
+    def snapshot(self) -> dict:
+        engines = {}
+        for name in self.order:
+            snap = self.stats[name].snapshot()
+            snap["healthy"] = self._healthy(name)
+            snap["timeout_s"] = self.config.engine_timeouts.get(name, 15.0)
+            engines[name] = snap
+        return {
+            "order": self.order,
+            "active": self.ranked()[0] if self.order else None,
+            "hedges_fired": self.hedges_fired,
+            "hedges_won": self.hedges_won,
+            "failovers": self.failovers,
+            "engines": engines,
+        }
 
 
 class TTSPipeline:
@@ -409,62 +930,211 @@ class TTSPipeline:
 
     def __init__(self, config: Optional[TTSConfig] = None):
         self.config = config or TTSConfig()
-        self.engine = None
+        self.engine = None  # primary engine
+        self.router: Optional[TTSEngineRouter] = None
         self.phonemizer = SimplePhonemizer()
+        self.postprocessor = AudioPostProcessor(self.config)
+        self.singleflight = SingleFlight("tts")  # identical concurrent requests share one synthesis
         self.is_ready = False
 
+    async def _init_engine(self, name: str):
+        """Create and initialize one engine off the event loop (model loads block)"""
+        engine_cls = ENGINE_CLASSES.get(name)
+        if name == "remote":
+            # Synthesis on the shared model host (multi-worker mode)
+            from model_host import RemoteTTSEngine as engine_cls
+        if engine_cls is None:
+            raise ValueError(f"Unknown TTS engine: {name}")
+        engine = engine_cls(self.config)
+        init = getattr(engine, "initialize", None)
+        if init is not None:
+            await asyncio.get_running_loop().run_in_executor(None, init)
+        return engine
+
     async def initialize(self):
-        """Initialize TTS engine"""
+        """Initialize the configured engine plus the runtime fallback chain"""
         print(f"Initializing TTS pipeline (engine: {self.config.engine})...")
 
-        try:
-            if self.config.engine == "edge":
-                self.engine = EdgeTTSEngine(self.config)
-                print(f"[OK] Edge TTS initialized (voice: {self.config.voice})")
-                self.is_ready = True
-            elif self.config.engine == "coqui":
-                self.engine = CoquiTTSEngine(self.config)
-                self.engine.initialize()
-                self.is_ready = True
-            elif self.config.engine == "pyttsx3":
-                self.engine = PyTTSX3Engine(self.config)
-                self.engine.initialize()
-                self.is_ready = True
-            else:
-                raise ValueError(f"Unknown TTS engine: {self.config.engine}")
+        chain: List[str] = []
+        for name in [self.config.engine] + list(self.config.fallback_engines):
+            if name not in chain:
+                chain.append(name)
 
-        except Exception as e:
-            print(f"[FAIL] TTS initialization failed: {e}")
-            # Fallback to edge TTS (most reliable)
+        engines: List[Tuple[str, object]] = []
+        for name in chain:
             try:
-                print("[WARN] Falling back to Edge TTS")
-                self.config.engine = "edge"
-                self.engine = EdgeTTSEngine(self.config)
-                self.is_ready = True
-                print("[OK] Edge TTS fallback initialized")
-            except:
-                raise
+                engine = await self._init_engine(name)
+                engines.append((name, engine))
+                print(f"[OK] TTS engine ready: {name}")
+            except Exception as e:
+                level = "FAIL" if name == self.config.engine else "WARN"
+                print(f"[{level}] TTS engine '{name}' unavailable: {e}")
+
+        if not engines:
+            raise RuntimeError("No TTS engine could be initialized")
+
+        if engines[0][0] != self.config.engine:
+            print(f"[WARN] Falling back to {engines[0][0]} TTS")
+        self.engine = engines[0][1]
+        self.router = TTSEngineRouter(self.config, engines)
+        self.is_ready = True
+        print(f"[OK] TTS failover chain: {' -> '.join(self.router.order)}")
+
+    def _language_runs(self, text: str) -> List[Tuple[str, str]]:
+        """
+        Split text into per-language runs worth synthesizing separately
+        Returns [] when one call is enough (single language, or no distinct
+        zh/en voices configured). Tiny English fragments ("OK", "A") stay
+        with their neighbour instead of costing an extra request.
+        """
+        cfg = self.config
+        distinct_voices = (
+            (cfg.voice_cn and cfg.voice_en and cfg.voice_cn != cfg.voice_en)
+            or (cfg.speaker_wav_cn and cfg.speaker_wav_en and cfg.speaker_wav_cn != cfg.speaker_wav_en)
+        )
+        if not cfg.split_mixed_language or not distinct_voices:
+            return []
+
+        runs: List[List[str]] = []
+        for lang, span in split_language_spans(text):
+            small = lang == "en" and len(LATIN_RE.findall(span)) < cfg.mixed_min_span_chars
+            if runs and (runs[-1][0] == lang or small):
+                runs[-1][1] += span
+            else:
+                runs.append([lang, span])
+        # A tiny leading English fragment joins the following run
+        if len(runs) > 1 and runs[0][0] == "en" and len(LATIN_RE.findall(runs[0][1])) < cfg.mixed_min_span_chars:
+            runs[1][1] = runs[0][1] + runs[1][1]
+            runs.pop(0)
+        runs = [r for r in runs if r[1].strip()]
+        return [(lang, span) for lang, span in runs] if len(runs) > 1 else []
+
+    async def _synthesize_single(self, text: str, language: Optional[str], out_rate: int) -> Tuple[str, bytes, float, int, dict]:
+        """One engine call plus post-processing. Returns (engine, audio, duration_ms, rate, stats)"""
+        engine_name, audio_bytes, duration_ms = await self.router.synthesize(text, language=language)
+
+        # Normalize format/loudness and trim silence so timing matches what is heard
+        rate = out_rate
+        post_stats = {}
+        if self.config.postprocess:
+            post_start = time.time()
+            audio_bytes, post_duration, post_rate, post_stats = self.postprocessor.process(audio_bytes, out_rate)
+            post_stats["postprocess_ms"] = (time.time() - post_start) * 1000
+            if post_duration is not None:
+                duration_ms, rate = post_duration, post_rate
+            else:
+                rate = self.config.sample_rate
+        return engine_name, audio_bytes, duration_ms, rate, post_stats
+
+    async def _synthesize_mixed(self, runs: List[Tuple[str, str]], out_rate: int) -> Optional[dict]:
+        """
+        Synthesize each language run with its own voice concurrently and
+        splice the PCM in order. Returns None if any run is not decodable
+        (caller falls back to a single call).
+        """
+        tasks = [asyncio.create_task(self._synthesize_single(span, lang, out_rate)) for lang, span in runs]
+        try:
+            results = await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()  # one failed run voids the splice: stop its siblings
+
+        gap = np.zeros(int(out_rate * self.config.mixed_gap_ms / 1000), dtype='<i2')
+        pieces: List[np.ndarray] = []
+        phonemes: List[Tuple[str, float, float]] = []
+        spans = []
+        offset_ms = 0.0
+        for (lang, span), (engine_name, audio_bytes, _, _, _) in zip(runs, results):
+            pcm = self.postprocessor.to_pcm16(audio_bytes, out_rate)
+            if pcm is None:
+                return None
+            if pieces and len(gap):
+                pieces.append(gap)
+                offset_ms += self.config.mixed_gap_ms
+            span_ms = len(pcm) / out_rate * 1000
+            # Phoneme timing stays continuous across splices
+            phonemes.extend(
+                (ph, start + offset_ms, end + offset_ms)
+                for ph, start, end in self.phonemizer.estimate_phonemes(span, span_ms)
+            )
+            spans.append({"language": lang, "text": span, "engine": engine_name,
+                          "start_ms": offset_ms, "duration_ms": span_ms})
+            pieces.append(pcm)
+            offset_ms += span_ms
+
+        engines = sorted({span["engine"] for span in spans})
+        post_stats = [stats for *_, stats in results]
+        return {
+            "audio": AudioPostProcessor.encode_wav(np.concatenate(pieces), out_rate),
+            "duration_ms": offset_ms,
+            "phonemes": phonemes,
+            "sample_rate": out_rate,
+            "engine": "+".join(engines),
+            "spans": spans,
+            "postprocess": {
+                "decoded": all(stats.get("decoded", False) for stats in post_stats),
+                "trimmed_ms": sum(stats.get("trimmed_ms", 0.0) for stats in post_stats),
+                "postprocess_ms": sum(stats.get("postprocess_ms", 0.0) for stats in post_stats),
+                "spans": post_stats,
+            },
+        }
+
+    async def synthesize_with_phonemes(self, text: str, sample_rate: Optional[int] = None) -> dict:
+        """
+        Synthesize speech with phoneme timing (coalesced)
+        Concurrent calls with the same text, output rate and voice settings
+        share one synthesis; each caller gets its own copy of the result dict.
+        """
+        if not self.is_ready:
+            raise RuntimeError("TTS pipeline not initialized")
+        out_rate = sample_rate or self.config.sample_rate
+        cfg = self.config
+        key = (text, out_rate, cfg.voice, cfg.voice_cn, cfg.voice_en, cfg.rate, cfg.pitch)
+        result = await self.singleflight.do(key, lambda: self._synthesize_with_phonemes(text, out_rate))
+        return dict(result)
 
-    async def synthesize_with_phonemes(self, text: str) -> dict:
+    async def _synthesize_with_phonemes(self, text: str, sample_rate: Optional[int] = None) -> dict:
         """
         Synthesize speech and extract phonemes
+        Mixed zh/en text is synthesized per language run with the matching
+        voice and spliced into one clip.
+
+        Args:
+            text: Text to speak
+            sample_rate: Output rate requested by the session (default: config.sample_rate)
 
         Returns:
             {
                 "audio": bytes,
                 "duration_ms": float,
                 "phonemes": [(phoneme, start_ms, end_ms), ...],
-                "tts_latency_ms": float
+                "tts_latency_ms": float,
+                "sample_rate": int,
+                "engine": str
             }
         """
         if not self.is_ready:
             raise RuntimeError("TTS pipeline not initialized")
 
         start_time = time.time()
+        out_rate = sample_rate or self.config.sample_rate
 
         try:
-            # Synthesize audio
-            audio_bytes, duration_ms = await self.engine.synthesize(text)
+            runs = self._language_runs(text)
+            if runs:
+                try:
+                    result = await self._synthesize_mixed(runs, out_rate)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"[WARN] Mixed-language synthesis failed, using one voice: {e}")
+                    result = None
+                if result is not None:
+                    result["tts_latency_ms"] = (time.time() - start_time) * 1000
+                    return result
+
+            # Synthesize audio on the best healthy engine
+            engine_name, audio_bytes, duration_ms, rate, post_stats = await self._synthesize_single(text, None, out_rate)
 
             # Estimate phonemes
             phonemes = self.phonemizer.estimate_phonemes(text, duration_ms)
@@ -477,13 +1147,21 @@ class TTSPipeline:
                 "duration_ms": duration_ms,
                 "phonemes": phonemes,
                 "tts_latency_ms": tts_latency_ms,
-                "sample_rate": self.config.sample_rate
+                "sample_rate": rate,
+                "engine": engine_name,
+                "postprocess": post_stats
             }
 
         except Exception as e:
             print(f"[FAIL] TTS synthesis error: {e}")
             raise
 
+    def get_health(self) -> dict:
+        """Router state for /health"""
+        if not self.router:
+            return {}
+        return self.router.snapshot()
+
 
 # Testing
 async def test_tts_pipeline():
@@ -528,5 +1206,43 @@ async def test_tts_pipeline():
     print("=" * 60)
 
 
+async def test_engine_failover():
+    """Offline failover test: a stub stands in for Edge and starts failing"""
+    print("=" * 60)
+    print("Testing TTS Engine Failover (offline)")
+    print("=" * 60)
+
+    config = TTSConfig(engine="stub", fallback_engines=[], stub_latency_ms=20, hedge_min_samples=5)
+    fake_edge = StubTTSEngine(config, latency_ms=20)
+    backup = StubTTSEngine(config, latency_ms=40)
+    pipeline = TTSPipeline(config)
+    pipeline.router = TTSEngineRouter(config, [("edge", fake_edge), ("pyttsx3", backup)])
+    pipeline.engine = fake_edge
+    pipeline.is_ready = True
+
+    for i in range(6):
+        result = await pipeline.synthesize_with_phonemes(f"Healthy turn {i}")
+        print(f"[Turn {i}] engine={result['engine']} latency={result['tts_latency_ms']:.0f}ms")
+
+    print("\n[Inject] Edge outage")
+    fake_edge.fail_rate = 1.0
+    for i in range(4):
+        result = await pipeline.synthesize_with_phonemes(f"Outage turn {i}")
+        print(f"[Turn {i}] engine={result['engine']}")
+
+    print("\n[Inject] Edge slow (past p95) -> hedge")
+    fake_edge.fail_rate = 0.0
+    fake_edge.latency_ms = 500
+    pipeline.router.stats["edge"].opened_at = None
+    result = await pipeline.synthesize_with_phonemes("Slow turn")
+    print(f"[Slow] engine={result['engine']} latency={result['tts_latency_ms']:.0f}ms")
+
+    print(json.dumps(pipeline.get_health(), indent=2))
+
+
 if __name__ == "__main__":
-    asyncio.run(test_tts_pipeline())
+    import sys
+    if "--failover" in sys.argv:
+        asyncio.run(test_engine_failover())
+    else:
+        asyncio.run(test_tts_pipeline())
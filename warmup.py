@@ -0,0 +1,134 @@
+"""
+Model warm-up for Ani v0
+Runs throwaway inference through each loaded model before the server reports
+ready, so lazy kernel init / allocator growth happens at boot instead of on
+the first user's turn. Each routine returns first-call vs steady-state timings
+for the startup timeline.
+"""
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, List
+
+import numpy as np
+
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() in {"1", "true", "yes", "on"}
+
+
+@dataclass
+class WarmupConfig:
+    """What to warm up (ANI_WARMUP, ANI_WARMUP_LLM, ANI_WARMUP_ROUNDS)"""
+    enabled: bool = True
+    audio: bool = True
+    tts: bool = True
+    llm: bool = False  # costs a real request on paid backends
+    rounds: int = 3  # passes per audio model; the first is the slow one
+    tts_phrases: tuple = ("你好呀", "Hi there!")  # TTS: the first, once per engine
+
+    @classmethod
+    def from_env(cls) -> "WarmupConfig":
+        config = cls()
+        config.enabled = _env_flag("ANI_WARMUP", "1")
+        config.audio = _env_flag("ANI_WARMUP_AUDIO", "1")
+        config.tts = _env_flag("ANI_WARMUP_TTS", "1")
+        config.llm = _env_flag("ANI_WARMUP_LLM", "0")
+        try:
+            config.rounds = max(1, int(os.getenv("ANI_WARMUP_ROUNDS", config.rounds)))
+        except ValueError:
+            pass
+        return config
+
+
+def _timings(samples: List[float]) -> Dict[str, float]:
+    steady = samples[1:] or samples
+    return {
+        "first_ms": round(samples[0], 1),
+        "steady_ms": round(sorted(steady)[len(steady) // 2], 1),
+        "passes": len(samples),
+    }
+
+
+def _test_signals(sample_rate: int, seconds: float) -> List[np.ndarray]:
+    """Silence and a short voiced-ish tone (float32, like the live path)"""
+    n = int(sample_rate * seconds)
+    t = np.arange(n, dtype=np.float32) / sample_rate
+    tone = (0.3 * np.sin(2 * np.pi * 220 * t) * np.sin(2 * np.pi * 3 * t) ** 2).astype(np.float32)
+    return [np.zeros(n, dtype=np.float32), tone]
+
+
+async def warm_vad(vad, config: WarmupConfig, sample_rate: int = 16000, chunk_size: int = 512) -> Dict[str, float]:
+    loop = asyncio.get_running_loop()
+    chunks = [sig[:chunk_size] for sig in _test_signals(sample_rate, chunk_size / sample_rate)]
+    local = getattr(vad, "model", None) is not None
+    samples = []
+    for i in range(config.rounds * len(chunks)):
+        chunk = chunks[i % len(chunks)]
+        start = time.perf_counter()
+        if local:
+            await loop.run_in_executor(None, vad.detect_speech, chunk)
+        else:
+            await vad.detect_speech_async(chunk)
+        samples.append((time.perf_counter() - start) * 1000)
+    # Silero carries recurrent state between chunks; don't leak warm-up audio into the first session
+    reset = getattr(getattr(vad, "model", None), "reset_states", None)
+    if callable(reset):
+        reset()
+    return _timings(samples)
+
+
+async def warm_stt(stt, config: WarmupConfig, sample_rate: int = 16000) -> Dict[str, float]:
+    signals = _test_signals(sample_rate, 1.0)
+    samples = []
+    for i in range(max(2, config.rounds - 1)):  # STT passes are expensive
+        audio = signals[i % len(signals)]
+        start = time.perf_counter()
+        await stt.transcribe(audio, language="zh")  # local decodes run on the STT thread
+        samples.append((time.perf_counter() - start) * 1000)
+    return _timings(samples)
+
+
+async def warm_audio(audio_pipeline, config: WarmupConfig) -> Dict[str, dict]:
+    cfg = audio_pipeline.config
+    return {
+        "vad": await warm_vad(audio_pipeline.vad, config, cfg.sample_rate, cfg.chunk_size),
+        "stt": await warm_stt(audio_pipeline.stt, config, cfg.sample_rate),
+    }
+
+
+async def warm_tts(tts_pipeline, config: WarmupConfig) -> Dict[str, dict]:
+    """
+    One short phrase per engine in the failover chain: a fallback is only needed
+    when the primary is failing, which is the worst time for a cold start.
+    Engines are called directly so warm-up latencies stay out of the router's health stats.
+    """
+    router = getattr(tts_pipeline, "router", None)
+    engines = list(router.engines.items()) if router is not None else [(tts_pipeline.config.engine, tts_pipeline.engine)]
+    phrase = config.tts_phrases[0]
+    results: Dict[str, dict] = {}
+    for name, engine in engines:
+        timeout = tts_pipeline.config.engine_timeouts.get(name, 15.0)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(engine.synthesize(phrase), timeout=timeout)
+            results[name] = {"first_ms": round((time.perf_counter() - start) * 1000, 1)}
+        except Exception as e:
+            results[name] = {"error": f"{type(e).__name__}: {e}"[:120]}
+    return results
+
+
+async def warm_llm(llm_pipeline, config: WarmupConfig) -> Dict[str, float]:
+    """
+    One tiny request: opens the HTTP connection / loads the model (Ollama).
+    Sent with the static prompt prefix so the backend's prefix cache is primed too.
+    """
+    prefix = llm_pipeline.static_prefix()
+    prompt = (
+        'Reply with exactly this JSON: {"utterance": "ok", '
+        '"emote": {"type": "neutral", "intensity": 0.0}, "intent": "SMALL_TALK"}'
+    )
+    start = time.perf_counter()
+    await llm_pipeline.backend.generate(prompt, schema=llm_pipeline.response_schema, prefix=prefix)
+    return _timings([(time.perf_counter() - start) * 1000])
@@ -0,0 +1,260 @@
+"""
+Per-connection websocket writer for Ani v0
+Turn code enqueues messages and moves on; a single writer task drains a
+bounded priority queue so one slow client never holds up server-side work.
+- Control events (state, emotion, gesture, interrupted) jump ahead of bulk audio;
+  a newer state/emotion/gesture replaces a queued one (only the latest matters),
+  and the control queue itself is bounded
+- Audio frames beyond the backlog limit, or older than max age, are dropped
+- Queue depth, queue wait and send latency are tracked per connection
+"""
+import asyncio
+import itertools
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Optional
+import weakref
+
+
+PRIORITY_CONTROL = 0
+PRIORITY_META = 1
+PRIORITY_AUDIO = 2
+
+CONTROL_TYPES = {"state", "emotion", "gesture", "interrupted", "error", "session_config"}
+COALESCED_TYPES = {"state", "emotion", "gesture"}  # latest wins: a queued older one is stale
+
+
+def default_priority(message: Dict[str, Any]) -> int:
+    msg_type = message.get("type")
+    if msg_type == "audio":
+        return PRIORITY_AUDIO
+    if msg_type in CONTROL_TYPES:
+        return PRIORITY_CONTROL
+    return PRIORITY_META
+
+
+@dataclass
+class SenderConfig:
+    """Writer limits"""
+    max_queue: int = 64  # total queued messages per connection
+    max_audio_backlog: int = 4  # audio frames allowed to wait; older ones are stale
+    max_control: int = 16  # control events allowed to wait; the oldest go first beyond this
+    audio_max_age_s: float = 5.0  # audio older than this is not worth sending
+    latency_window: int = 200  # samples kept for send-latency percentiles
+
+
+@dataclass
+class _Outgoing:
+    message: Dict[str, Any]
+    priority: int
+    enqueued_at: float
+    turn_id: Optional[int] = None
+    on_sent: Optional[Callable[[], None]] = None
+
+
+@dataclass
+class SenderStats:
+    sent: int = 0
+    dropped_audio: int = 0
+    dropped_other: int = 0
+    dropped_turn: int = 0
+    dropped_control: int = 0
+    coalesced: int = 0
+    send_errors: int = 0
+    max_depth: int = 0
+    send_ms: Deque[float] = field(default_factory=lambda: deque(maxlen=200))
+    wait_ms: Deque[float] = field(default_factory=lambda: deque(maxlen=200))
+
+
+def _pct(values: Deque[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(p / 100.0 * (len(ordered) - 1)))], 2)
+
+
+class ConnectionSender:
+    """Bounded, prioritized writer task for one websocket"""
+
+    _ids = itertools.count(1)
+    active: "weakref.WeakSet[ConnectionSender]" = weakref.WeakSet()
+
+    def __init__(self, websocket, config: Optional[SenderConfig] = None):
+        self.websocket = websocket
+        self.config = config or SenderConfig()
+        self.connection_id = next(self._ids)
+        self.queues: Dict[int, Deque[_Outgoing]] = {
+            PRIORITY_CONTROL: deque(),
+            PRIORITY_META: deque(),
+            PRIORITY_AUDIO: deque(),
+        }
+        self.stats = SenderStats(
+            send_ms=deque(maxlen=self.config.latency_window),
+            wait_ms=deque(maxlen=self.config.latency_window),
+        )
+        self.closed = False
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        ConnectionSender.active.add(self)
+
+    @property
+    def depth(self) -> int:
+        return sum(len(q) for q in self.queues.values())
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def send(
+        self,
+        message: Dict[str, Any],
+        priority: Optional[int] = None,
+        turn_id: Optional[int] = None,
+        on_sent: Optional[Callable[[], None]] = None,
+    ) -> bool:
+        """Enqueue without waiting. Returns False if the message was dropped."""
+        if self.closed:
+            return False
+        prio = default_priority(message) if priority is None else priority
+        item = _Outgoing(message, prio, time.time(), turn_id, on_sent)
+        queue = self.queues[prio]
+        msg_type = message.get("type")
+        if prio == PRIORITY_CONTROL and msg_type in COALESCED_TYPES and queue:
+            kept = deque(queued for queued in queue if queued.message.get("type") != msg_type)
+            self.stats.coalesced += len(queue) - len(kept)
+            queue = self.queues[prio] = kept
+        queue.append(item)
+
+        if prio == PRIORITY_CONTROL:
+            # A client this far behind can't use old events either (the latest state etc. always stays)
+            while len(queue) > self.config.max_control:
+                oldest = next((queued for queued in queue if queued.message.get("type") not in COALESCED_TYPES), None)
+                if oldest is None:
+                    break
+                queue.remove(oldest)
+                self.stats.dropped_control += 1
+        elif prio == PRIORITY_AUDIO:
+            # Client is too far behind: the oldest audio is stale
+            while len(queue) > self.config.max_audio_backlog:
+                queue.popleft()
+                self.stats.dropped_audio += 1
+        while self.depth > self.config.max_queue and self._evict_one():
+            pass
+
+        self.stats.max_depth = max(self.stats.max_depth, self.depth)
+        self._wakeup.set()
+        return any(queued is item for queued in queue)
+
+    def _evict_one(self) -> bool:
+        """Drop the least valuable queued item (oldest audio, then oldest metadata)"""
+        if self.queues[PRIORITY_AUDIO]:
+            self.queues[PRIORITY_AUDIO].popleft()
+            self.stats.dropped_audio += 1
+            return True
+        if self.queues[PRIORITY_META]:
+            self.queues[PRIORITY_META].popleft()
+            self.stats.dropped_other += 1
+            return True
+        return False  # control events are bounded (and coalesced) separately
+
+    def drop_turn(self, turn_id: int) -> int:
+        """Discard queued audio/metadata of an interrupted turn"""
+        dropped = 0
+        for prio in (PRIORITY_META, PRIORITY_AUDIO):
+            queue = self.queues[prio]
+            keep = deque(item for item in queue if item.turn_id != turn_id)
+            dropped += len(queue) - len(keep)
+            self.queues[prio] = keep
+        self.stats.dropped_turn += dropped
+        return dropped
+
+    def _pop(self) -> Optional[_Outgoing]:
+        if self.queues[PRIORITY_CONTROL]:
+            return self.queues[PRIORITY_CONTROL].popleft()
+        meta, audio = self.queues[PRIORITY_META], self.queues[PRIORITY_AUDIO]
+        if meta:
+            head = meta[0]
+            # A turn's summary never overtakes that turn's own audio
+            if head.turn_id is None or not any(a.turn_id == head.turn_id for a in audio):
+                return meta.popleft()
+        if audio:
+            return audio.popleft()
+        return meta.popleft() if meta else None
+
+    async def _run(self):
+        while not self.closed:
+            item = self._pop()
+            if item is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            waited = time.time() - item.enqueued_at
+            if item.priority == PRIORITY_AUDIO and waited > self.config.audio_max_age_s:
+                self.stats.dropped_audio += 1
+                continue
+            start = time.time()
+            try:
+                await self.websocket.send_json(item.message)
+            except Exception as e:
+                self.stats.send_errors += 1
+                print(f"[WARN] Send failed on connection {self.connection_id}: {e}")
+                self.closed = True
+                break
+            self.stats.send_ms.append((time.time() - start) * 1000)
+            self.stats.wait_ms.append(waited * 1000)
+            self.stats.sent += 1
+            if item.on_sent is not None:
+                try:
+                    item.on_sent()
+                except Exception:
+                    pass
+
+    async def close(self, flush_timeout: float = 0.5):
+        """Give queued control/metadata a moment to go out, then stop the writer"""
+        if self._task is not None and not self.closed:
+            deadline = time.time() + flush_timeout
+            while self.depth and time.time() < deadline and not self._task.done():
+                await asyncio.sleep(0.01)
+        self.closed = True
+        self._wakeup.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+        ConnectionSender.active.discard(self)
+
+    def snapshot(self) -> dict:
+        s = self.stats
+        return {
+            "connection_id": self.connection_id,
+            "queue_depth": self.depth,
+            "queue_depth_by_priority": {
+                "control": len(self.queues[PRIORITY_CONTROL]),
+                "meta": len(self.queues[PRIORITY_META]),
+                "audio": len(self.queues[PRIORITY_AUDIO]),
+            },
+            "max_depth": s.max_depth,
+            "sent": s.sent,
+            "dropped_audio": s.dropped_audio,
+            "dropped_other": s.dropped_other,
+            "dropped_turn": s.dropped_turn,
+            "dropped_control": s.dropped_control,
+            "coalesced": s.coalesced,
+            "send_errors": s.send_errors,
+            "send_ms_p50": _pct(s.send_ms, 50),
+            "send_ms_p95": _pct(s.send_ms, 95),
+            "queue_wait_ms_p95": _pct(s.wait_ms, 95),
+        }
+
+    @classmethod
+    def snapshot_all(cls) -> dict:
+        conns = [sender.snapshot() for sender in list(cls.active)]
+        return {
+            "connections": len(conns),
+            "queue_depth_total": sum(c["queue_depth"] for c in conns),
+            "dropped_audio_total": sum(c["dropped_audio"] for c in conns),
+            "per_connection": conns,
+        }